@@ -5,16 +5,27 @@ Ejemplo de uso de la API de recomendación de productos
 import requests
 import json
 import argparse
+import time
 
 def train_model():
-    """Entrena el modelo de recomendación"""
+    """Entrena el modelo de recomendación y espera a que termine"""
     url = "http://localhost:8000/api/train/"
     response = requests.get(url)
-    if response.status_code == 200:
-        print("Modelo entrenado correctamente")
-        print(f"Productos disponibles: {response.json()['products']}")
-    else:
+    if response.status_code != 202:
         print(f"Error: {response.json()}")
+        return
+    
+    # El entrenamiento corre en segundo plano: consultar su estado hasta que termine
+    job = response.json()
+    while job['status'] in ('pending', 'running'):
+        print(f"Entrenando... {job['stage'] or ''} {job['progress']:.0%}")
+        time.sleep(1)
+        job = requests.get(job['status_url']).json()
+    
+    if job['status'] == 'succeeded':
+        print(f"Modelo entrenado correctamente (versión {job['version']})")
+    else:
+        print(f"Error: {job['error']}")
 
 def get_recommendations(input_products):
     """Obtiene recomendaciones para los productos de entrada"""
@@ -134,3 +134,147 @@ SWAGGER_SETTINGS = {
     },
     'USE_SESSION_AUTH': False,
 }
+
+# Recommender settings
+RECOMMENDER_DATASET_PATH = BASE_DIR / 'datasets' / 'train_input_target_m2_n>=1.csv'
+
+# Artefacto del modelo entrenado (generado por GET /api/train/ o `manage.py train_recommender`)
+RECOMMENDER_MODEL_PATH = BASE_DIR / 'models' / 'recommender.joblib'
+
+# Descartar el artefacto si el dataset cambió desde que se entrenó
+RECOMMENDER_VERIFY_DATASET_CHECKSUM = True
+
+# Cargar el modelo al arrancar el proceso WSGI/ASGI (con `gunicorn --preload`
+# el modelo se carga una sola vez y se comparte entre workers)
+RECOMMENDER_PRELOAD_MODEL = True
+
+# Mapear en memoria (solo lectura) los arrays del artefacto: todos los workers
+# comparten las mismas páginas y la RAM no crece con el número de workers
+RECOMMENDER_MODEL_MMAP = True
+
+# Número máximo de entradas aceptadas por POST /api/recommendations/batch/
+RECOMMENDER_MAX_BATCH_SIZE = 10000
+
+# Motor de recomendación: 'forest' (un RandomForest por producto) o
+# 'cooccurrence' (reglas de asociación par → producto, mucho más rápido)
+RECOMMENDER_ENGINE = 'forest'
+
+RECOMMENDER_ENGINE_OPTIONS = {
+    'forest': {
+        'n_estimators': 100,
+        'random_state': 42,
+        # Procesos para ajustar los bosques en paralelo (-1 = todos los núcleos)
+        'n_jobs': -1,
+    },
+    'cooccurrence': {
+        # Fracción mínima de veces que el producto acompañó al par
+        'min_confidence': 0.5,
+        # Número mínimo de ejemplos en los que el par y el producto coinciden
+        'min_support': 1,
+    },
+    'embedding': {
+        # Dimensiones de los vectores de producto (SVD truncada de la matriz PPMI de co-compras)
+        'n_components': 64,
+        # Celdas del índice aproximado (None = raíz cuadrada del número de productos)
+        'n_clusters': None,
+        # Celdas visitadas por búsqueda: más celdas, más recall y más latencia
+        'n_probe': 8,
+        # Similitud coseno mínima para recomendar un producto
+        'min_similarity': 0.5,
+        'random_state': 42,
+    },
+}
+
+# Tabla top-K precalculada tras el entrenamiento para cada par de entrada observado
+# al menos RECOMMENDER_TOPK_MIN_PAIR_COUNT veces; el motor solo se usa con pares nuevos
+RECOMMENDER_TOPK_ENABLED = True
+RECOMMENDER_TOPK_SIZE = 10
+RECOMMENDER_TOPK_MIN_PAIR_COUNT = 1
+
+# Recomendaciones de respaldo (entradas sin candidatos o con productos desconocidos):
+# productos más comprados junto a cada producto y más populares, hasta este número
+RECOMMENDER_FALLBACK_SIZE = 20
+
+# Número de recomendaciones por entrada cuando la petición no indica `k`, y máximo permitido
+RECOMMENDER_DEFAULT_K = 10
+RECOMMENDER_MAX_K = 100
+
+# Caché de respuestas por par de entrada (en cualquier orden) y versión del modelo.
+# Con RECOMMENDER_CACHE_ALIAS apuntando a un alias de CACHES, la caché local se
+# respalda en ese backend (p. ej. FileBasedCache compartida entre workers).
+RECOMMENDER_CACHE_ENABLED = True
+RECOMMENDER_CACHE_MAX_SIZE = 100000
+RECOMMENDER_CACHE_TTL = 3600  # segundos
+RECOMMENDER_CACHE_ALIAS = None
+
+# Registro de recomendaciones (ProductRecommendation): en segundo plano y por lotes.
+# Se escribe cada RECOMMENDER_LOG_BATCH_SIZE filas o RECOMMENDER_LOG_FLUSH_INTERVAL
+# segundos; con la cola llena, 'drop' descarta la fila y 'block' espera hasta
+# RECOMMENDER_LOG_BLOCK_TIMEOUT segundos antes de descartarla.
+RECOMMENDER_LOG_ASYNC = True
+RECOMMENDER_LOG_QUEUE_SIZE = 10000
+RECOMMENDER_LOG_BATCH_SIZE = 500
+RECOMMENDER_LOG_FLUSH_INTERVAL = 1.0  # segundos
+RECOMMENDER_LOG_FULL_POLICY = 'drop'
+RECOMMENDER_LOG_BLOCK_TIMEOUT = 1.0  # segundos
+
+# Filas del CSV leídas por bloque durante el entrenamiento (None = todo de una vez)
+RECOMMENDER_CSV_CHUNK_SIZE = 100000
+
+# Entrenar directamente desde líneas de pedido (pedido_id, producto_id) en lugar del
+# CSV input/target: las combinaciones m=2 se generan al vuelo y los ejemplos
+# idénticos se agrupan con su frecuencia como peso. Las líneas de cada pedido
+# deben ser contiguas en el CSV.
+RECOMMENDER_ORDER_LINES_PATH = None
+RECOMMENDER_ORDER_FIELD = 'pedido_id'
+RECOMMENDER_PRODUCT_FIELD = 'producto_id'
+
+# Máximo de combinaciones de entrada por pedido (muestreadas si hay más; None = todas)
+RECOMMENDER_MAX_COMBINATIONS_PER_ORDER = 100
+
+# refresh_recommender: actualizaciones incrementales (solo filas añadidas al dataset)
+# permitidas antes de forzar un reentrenamiento completo que compacte el modelo
+RECOMMENDER_MAX_INCREMENTAL_UPDATES = 24
+
+# Entrenamiento en segundo plano: 'thread' (mismo proceso) o 'process' (proceso hijo)
+RECOMMENDER_TRAINING_EXECUTOR = 'thread'
+
+# Número de entrenamientos recientes cuyo estado se conserva
+RECOMMENDER_TRAINING_MAX_JOBS = 100
+
+# Cada cuántos segundos comprobar si otro proceso guardó un artefacto más nuevo (0 = nunca)
+RECOMMENDER_RELOAD_INTERVAL = 30
+
+# Imágenes de la visualización del entrenamiento, generadas una vez por versión del modelo (None = solo en memoria)
+RECOMMENDER_VISUALIZATION_DIR = BASE_DIR / 'models' / 'visualizations'
+
+# Medir la memoria máxima de cada etapa del entrenamiento con tracemalloc. Traza todo el
+# proceso, también los hilos que sirven peticiones mientras se reentrena en segundo plano
+# (unas 4 veces más lentas), así que está desactivado para el entrenamiento en el servidor;
+# train_recommender, benchmark_recommender y el ejecutor 'process' lo activan siempre
+RECOMMENDER_TRAINING_TRACE_MEMORY = False
+
+# Fracción de pedidos reservada para medir el modelo entrenado, si el dataset tiene al
+# menos RECOMMENDER_HOLDOUT_MIN_EXAMPLES ejemplos (0 = no medir). Se mide con un motor
+# aparte entrenado sin esos pedidos (un segundo ajuste); el modelo servido usa todos
+RECOMMENDER_HOLDOUT_FRACTION = 0
+RECOMMENDER_HOLDOUT_MIN_EXAMPLES = 1000
+RECOMMENDER_HOLDOUT_MAX_ROWS = 10000
+
+# Direcciones que pueden leer /metrics (formato Prometheus); None = cualquiera
+RECOMMENDER_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Micro-batching de /api/recommendations/: las peticiones concurrentes que esperan al
+# modelo (hasta RECOMMENDER_MICRO_BATCH_MAX_SIZE entradas) se predicen en una sola
+# llamada. Solo agrupa con workers con hilos (gthread) o ASGI; con workers síncronos
+# cada proceso atiende una petición a la vez y no hay nada que agrupar
+RECOMMENDER_MICRO_BATCHING = False
+RECOMMENDER_MICRO_BATCH_MAX_SIZE = 64
+# Segundos que el lote sigue esperando entradas tras la primera; 0 = tomar solo las que
+# ya están en la cola. Las respuestas en caché y de la tabla top-K nunca esperan
+RECOMMENDER_MICRO_BATCH_MAX_WAIT = 0
+
+# Vistas asíncronas (ASGI): hilos que ejecutan la inferencia y peticiones que pueden
+# esperar turno; por encima se responde 429
+RECOMMENDER_INFERENCE_WORKERS = 4
+RECOMMENDER_INFERENCE_QUEUE_SIZE = 64
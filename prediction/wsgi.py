@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'prediction.settings')
 
 application = get_wsgi_application()
+
+# Cargar el modelo de recomendación una vez por proceso, antes de atender peticiones
+from recommender.recommendation import preload_recommendation_system  # noqa: E402
+
+preload_recommendation_system()
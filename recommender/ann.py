@@ -0,0 +1,101 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+class IVFIndex:
+    """Approximate nearest-neighbour index over unit vectors (inverted file)
+
+    The vectors are clustered with spherical k-means and stored contiguously
+    cell by cell (``offsets`` delimits each cell in ``vectors``; ``ids`` are
+    their original rows). A search compares the query with the centroids and
+    then only with the vectors of the ``n_probe`` closest cells, so with about
+    sqrt(n) cells it reads O(sqrt(n)) vectors instead of n. More probes give
+    better recall at a higher latency; probing every cell is an exact search.
+    """
+
+    def __init__(self, centroids, offsets, ids, vectors):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_clusters(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_clusters=None, n_iter=10, random_state=42, batch_size=8192):
+        """Cluster the rows of vectors (float32, unit or zero norm)"""
+        n = len(vectors)
+        if n_clusters is None:
+            n_clusters = int(np.sqrt(n))
+        n_clusters = max(1, min(n_clusters, n))
+        if n == 0:
+            return cls(np.zeros((0, vectors.shape[1]), dtype=np.float32), np.zeros(1, dtype=np.int64),
+                       np.empty(0, dtype=np.int64), vectors)
+
+        rng = np.random.RandomState(random_state)
+        centroids = vectors[rng.choice(n, n_clusters, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = _assign(vectors, centroids, batch_size)
+            # Suma de los vectores de cada celda como un producto disperso
+            members = sp.csr_matrix((np.ones(n, dtype=np.float32), (assign, np.arange(n))), shape=(n_clusters, n))
+            sums = np.asarray(members @ vectors)
+            norms = np.linalg.norm(sums, axis=1)
+            # Una celda vacía conserva su centroide
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        assign = _assign(vectors, centroids, batch_size)
+        ids = np.argsort(assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_clusters))]).astype(np.int64)
+        return cls(centroids.astype(np.float32), offsets, ids.astype(np.int64), np.ascontiguousarray(vectors[ids]))
+
+    def search(self, queries, k, n_probe=8, exclude=None):
+        """Return (ids, scores) of the k most similar vectors to each query
+
+        Rows are sorted best first (dot product; ties by id) and padded with
+        -1 / -inf. ``exclude[q]``, if given, lists ids never returned for
+        query q.
+        """
+        n_queries = len(queries)
+        columns = np.full((n_queries, k), -1, dtype=np.int64)
+        scores = np.full((n_queries, k), -np.inf)
+        if not len(self.ids) or not k:
+            return columns, scores
+
+        n_probe = max(1, min(n_probe, self.n_clusters))
+        cell_scores = queries @ self.centroids.T
+        if n_probe < self.n_clusters:
+            probes = np.argpartition(-cell_scores, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            probes = np.broadcast_to(np.arange(self.n_clusters), cell_scores.shape)
+
+        for q in range(n_queries):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes[q]])
+            if not len(rows):
+                continue
+            candidates = self.ids[rows]
+            similarity = self.vectors[rows] @ queries[q]
+            if exclude is not None:
+                similarity[np.isin(candidates, exclude[q])] = -np.inf
+
+            top = min(k, len(rows))
+            best = np.argpartition(-similarity, top - 1)[:top]
+            best = best[np.lexsort((candidates[best], -similarity[best]))]
+            columns[q, :top] = candidates[best]
+            scores[q, :top] = similarity[best]
+
+        columns[~np.isfinite(scores)] = -1
+        return columns, scores
+
+
+def _assign(vectors, centroids, batch_size):
+    """Index of the most similar centroid of each vector, in batches to bound memory"""
+    return np.concatenate([
+        np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), batch_size)
+    ])
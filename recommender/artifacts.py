@@ -0,0 +1,112 @@
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+import joblib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Versión del formato de artefacto; incrementar ante cambios incompatibles
+ARTIFACT_FORMAT_VERSION = 7
+
+
+class ArtifactError(Exception):
+    """Raised when a model artifact is missing, corrupt or incompatible"""
+
+
+class StaleArtifactError(ArtifactError):
+    """Raised when the dataset an artifact was trained on has changed since"""
+
+    def __init__(self, message, dataset_path):
+        super().__init__(message)
+        self.dataset_path = dataset_path
+
+
+def file_checksum(file_path, chunk_size=1 << 20, limit=None):
+    """Return the SHA-256 hex digest of a file (or of its first ``limit`` bytes), read in chunks"""
+    digest = hashlib.sha256()
+    remaining = limit
+    with open(file_path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def artifact_lock(path):
+    """Hold an exclusive lock shared by every process using the artifact at path
+
+    Blocks until the lock is free. It is an advisory ``flock`` on
+    ``<path>.lock``, so it only excludes other callers of artifact_lock (and
+    is a no-op where fcntl is unavailable).
+    """
+    if fcntl is None:
+        yield
+        return
+
+    lock_path = os.fspath(path) + '.lock'
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_artifact(path, payload):
+    """Atomically write a model artifact to disk"""
+    path = os.fspath(path)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    data = dict(payload)
+    data['format_version'] = ARTIFACT_FORMAT_VERSION
+
+    # Escribir en un archivo temporal y renombrar, para que los workers
+    # nunca lean un artefacto a medio escribir
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        joblib.dump(data, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_artifact(path, mmap_mode=None):
+    """Load a model artifact written by save_artifact
+
+    With ``mmap_mode='r'`` every numpy array of the payload is memory-mapped
+    read-only from the file instead of being copied into the process, so all
+    workers that load the same artifact share its pages through the OS page
+    cache. Artifacts are replaced with ``os.replace``, which leaves the file
+    mapped by running workers intact.
+    """
+    path = os.fspath(path)
+    if not os.path.exists(path):
+        raise ArtifactError(f"No existe el artefacto del modelo: {path}")
+
+    try:
+        data = joblib.load(path, mmap_mode=mmap_mode)
+    except Exception as e:
+        raise ArtifactError(f"No se pudo leer el artefacto {path}: {e}") from e
+
+    version = data.get('format_version') if isinstance(data, dict) else None
+    if version != ARTIFACT_FORMAT_VERSION:
+        raise ArtifactError(
+            f"Formato de artefacto incompatible: {version} "
+            f"(se esperaba {ARTIFACT_FORMAT_VERSION})"
+        )
+    return data
@@ -0,0 +1,155 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from django.conf import settings
+from .metrics import registry
+from .recommendation import recommendation_system
+
+# Marca que detiene el hilo del batcher tras atender la cola
+_STOP = object()
+
+batch_sizes = registry.histogram(
+    'recommender_micro_batch_size',
+    'Distinct inputs ranked per micro-batch',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-input rankings into one ``rank_many`` call
+
+    Inputs in the recommendation cache or the top-K table are answered
+    directly (``system.rank_precomputed``). The rest are queued: a background
+    thread takes everything already waiting, up to ``max_batch_size`` inputs,
+    and ranks it in one model call per (k, min_score). With ``max_wait`` > 0
+    it keeps collecting for up to that many seconds after the first input;
+    with 0 (the default) it does not wait for more to arrive. Inputs queued
+    while a batch is being ranked form the next one, so batches grow under
+    concurrent load even without a wait. Identical inputs in the same batch
+    are ranked once and share the result.
+    """
+
+    def __init__(self, system, max_batch_size=64, max_wait=0, enabled=True):
+        self.system = system
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, system):
+        return cls(
+            system,
+            max_batch_size=settings.RECOMMENDER_MICRO_BATCH_MAX_SIZE,
+            max_wait=settings.RECOMMENDER_MICRO_BATCH_MAX_WAIT,
+            enabled=settings.RECOMMENDER_MICRO_BATCHING,
+        )
+
+    def submit(self, input_products, k=None, min_score=None):
+        """Queue one input and return a Future of its (product IDs, scores)"""
+        future = Future()
+        if not self.enabled:
+            try:
+                [result] = self.system.rank_many([input_products], k=k, min_score=min_score)
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        # Aciertos de caché y pares precalculados: sin cola ni llamada al modelo
+        try:
+            result = self.system.rank_precomputed(input_products, k=k, min_score=min_score)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        if result is not None:
+            future.set_result(result)
+            return future
+
+        self._start()
+        self._queue.put((list(input_products), k, min_score, future))
+        return future
+
+    def rank(self, input_products, k=None, min_score=None):
+        """Same result as ``system.rank_many([input_products], k, min_score)[0]``"""
+        products, scores = self.submit(input_products, k=k, min_score=min_score).result()
+        # Copias: el resultado puede compartirse con otras peticiones idénticas
+        return list(products), list(scores)
+
+    def stop(self, timeout=None):
+        """Rank the pending inputs and stop the background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            # Tras un fork el hilo del proceso padre no existe en el hijo
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='recommendation-micro-batcher', daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            # Con max_wait = 0 el lote son las entradas que ya estaban en la cola
+            deadline = time.monotonic() + self.max_wait
+            batch = [item]
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        # (k, min_score) -> {entrada normalizada -> (entrada, [futures])}
+        groups = {}
+        for input_products, k, min_score, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            pending = groups.setdefault((k, min_score), {})
+            key = tuple(sorted(set(input_products)))
+            pending.setdefault(key, (input_products, []))[1].append(future)
+
+        for (k, min_score), pending in groups.items():
+            inputs = [input_products for input_products, _ in pending.values()]
+            batch_sizes.observe(len(inputs))
+            try:
+                # rank_precomputed ya consultó la caché para estas entradas
+                results = self.system.rank_many(inputs, k=k, min_score=min_score, lookup_cache=False)
+            except Exception as e:
+                # Cada petición recibe el error y lo gestiona su vista
+                for _, futures in pending.values():
+                    for future in futures:
+                        future.set_exception(e)
+                continue
+
+            for (_, futures), (products, scores) in zip(pending.values(), results):
+                result = (tuple(products), tuple(scores))
+                for future in futures:
+                    future.set_result(result)
+
+
+# Singleton instance
+recommendation_batcher = MicroBatcher.from_settings(recommendation_system)
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+
+def cache_key(input_products, version, k, min_score):
+    """Canonical key: the same products in any order share one entry per model version"""
+    products = ','.join(str(p) for p in sorted(input_products))
+    return f"recommender:{version}:{products}:{k}:{min_score}"
+
+
+class RecommendationCache:
+    """In-process LRU cache with TTL, optionally backed by a Django cache
+
+    Entries are looked up in the local LRU first and then, if ``alias`` names
+    one of the ``CACHES``, in that backend (shared across workers when it is a
+    file or network cache). Keys include the model version, so a retrained
+    model never reads entries produced by the previous one.
+    """
+
+    def __init__(self, max_size=100000, ttl=3600, alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_size=settings.RECOMMENDER_CACHE_MAX_SIZE,
+            ttl=settings.RECOMMENDER_CACHE_TTL,
+            alias=settings.RECOMMENDER_CACHE_ALIAS,
+        )
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = caches[self.alias].get(key) if self.alias else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._set_local(key, value, now)
+        return value
+
+    def set(self, key, value):
+        self._set_local(key, value, time.monotonic())
+        if self.alias:
+            caches[self.alias].set(key, value, timeout=self.ttl)
+
+    def _set_local(self, key, value, now):
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop the local entries; shared entries expire or are skipped by version"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
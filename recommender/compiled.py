@@ -0,0 +1,123 @@
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+from sklearn.utils.fixes import parse_version
+
+# Desde scikit-learn 1.4 tree_.value ya guarda proporciones y predict_proba no las renormaliza
+_VALUES_ARE_PROPORTIONS = parse_version(sklearn.__version__) >= parse_version('1.4')
+
+
+class CompiledForest:
+    """All trees of the per-product forests flattened into contiguous arrays
+
+    Node ``n`` of the flattened arrays tests ``X[:, feature[n]] <= threshold[n]``
+    and moves to ``left[n]`` or ``right[n]``; leaves point to themselves, so
+    every row can advance through every tree in lockstep for ``max_depth``
+    steps with a handful of numpy operations. ``leaf_value[n]`` is the
+    probability of class 1 that the leaf contributes to its forest. Tree t of
+    forest c is ``roots[c * n_estimators + t]``.
+
+    Scores are accumulated tree by tree in the order sklearn uses, so they
+    are bit-for-bit equal to ``RandomForestClassifier.predict_proba``.
+    """
+
+    def __init__(self, n_features, n_estimators, roots, feature, threshold, left, right, leaf_value, max_depth):
+        self.n_features = n_features
+        self.n_estimators = n_estimators
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf_value = leaf_value
+        self.max_depth = max_depth
+
+    @property
+    def n_forests(self):
+        return len(self.roots) // max(self.n_estimators, 1)
+
+    @classmethod
+    def from_estimators(cls, estimators, n_features):
+        """Flatten a list of fitted RandomForestClassifier (one per product)"""
+        n_estimators = len(estimators[0].estimators_) if estimators else 0
+        roots, features, thresholds, lefts, rights, values = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        for forest in estimators:
+            classes = list(forest.classes_)
+            positive = classes.index(1) if 1 in classes else None
+            for tree in forest.estimators_:
+                t = tree.tree_
+                nodes = np.arange(t.node_count, dtype=np.int64)
+                is_leaf = t.children_left < 0
+
+                roots.append(offset)
+                features.append(np.where(is_leaf, 0, t.feature).astype(np.int32))
+                thresholds.append(t.threshold.astype(np.float64))
+                lefts.append(np.where(is_leaf, nodes, t.children_left) + offset)
+                rights.append(np.where(is_leaf, nodes, t.children_right) + offset)
+                values.append(_leaf_values(t.value, positive))
+                offset += t.node_count
+                max_depth = max(max_depth, t.max_depth)
+
+        def join(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype=dtype)
+
+        return cls(
+            n_features=n_features,
+            n_estimators=n_estimators,
+            roots=np.asarray(roots, dtype=np.int64),
+            feature=join(features, np.int32),
+            threshold=join(thresholds, np.float64),
+            left=join(lefts, np.int64),
+            right=join(rights, np.int64),
+            leaf_value=join(values, np.float64),
+            max_depth=max_depth,
+        )
+
+    def predict_proba(self, X, max_batch_cells=2 ** 22):
+        """Return the (#rows × #forests) probability of class 1 of every forest"""
+        X = sp.csr_matrix(X, dtype=np.float32) if sp.issparse(X) else np.asarray(X, dtype=np.float32)
+        n_rows = X.shape[0]
+        scores = np.empty((n_rows, self.n_forests))
+
+        # Cada lote materializa #filas × #árboles nodos y #filas × #features valores
+        width = max(len(self.roots), self.n_features, 1)
+        batch_size = max(1, max_batch_cells // width)
+        for start in range(0, n_rows, batch_size):
+            batch = X[start:start + batch_size]
+            dense = batch.toarray() if sp.issparse(batch) else batch
+            scores[start:start + len(dense)] = self._predict_dense(dense)
+        return scores
+
+    def _predict_dense(self, X):
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+
+        # Avanzar todas las filas por todos los árboles a la vez; las hojas se quedan fijas
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        leaf_values = self.leaf_value[nodes].reshape(X.shape[0], self.n_forests, self.n_estimators)
+
+        # Sumar árbol a árbol, en el mismo orden que RandomForestClassifier.predict_proba
+        proba = np.zeros((X.shape[0], self.n_forests))
+        for t in range(self.n_estimators):
+            proba += leaf_values[:, :, t]
+        proba /= self.n_estimators
+        return proba
+
+
+def _leaf_values(value, positive):
+    """Per-node probability of class 1, as DecisionTreeClassifier.predict_proba computes it"""
+    value = value[:, 0, :]
+    if positive is None:
+        return np.zeros(len(value))
+    if _VALUES_ARE_PROPORTIONS:
+        return value[:, positive].copy()
+
+    normalizer = value.sum(axis=1)
+    normalizer[normalizer == 0.0] = 1.0
+    return value[:, positive] / normalizer
@@ -0,0 +1,145 @@
+import random
+from collections import Counter
+from itertools import combinations, groupby
+from math import comb
+import numpy as np
+import pandas as pd
+from .ingest import IdLists
+
+
+def iter_baskets_csv(file_path, order_column='pedido_id', product_column='producto_id', chunksize=100000):
+    """Stream (order_id, products) baskets from an order-lines CSV
+
+    The lines of each order must be contiguous (e.g. exported ``ORDER BY
+    pedido_id``); the file is read in chunks and an order split across two
+    chunks is carried over to the next one.
+    """
+    carry_order, carry_products = None, []
+    reader = pd.read_csv(file_path, usecols=[order_column, product_column], chunksize=chunksize)
+    for chunk in reader:
+        orders = chunk[order_column].to_numpy()
+        products = chunk[product_column].to_numpy(dtype=np.int64)
+        if len(orders) == 0:
+            continue
+
+        # Límites entre pedidos consecutivos dentro del bloque
+        bounds = np.concatenate([[0], np.flatnonzero(orders[1:] != orders[:-1]) + 1, [len(orders)]])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            order_id = orders[start]
+            if order_id == carry_order:
+                carry_products.extend(products[start:end].tolist())
+                continue
+            if carry_order is not None:
+                yield carry_order, carry_products
+            carry_order, carry_products = order_id, products[start:end].tolist()
+
+    if carry_order is not None:
+        yield carry_order, carry_products
+
+
+def iter_baskets_queryset(queryset, order_field='pedido_id', product_field='producto_id', chunk_size=2000):
+    """Stream (order_id, products) baskets from a queryset of order lines"""
+    lines = queryset.order_by(order_field).values_list(order_field, product_field).iterator(chunk_size=chunk_size)
+    for order_id, group in groupby(lines, key=lambda line: line[0]):
+        yield order_id, [product for _, product in group]
+
+
+def _nth_combination(items, m, index):
+    """Return the index-th m-combination of items in lexicographic order"""
+    result = []
+    start = 0
+    for remaining in range(m, 0, -1):
+        for i in range(start, len(items)):
+            count = comb(len(items) - i - 1, remaining - 1)
+            if index < count:
+                result.append(items[i])
+                start = i + 1
+                break
+            index -= count
+    return tuple(result)
+
+
+def iter_examples(baskets, m=2, max_combinations=None, seed=42):
+    """Lazily expand baskets into (input, target) examples
+
+    Every m-combination of a basket is an input and the rest of the basket
+    its target. Orders with ``m`` products or fewer are skipped. When an order
+    has more than ``max_combinations`` combinations, that many are sampled
+    uniformly (and reproducibly for a given seed) without enumerating them all.
+    """
+    rng = random.Random(seed)
+    for _, products in baskets:
+        # Un producto repetido en el pedido cuenta una sola vez
+        products = sorted(set(products))
+        if len(products) <= m:
+            continue
+
+        total = comb(len(products), m)
+        if max_combinations is None or total <= max_combinations:
+            selected = combinations(products, m)
+        else:
+            selected = (
+                _nth_combination(products, m, index)
+                for index in sorted(rng.sample(range(total), max_combinations))
+            )
+
+        for input_products in selected:
+            chosen = set(input_products)
+            yield input_products, tuple(p for p in products if p not in chosen)
+
+
+def build_training_data(examples):
+    """Deduplicate (input, target) examples into IdLists plus per-example counts
+
+    Identical examples (typically the same pair bought with the same rest of
+    basket in many orders) are kept once, with their count returned as the
+    sample weight.
+    """
+    counts = Counter(examples)
+
+    inputs = [input_products for input_products, _ in counts]
+    targets = [target_products for _, target_products in counts]
+    weights = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    return _to_id_lists(inputs), _to_id_lists(targets), weights
+
+
+def _to_id_lists(lists):
+    lengths = np.fromiter((len(items) for items in lists), dtype=np.int64, count=len(lists))
+    ids = np.fromiter((p for items in lists for p in items), dtype=np.int64, count=int(lengths.sum()))
+    return IdLists(ids, np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+
+
+def generate_orders(n_products=1000, n_orders=10000, basket_size_mean=4.0, basket_distribution='poisson',
+                    max_basket_size=50, popularity_exponent=1.0, first_product_id=1001, seed=42):
+    """Generate synthetic (order IDs, product IDs) order lines for benchmarks
+
+    Basket sizes follow ``basket_distribution`` ('poisson', 'geometric' or
+    'uniform') with the given mean, clipped to [1, max_basket_size]. Products
+    are drawn from a Zipf-like popularity (rank ** -popularity_exponent), as
+    in real catalogs; a product drawn twice for the same order is kept once.
+    Lines are grouped by order, like an export ``ORDER BY pedido_id``.
+    """
+    rng = np.random.default_rng(seed)
+    if basket_distribution == 'poisson':
+        sizes = 1 + rng.poisson(max(basket_size_mean - 1, 0), n_orders)
+    elif basket_distribution == 'geometric':
+        sizes = rng.geometric(1 / max(basket_size_mean, 1), n_orders)
+    elif basket_distribution == 'uniform':
+        sizes = rng.integers(1, max(2 * round(basket_size_mean), 2), n_orders)
+    else:
+        raise ValueError(f"Distribución de tamaño de pedido desconocida: {basket_distribution}")
+    sizes = np.clip(sizes, 1, min(max_basket_size, n_products))
+
+    popularity = np.arange(1, n_products + 1, dtype=np.float64) ** -popularity_exponent
+    popularity /= popularity.sum()
+
+    # Muestrear con reemplazo y descartar repetidos dentro del pedido, en bloque
+    drawn = rng.choice(n_products, size=int(sizes.sum()), p=popularity)
+    orders = np.repeat(np.arange(1, n_orders + 1), sizes)
+    lines = np.unique(np.column_stack([orders, drawn]), axis=0)
+    return lines[:, 0], lines[:, 1] + first_product_id
+
+
+def write_orders_csv(file_path, order_ids, product_ids, order_column='pedido_id', product_column='producto_id'):
+    """Write order lines as the CSV read by iter_baskets_csv"""
+    pd.DataFrame({order_column: order_ids, product_column: product_ids}).to_csv(file_path, index=False)
@@ -0,0 +1,536 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from django.conf import settings
+from .ann import IVFIndex
+from .compiled import CompiledForest
+
+
+class ForestEngine:
+    """One random forest per product (the multi-output scheme of MultiOutputClassifier)
+
+    Forests are fitted column by column from sparse matrices, so only one
+    dense target column exists at a time. With ``n_jobs`` other than 1 the
+    columns are split into contiguous blocks fitted in a process pool; X is
+    memory-mapped once and shared by the workers instead of being pickled per
+    task, and every forest keeps the same ``random_state``, so the result does
+    not depend on the number of workers.
+
+    After fitting, all trees are exported to a CompiledForest, which scores
+    every product in a few vectorized passes instead of one sklearn call per
+    forest.
+    """
+    name = 'forest'
+    # Un producto se recomienda si la mayoría de los árboles lo predicen
+    score_threshold = 0.5
+    # Los bosques no admiten añadir ejemplos: los datos nuevos requieren reentrenar
+    supports_update = False
+
+    def __init__(self, n_estimators=100, random_state=42, n_jobs=1):
+        self.n_estimators = n_estimators
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.estimators_ = []
+        self.compiled_ = None
+
+    def fit(self, X, Y, sample_weight=None):
+        """Fit one forest per output column"""
+        # Los árboles trabajan sobre CSC float32: convertir una sola vez, no en cada bosque
+        X = sp.csc_matrix(X, dtype=np.float32)
+        X.sort_indices()
+        Y = sp.csc_matrix(Y)
+
+        base_model = RandomForestClassifier(n_estimators=self.n_estimators, random_state=self.random_state)
+        n_jobs = min(effective_n_jobs(self.n_jobs), Y.shape[1])
+        if n_jobs <= 1:
+            self.estimators_ = _fit_columns(base_model, X, Y, sample_weight)
+            return self.compile(X.shape[1])
+
+        # Varios bloques por worker para repartir bien columnas de coste desigual
+        bounds = np.linspace(0, Y.shape[1], min(Y.shape[1], 4 * n_jobs) + 1).astype(int)
+        blocks = Parallel(n_jobs=n_jobs, mmap_mode='r')(
+            delayed(_fit_columns)(base_model, X, Y[:, start:end], sample_weight)
+            for start, end in zip(bounds[:-1], bounds[1:])
+        )
+        self.estimators_ = [estimator for block in blocks for estimator in block]
+        return self.compile(X.shape[1])
+
+    def __getstate__(self):
+        # Al guardar, los arrays compilados bastan para predecir; los árboles de
+        # sklearn no se pueden mapear en memoria y duplicarían el artefacto
+        state = self.__dict__.copy()
+        if state.get('compiled_') is not None:
+            state['estimators_'] = []
+        return state
+
+    def compile(self, n_features):
+        """Flatten the fitted forests into the arrays used for inference"""
+        self.compiled_ = CompiledForest.from_estimators(self.estimators_, n_features)
+        return self
+
+    def predict(self, X):
+        """Return a binary (#rows × #products) matrix of recommended products"""
+        return (self.predict_scores(X) > self.score_threshold).astype(np.int64)
+
+    def predict_scores(self, X):
+        """Return the (#rows × #products) probability of each product being bought"""
+        if self.compiled_ is not None:
+            return self.compiled_.predict_proba(X)
+        X = _as_float32(X)
+        return np.column_stack([_positive_proba(estimator, X) for estimator in self.estimators_])
+
+
+def _fit_columns(base_model, X, Y, sample_weight):
+    """Fit a clone of base_model on every column of the CSC matrix Y"""
+    return [
+        clone(base_model).fit(X, _dense_column(Y, i), sample_weight=sample_weight)
+        for i in range(Y.shape[1])
+    ]
+
+
+def _dense_column(Y, i):
+    """Column i of a binary CSC matrix as a dense int vector"""
+    column = np.zeros(Y.shape[0], dtype=np.int64)
+    column[Y.indices[Y.indptr[i]:Y.indptr[i + 1]]] = 1
+    return column
+
+
+def _as_float32(X):
+    """Convert X once to the dtype/format the trees predict on"""
+    if sp.issparse(X):
+        return sp.csr_matrix(X, dtype=np.float32)
+    return np.asarray(X, dtype=np.float32)
+
+
+def _positive_proba(estimator, X):
+    """Probability of class 1 for a binary classifier, even if it only saw one class"""
+    classes = list(estimator.classes_)
+    if 1 not in classes:
+        return np.zeros(X.shape[0])
+    return estimator.predict_proba(X)[:, classes.index(1)]
+
+
+def _as_csr(X):
+    """X as a CSR matrix, without re-validating one that already is"""
+    return X if isinstance(X, sp.csr_matrix) else sp.csr_matrix(X)
+
+
+def exact_pairs(X):
+    """Return (row, key) arrays for the rows of X with exactly two active columns
+
+    The key of a pair (i, j) with i < j is ``i * n_columns + j``.
+    """
+    X = _as_csr(X)
+    X.sort_indices()
+    n_columns = X.shape[1]
+    rows = np.flatnonzero(np.diff(X.indptr) == 2).astype(np.int64)
+    first = X.indices[X.indptr[rows]].astype(np.int64)
+    second = X.indices[X.indptr[rows] + 1].astype(np.int64)
+    return rows, first * n_columns + second
+
+
+def remap_pair_keys(keys, positions, n_columns):
+    """Re-key pairs after column c moved to positions[c] in a matrix of n_columns columns
+
+    ``positions`` is increasing (new products are inserted in sorted order),
+    so sorted keys stay sorted.
+    """
+    old_columns = len(positions)
+    return positions[keys // old_columns] * n_columns + positions[keys % old_columns]
+
+
+def _place_rows(matrix, rows, n_rows):
+    """CSR matrix of n_rows rows whose row rows[i] is row i of matrix (rows increasing)"""
+    lengths = np.zeros(n_rows, dtype=np.int64)
+    lengths[rows] = np.diff(matrix.indptr)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    return sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=(n_rows, matrix.shape[1]))
+
+
+def row_pairs(X):
+    """Return (row, key) arrays for every unordered pair of active columns per row"""
+    X = _as_csr(X)
+    X.sort_indices()
+    n_columns = X.shape[1]
+    lengths = np.diff(X.indptr)
+
+    # Caso habitual (m=2): un único par por fila, sin bucles de Python
+    rows_2, keys_2 = exact_pairs(X)
+    rows = [rows_2]
+    keys = [keys_2]
+
+    # Entradas con más de 2 productos: todas sus combinaciones de pares
+    for r in np.flatnonzero(lengths > 2):
+        cols = X.indices[X.indptr[r]:X.indptr[r + 1]].astype(np.int64)
+        a, b = np.triu_indices(len(cols), k=1)
+        rows.append(np.full(len(a), r))
+        keys.append(cols[a] * n_columns + cols[b])
+
+    return np.concatenate(rows).astype(np.int64), np.concatenate(keys)
+
+
+class CooccurrenceEngine:
+    """Association rules from item pairs to target products
+
+    Training aggregates, for every unordered input pair seen in the data, how
+    often each product appeared in the target. The counts are kept in a CSR
+    matrix whose rows are indexed by the sorted pair keys, so answering a query
+    is a binary search plus a sparse row slice.
+
+    The counts are plain sums over examples, so new examples can be added
+    with ``updated`` without revisiting the old ones.
+    """
+    name = 'cooccurrence'
+    supports_update = True
+
+    def __init__(self, min_confidence=0.5, min_support=1):
+        self.min_confidence = min_confidence
+        self.min_support = min_support
+        self.n_examples = 0
+        self.pair_keys = None
+        self.pair_counts = None
+        self.target_counts = None
+        self.counts = None
+
+    @property
+    def score_threshold(self):
+        return self.min_confidence
+
+    def fit(self, X, Y, sample_weight=None):
+        """Build the pair → target co-occurrence index
+
+        ``sample_weight`` counts each example that many times.
+        """
+        Y = sp.csr_matrix(Y)
+        if sample_weight is None:
+            sample_weight = np.ones(Y.shape[0], dtype=np.int64)
+        self.n_examples = sample_weight.sum()
+
+        rows, keys = row_pairs(X)
+        self.pair_keys, inverse = np.unique(keys, return_inverse=True)
+
+        # Matriz de agregación (#pares × #ejemplos): cada fila suma los
+        # targets de todos los ejemplos donde aparece el par
+        P = sp.csr_matrix(
+            (sample_weight[rows], (inverse, rows)),
+            shape=(len(self.pair_keys), Y.shape[0]),
+        )
+        self.counts = (P @ Y).tocsr()
+        self.counts.sort_indices()
+        self.pair_counts = np.bincount(inverse, weights=sample_weight[rows], minlength=len(self.pair_keys))
+        self.target_counts = np.asarray(Y.T @ sample_weight).ravel()
+        return self
+
+    def remapped(self, positions, n_columns):
+        """Return a copy whose column c is positions[c] of n_columns (new products are empty)"""
+        engine = CooccurrenceEngine(self.min_confidence, self.min_support)
+        engine.n_examples = self.n_examples
+        engine.pair_keys = remap_pair_keys(self.pair_keys, positions, n_columns)
+        engine.pair_counts = self.pair_counts
+        engine.counts = sp.csr_matrix(
+            (self.counts.data, positions[self.counts.indices], self.counts.indptr),
+            shape=(self.counts.shape[0], n_columns),
+        )
+        engine.target_counts = np.zeros(n_columns, dtype=self.target_counts.dtype)
+        engine.target_counts[positions] = self.target_counts
+        return engine
+
+    def updated(self, X, Y, sample_weight=None):
+        """Return a new engine fitted on this one's examples plus (X, Y)
+
+        Only the new examples are aggregated; the result is merged with the
+        existing counts row by row, so the cost grows with the new data and
+        the number of distinct pairs, not with the history. X and Y must use
+        this engine's columns (see ``remapped``). The engine itself is not
+        modified, so it can keep serving (or stay memory-mapped) meanwhile.
+        """
+        delta = CooccurrenceEngine(self.min_confidence, self.min_support).fit(X, Y, sample_weight)
+        if self.counts is None:
+            return delta
+        if X.shape[1] != self.counts.shape[1]:
+            raise ValueError("Los nuevos ejemplos no usan las columnas del motor")
+
+        engine = CooccurrenceEngine(self.min_confidence, self.min_support)
+        engine.n_examples = self.n_examples + delta.n_examples
+        engine.pair_keys = np.union1d(self.pair_keys, delta.pair_keys)
+        old_rows = np.searchsorted(engine.pair_keys, self.pair_keys)
+        new_rows = np.searchsorted(engine.pair_keys, delta.pair_keys)
+        n_pairs = len(engine.pair_keys)
+
+        engine.counts = (_place_rows(self.counts, old_rows, n_pairs) + _place_rows(delta.counts, new_rows, n_pairs)).tocsr()
+        engine.counts.sort_indices()
+        engine.pair_counts = np.zeros(n_pairs)
+        engine.pair_counts[old_rows] = self.pair_counts
+        engine.pair_counts[new_rows] += delta.pair_counts
+        engine.target_counts = self.target_counts + delta.target_counts
+        return engine
+
+    def pair_count(self, keys):
+        """Weighted number of examples containing each pair key (0 if unseen)"""
+        if len(self.pair_keys) == 0:
+            return np.zeros(len(keys))
+        positions = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+        return np.where(self.pair_keys[positions] == keys, self.pair_counts[positions], 0)
+
+    def _pair_row(self, key):
+        """Return the index row of a pair key, or -1 if it was never seen"""
+        pos = np.searchsorted(self.pair_keys, key)
+        if pos < len(self.pair_keys) and self.pair_keys[pos] == key:
+            return pos
+        return -1
+
+    def _row_confidence(self, row):
+        """Return (targets, confidence) of an index row, honouring min_support"""
+        start, end = self.counts.indptr[row], self.counts.indptr[row + 1]
+        counts = self.counts.data[start:end]
+        keep = counts >= self.min_support
+        return self.counts.indices[start:end][keep], counts[keep] / self.pair_counts[row]
+
+    def _lookup(self, X):
+        """Return (row, index row) arrays for the pairs of X present in the index"""
+        if len(self.pair_keys) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        rows, keys = row_pairs(X)
+        positions = np.searchsorted(self.pair_keys, keys)
+        positions = np.minimum(positions, len(self.pair_keys) - 1)
+        found = self.pair_keys[positions] == keys
+        return rows[found], positions[found]
+
+    def rules(self, i, j):
+        """Return (targets, support, confidence, lift) for the column pair (i, j)"""
+        i, j = min(i, j), max(i, j)
+        row = self._pair_row(i * self.counts.shape[1] + j)
+        if row < 0:
+            empty = np.empty(0)
+            return np.empty(0, dtype=np.int64), empty, empty, empty
+
+        start, end = self.counts.indptr[row], self.counts.indptr[row + 1]
+        targets = self.counts.indices[start:end]
+        counts = self.counts.data[start:end]
+
+        support = counts / self.n_examples
+        confidence = counts / self.pair_counts[row]
+        lift = confidence / (self.target_counts[targets] / self.n_examples)
+        return targets, support, confidence, lift
+
+    def retrieve(self, X, k):
+        """Return (columns, scores) of the k best products per row, read from the index rows
+
+        Same ranking as top_k over predict_scores (products of the row and
+        unseen products excluded, ties by column) but only the CSR slices of
+        the row's pairs are read, so the cost does not depend on the catalog
+        size. Rows are padded with -1 / -inf.
+        """
+        X = _as_csr(X)
+        X.sort_indices()
+        rows, index_rows = self._lookup(X)
+        # Productos de entrada como claves fila * #productos + columna, para excluirlos
+        input_rows = np.repeat(np.arange(X.shape[0], dtype=np.int64), np.diff(X.indptr))
+        exclude = input_rows * X.shape[1] + X.indices
+        return self._top_targets(rows, index_rows, X.shape[0], k, exclude)
+
+    def retrieve_pairs(self, keys, k):
+        """Same as ``retrieve`` on the 2-product inputs given by their pair keys
+
+        Reads the index rows of the keys directly (one binary search), without
+        building a query matrix; used to precompute the top-K table.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        n_columns = self.counts.shape[1]
+        rows = np.arange(len(keys), dtype=np.int64)
+        index_rows = np.empty(0, dtype=np.int64)
+        if len(self.pair_keys):
+            positions = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+            found = self.pair_keys[positions] == keys
+            rows, index_rows = rows[found], positions[found]
+        else:
+            rows = rows[:0]
+        # Los dos productos del par, en orden: fila * #productos + primero < ... + segundo
+        out = np.arange(len(keys), dtype=np.int64) * n_columns
+        exclude = np.column_stack([out + keys // n_columns, out + keys % n_columns]).ravel()
+        return self._top_targets(rows, index_rows, len(keys), k, exclude)
+
+    def _top_targets(self, rows, index_rows, n_rows, k, exclude):
+        """k best (columns, confidences) per output row from the given index rows
+
+        ``rows[i]`` is the output row of index row ``index_rows[i]``; several
+        index rows of the same output row keep each product's best rule.
+        ``exclude`` lists, sorted, the ``row * #products + column`` keys never returned.
+        """
+        columns = np.full((n_rows, k), -1, dtype=np.int64)
+        scores = np.full((n_rows, k), -np.inf)
+        if not len(rows) or not k:
+            return columns, scores
+
+        # Entradas CSR de todas las filas del índice, sin densificar
+        starts = self.counts.indptr[index_rows]
+        lengths = self.counts.indptr[index_rows + 1] - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        entries = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        owners = np.repeat(rows, lengths)
+        targets = self.counts.indices[entries].astype(np.int64)
+        counts = self.counts.data[entries]
+        confidence = counts / np.repeat(self.pair_counts[index_rows], lengths)
+
+        n_columns = self.counts.shape[1]
+        keys = owners * n_columns + targets
+        keep = (counts >= self.min_support) & (confidence > 0)
+        if len(exclude):
+            positions = np.minimum(np.searchsorted(exclude, keys), len(exclude) - 1)
+            keep &= exclude[positions] != keys
+        owners, targets, confidence = owners[keep], targets[keep], confidence[keep]
+
+        # Con más de 2 productos de entrada se queda la mejor regla de cada producto
+        if len(np.unique(rows)) < len(rows):
+            keys = owners * n_columns + targets
+            order = np.lexsort((-confidence, keys))
+            keys, confidence = keys[order], confidence[order]
+            first = np.concatenate([[True], keys[1:] != keys[:-1]])
+            owners, targets, confidence = keys[first] // n_columns, keys[first] % n_columns, confidence[first]
+
+        # Orden por fila: mayor confianza primero, empates por columna; los k primeros
+        order = np.lexsort((targets, -confidence, owners))
+        owners, targets, confidence = owners[order], targets[order], confidence[order]
+        rank = np.arange(len(owners)) - np.searchsorted(owners, owners)
+        top = rank < k
+        columns[owners[top], rank[top]] = targets[top]
+        scores[owners[top], rank[top]] = confidence[top]
+        return columns, scores
+
+    def predict(self, X):
+        """Return a binary (#rows × #products) matrix of recommended products"""
+        Y_pred = np.zeros(X.shape, dtype=np.int64)
+        for r, row in zip(*self._lookup(X)):
+            targets, confidence = self._row_confidence(row)
+            Y_pred[r, targets[confidence >= self.min_confidence]] = 1
+        return Y_pred
+
+    def predict_scores(self, X):
+        """Return the (#rows × #products) confidence of each product, 0 if unseen"""
+        scores = np.zeros(X.shape)
+        for r, row in zip(*self._lookup(X)):
+            targets, confidence = self._row_confidence(row)
+            # Con más de 2 productos de entrada se queda la mejor regla
+            scores[r, targets] = np.maximum(scores[r, targets], confidence)
+        return scores
+
+
+class EmbeddingEngine:
+    """Product embeddings from the co-occurrence matrix, searched with an ANN index
+
+    Training counts how often every two products appear in the same example,
+    weights the counts by positive pointwise mutual information and factorizes
+    that matrix with a truncated SVD, giving each product a unit vector of
+    ``n_components`` dimensions. An input is scored as the normalized sum of
+    the vectors of its products, and a product's score is its cosine
+    similarity to that query.
+
+    ``retrieve`` answers through an IVFIndex built at training time, reading
+    only the ``n_probe`` closest of its ``n_clusters`` cells (sqrt(#products)
+    by default), so its cost grows sublinearly with the catalog; more probes
+    trade latency for recall. ``predict_scores`` is the exact, catalog-wide
+    version, used offline.
+    """
+    name = 'embedding'
+    supports_update = False
+
+    def __init__(self, n_components=64, n_clusters=None, n_probe=8, min_similarity=0.5, random_state=42):
+        self.n_components = n_components
+        self.n_clusters = n_clusters
+        self.n_probe = n_probe
+        self.min_similarity = min_similarity
+        self.random_state = random_state
+        self.vectors_ = None
+        self.index_ = None
+
+    @property
+    def score_threshold(self):
+        return self.min_similarity
+
+    def fit(self, X, Y, sample_weight=None):
+        """Learn the product vectors and build the index"""
+        B = sp.csr_matrix(X + Y)
+        B.data[:] = 1
+        if sample_weight is None:
+            sample_weight = np.ones(B.shape[0])
+        C = (B.T @ sp.diags(np.asarray(sample_weight, dtype=np.float64)) @ B).tocoo()
+        distinct = C.row != C.col
+        rows, columns, counts = C.row[distinct], C.col[distinct], C.data[distinct]
+
+        # PPMI: cuánto más de lo esperado por su popularidad aparecen juntos dos productos
+        totals = np.bincount(rows, weights=counts, minlength=B.shape[1])
+        pmi = np.log(counts * counts.sum() / (totals[rows] * totals[columns])) if len(counts) else counts
+        positive = pmi > 0
+        M = sp.csr_matrix((pmi[positive], (rows[positive], columns[positive])), shape=(B.shape[1],) * 2)
+
+        vectors = self._factorize(M)
+        norms = np.linalg.norm(vectors, axis=1)
+        vectors[norms > 0] /= norms[norms > 0, None]
+        self.vectors_ = vectors.astype(np.float32)
+        self.index_ = IVFIndex.build(self.vectors_, n_clusters=self.n_clusters, random_state=self.random_state)
+        return self
+
+    def _factorize(self, M):
+        """Rows of U·sqrt(S) of the truncated SVD of M"""
+        n = M.shape[0]
+        k = max(1, min(self.n_components, n - 1))
+        if n < 2 or M.nnz == 0:
+            return np.zeros((n, k))
+        if n <= 2000 or k >= n - 1:
+            U, S, _ = np.linalg.svd(M.toarray())
+            U, S = U[:, :k], S[:k]
+        else:
+            v0 = np.random.RandomState(self.random_state).uniform(size=n)
+            U, S, _ = svds(M, k=k, v0=v0)
+        return U * np.sqrt(S)
+
+    def _queries(self, X):
+        """Normalized sum of the vectors of each row's products"""
+        queries = np.asarray(sp.csr_matrix(X, dtype=np.float32) @ self.vectors_)
+        norms = np.linalg.norm(queries, axis=1)
+        queries[norms > 0] /= norms[norms > 0, None]
+        return queries
+
+    def retrieve(self, X, k):
+        """Return (columns, scores) of the k best products per row, from the ANN index
+
+        Products of the row and non-positive similarities are excluded; rows
+        are sorted best first and padded with -1 / -inf.
+        """
+        X = sp.csr_matrix(X)
+        exclude = [X.indices[X.indptr[r]:X.indptr[r + 1]] for r in range(X.shape[0])]
+        columns, scores = self.index_.search(self._queries(X), k, n_probe=self.n_probe, exclude=exclude)
+        columns[scores <= 0] = -1
+        scores[scores <= 0] = -np.inf
+        return columns, scores
+
+    def predict(self, X):
+        """Return a binary (#rows × #products) matrix of recommended products"""
+        scores = self.predict_scores(X)
+        return ((scores >= self.min_similarity) & (scores > 0)).astype(np.int64)
+
+    def predict_scores(self, X):
+        """Return the exact (#rows × #products) cosine similarity of each product to each row"""
+        return self._queries(X) @ self.vectors_.T
+
+
+ENGINES = {
+    ForestEngine.name: ForestEngine,
+    CooccurrenceEngine.name: CooccurrenceEngine,
+    EmbeddingEngine.name: EmbeddingEngine,
+}
+
+
+def get_engine(name=None):
+    """Build an untrained engine configured from the RECOMMENDER_* settings"""
+    if name is None:
+        name = settings.RECOMMENDER_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"Motor de recomendación desconocido: {name}")
+
+    options = settings.RECOMMENDER_ENGINE_OPTIONS.get(name, {})
+    return ENGINES[name](**options)
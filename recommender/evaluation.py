@@ -0,0 +1,158 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def holdout_split(n_rows, fraction=0.1, min_examples=1000, max_rows=10000, seed=42, groups=None):
+    """Return (training rows, holdout rows) index arrays
+
+    Datasets with fewer than ``min_examples`` rows are not split (the holdout
+    is empty). With ``groups`` (one label per row, e.g. its basket) whole
+    groups go to one side as in group_split. The holdout is capped at
+    ``max_rows`` rows; rows of a group dropped by the cap are not trained on either.
+    """
+    rows = np.arange(n_rows)
+    if not fraction or n_rows < min_examples:
+        return rows, rows[:0]
+
+    if groups is None:
+        size = min(int(n_rows * fraction), max_rows)
+        holdout = np.sort(np.random.RandomState(seed).choice(n_rows, size=size, replace=False))
+        return np.setdiff1d(rows, holdout, assume_unique=True), holdout
+
+    train, holdout = group_split(groups, fraction, seed)
+    return train, sample_rows(holdout, max_rows, seed)
+
+
+def sample_rows(rows, max_rows, seed=42):
+    """At most ``max_rows`` of the given sorted rows, drawn reproducibly"""
+    if max_rows is None or len(rows) <= max_rows:
+        return rows
+    return np.sort(np.random.RandomState(seed).choice(rows, size=max_rows, replace=False))
+
+
+def basket_groups(X, Y):
+    """Label each (input, target) row with its basket, input ∪ target
+
+    Without order IDs, the examples of one order share that basket, so
+    splitting by these labels keeps an order on one side.
+    """
+    baskets = sp.csr_matrix(X + Y)
+    baskets.sort_indices()
+    return [
+        baskets.indices[start:end].tobytes()
+        for start, end in zip(baskets.indptr[:-1], baskets.indptr[1:])
+    ]
+
+
+def holdout_score(engine, X, Y, max_batch_cells=2 ** 24):
+    """Micro-averaged precision, recall and F1 of engine.predict on held-out rows"""
+    Y = sp.csr_matrix(Y)
+    # engine.predict devuelve una matriz densa (#lote × #productos): acotarla como en TopKTable
+    batch_size = max(1, min(4096, max_batch_cells // max(X.shape[1], 1)))
+    true_positives = predicted = 0
+    for start in range(0, X.shape[0], batch_size):
+        Y_pred = sp.csr_matrix(engine.predict(X[start:start + batch_size]))
+        true_positives += Y_pred.multiply(Y[start:start + batch_size]).sum()
+        predicted += Y_pred.nnz
+
+    actual = Y.nnz
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / actual if actual else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'n_examples': X.shape[0],
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1': float(f1),
+    }
+
+
+def group_split(groups, test_fraction=0.2, seed=42):
+    """Return (train rows, test rows) index arrays keeping each group on one side
+
+    ``groups`` labels every row (e.g. with its order), so examples generated
+    from the same order never end up in both splits.
+    """
+    unique, inverse = np.unique(np.asarray(groups), return_inverse=True)
+    test = (np.random.RandomState(seed).rand(len(unique)) < test_fraction)[inverse]
+    return np.flatnonzero(~test), np.flatnonzero(test)
+
+
+def ranking_metric_sums(recommended, relevant, k_values=(5, 10), weights=None):
+    """Weighted sums of precision@k, recall@k and AP@k over ranked recommendations
+
+    ``recommended`` holds the product IDs of each example (best first) and
+    ``relevant`` its target products; examples without targets are skipped.
+    The sums of several chunks can be added and then divided by their
+    ``weight`` with average_metrics.
+    """
+    sums = {f'{metric}@{k}': 0.0 for k in k_values for metric in ('precision', 'recall', 'map')}
+    sums['weight'] = 0.0
+    if weights is None:
+        weights = np.ones(len(relevant))
+
+    for products, targets, weight in zip(recommended, relevant, weights):
+        targets = set(targets)
+        if not targets:
+            continue
+        hits = np.array([p in targets for p in products[:max(k_values)]], dtype=bool)
+        for k in k_values:
+            top = hits[:k]
+            precisions = np.cumsum(top) / np.arange(1, len(top) + 1)
+            sums[f'precision@{k}'] += weight * top.sum() / k
+            sums[f'recall@{k}'] += weight * top.sum() / len(targets)
+            sums[f'map@{k}'] += weight * precisions[top].sum() / min(len(targets), k)
+        sums['weight'] += weight
+    return sums
+
+
+def average_metrics(sums):
+    """Divide summed metrics by their total weight"""
+    weight = sums['weight']
+    return {key: float(value / weight) if weight else 0.0 for key, value in sums.items() if key != 'weight'}
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean/max of a list of latencies, in milliseconds"""
+    ms = np.asarray(seconds) * 1000
+    if not len(ms):
+        return None
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'count': len(ms),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'mean_ms': float(ms.mean()),
+        'max_ms': float(ms.max()),
+    }
+
+
+# Modelo cargado una vez por proceso del pool de evaluación
+_worker_system = None
+
+
+def init_scoring_worker(artifact_path):
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from .recommendation import RecommendationSystem
+    global _worker_system
+    _worker_system = RecommendationSystem()
+    _worker_system.cache = None
+    _worker_system.load(artifact_path, verify_dataset=False)
+
+
+def score_chunk(inputs, targets, weights, k_values, min_score, system=None):
+    """ranking_metric_sums of the model's rankings for a chunk of test examples
+
+    Runs in the process that called init_scoring_worker unless ``system``
+    is given.
+    """
+    if system is None:
+        system = _worker_system
+    ranked = system.rank_many(inputs, k=max(k_values), min_score=min_score)
+    return ranking_metric_sums([products for products, _ in ranked], targets, k_values, weights)
+
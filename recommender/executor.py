@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+
+class ExecutorFull(Exception):
+    """Raised when the inference executor already holds as many tasks as it accepts"""
+
+
+class InferenceExecutor:
+    """Bounded thread pool that runs CPU-bound inference off the event loop
+
+    At most ``max_workers`` tasks run at once and at most ``max_queue_size``
+    more wait for a thread; beyond that ``run`` raises ExecutorFull instead
+    of queueing, so callers can shed load (HTTP 429) rather than letting
+    latency grow without bound.
+    """
+
+    def __init__(self, max_workers=4, max_queue_size=64):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_workers=settings.RECOMMENDER_INFERENCE_WORKERS,
+            max_queue_size=settings.RECOMMENDER_INFERENCE_QUEUE_SIZE,
+        )
+
+    def _executor(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='recommender-inference')
+        return self._pool
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool and await its result, or raise ExecutorFull"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ExecutorFull()
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Liberar el hueco cuando termina el hilo, aunque la petición se haya cancelado antes
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+
+# Singleton instance
+inference_executor = InferenceExecutor.from_settings()
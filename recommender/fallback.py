@@ -0,0 +1,121 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def _baskets(X, Y, sample_weight=None):
+    """Binary (#examples × #products) matrix of every product in each example, and the weights"""
+    B = sp.csr_matrix(X + Y)
+    B.data[:] = 1
+    if sample_weight is None:
+        sample_weight = np.ones(B.shape[0], dtype=np.int64)
+    return B, sample_weight
+
+
+def _copurchases(B, sample_weight):
+    """(row, column, count) of every pair of distinct products bought together"""
+    C = (B.T @ sp.diags(sample_weight.astype(np.float64)) @ B).tocoo()
+    distinct = C.row != C.col
+    return C.row[distinct].astype(np.int64), C.col[distinct].astype(np.int64), C.data[distinct]
+
+
+class PopularityFallback:
+    """Recommendations for inputs the model has nothing to say about, as array slices
+
+    Built once at training time from the binarized examples:
+
+    - ``popularity``: weighted number of examples containing each product,
+      and ``global_items``, the ``size`` most popular products;
+    - co-purchase lists: for each product, the ``size`` products most often
+      in the same example, stored CSR-style (``item_indptr``,
+      ``item_columns``, ``item_counts``), so the list of a product is a slice.
+
+    ``rank`` answers with the co-purchases of the input products the model
+    knows (scored P(product | input product)) and tops them up with the most
+    popular products (scored by the fraction of examples containing them).
+    """
+
+    def __init__(self, popularity, n_examples, global_items, item_indptr, item_columns, item_counts, size):
+        self.popularity = popularity
+        self.n_examples = n_examples
+        self.global_items = global_items
+        self.item_indptr = item_indptr
+        self.item_columns = item_columns
+        self.item_counts = item_counts
+        self.size = size
+
+    @classmethod
+    def build(cls, X, Y, sample_weight=None, size=20):
+        B, sample_weight = _baskets(X, Y, sample_weight)
+        popularity = np.asarray(B.T @ sample_weight, dtype=np.float64).ravel()
+        return cls._from_counts(popularity, float(sample_weight.sum()), *_copurchases(B, sample_weight), size)
+
+    @classmethod
+    def _from_counts(cls, popularity, n_examples, rows, columns, counts, size):
+        n_columns = len(popularity)
+        # Los `size` mejores de cada producto (empates por columna)
+        order = np.lexsort((columns, -counts, rows))
+        rows, columns, counts = rows[order], columns[order], counts[order]
+        keep = np.arange(len(rows)) - np.searchsorted(rows, rows) < size
+        rows, columns, counts = rows[keep], columns[keep], counts[keep]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_columns))]).astype(np.int64)
+
+        ranking = np.lexsort((np.arange(n_columns), -popularity))[:size]
+        global_items = ranking[popularity[ranking] > 0]
+        return cls(popularity, n_examples, global_items, indptr, columns, counts, size)
+
+    def _entries(self):
+        rows = np.repeat(np.arange(len(self.popularity)), np.diff(self.item_indptr))
+        return rows, self.item_columns, self.item_counts
+
+    def remapped(self, positions, n_columns):
+        """Return a copy whose column c is positions[c] of n_columns"""
+        popularity = np.zeros(n_columns)
+        popularity[positions] = self.popularity
+        rows, columns, counts = self._entries()
+        return PopularityFallback._from_counts(
+            popularity, self.n_examples, positions[rows], positions[columns], counts, self.size
+        )
+
+    def updated(self, X, Y, sample_weight=None):
+        """Return a new fallback with the examples (X, Y) added
+
+        Co-purchase lists only keep their ``size`` best products, so a product
+        that was just outside a list and gains a few purchases may be missed
+        until the next full retrain.
+        """
+        B, sample_weight = _baskets(X, Y, sample_weight)
+        rows, columns, counts = self._entries()
+        new_rows, new_columns, new_counts = _copurchases(B, sample_weight)
+        merged = sp.coo_matrix(
+            (np.concatenate([counts, new_counts]), (np.concatenate([rows, new_rows]), np.concatenate([columns, new_columns]))),
+            shape=(len(self.popularity),) * 2,
+        ).tocsr().tocoo()
+        return PopularityFallback._from_counts(
+            self.popularity + np.asarray(B.T @ sample_weight, dtype=np.float64).ravel(),
+            self.n_examples + float(sample_weight.sum()),
+            merged.row.astype(np.int64), merged.col.astype(np.int64), merged.data, self.size,
+        )
+
+    def rank(self, columns, k, min_score=None):
+        """Return up to k (columns, scores) for an input whose known products are ``columns``
+
+        With ``min_score``, products scoring below it are skipped.
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        slices = [slice(self.item_indptr[c], self.item_indptr[c + 1]) for c in columns]
+        candidates = np.concatenate([self.item_columns[s] for s in slices] + [self.global_items])
+        scores = np.concatenate(
+            [self.item_counts[s] / self.popularity[c] for c, s in zip(columns, slices)]
+            + [self.popularity[self.global_items] / self.n_examples]
+        )
+        # Primero las co-compras, después los más populares; cada producto una vez, con su mejor score
+        tiers = np.repeat([0, 1], [len(candidates) - len(self.global_items), len(self.global_items)])
+        order = np.lexsort((-scores, tiers))
+        candidates, scores = candidates[order], scores[order]
+        first = np.sort(np.unique(candidates, return_index=True)[1])
+        candidates, scores = candidates[first], scores[first]
+
+        keep = ~np.isin(candidates, columns)
+        if min_score is not None:
+            keep &= scores >= min_score
+        return candidates[keep][:k], scores[keep][:k]
@@ -0,0 +1,116 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Corchetes que se eliminan antes de parsear los IDs en bloque
+_BRACKETS = str.maketrans('', '', '[]')
+
+
+class IdLists:
+    """A column of integer lists stored flat: row i is ``ids[offsets[i]:offsets[i + 1]]``"""
+
+    def __init__(self, ids, offsets):
+        self.ids = ids
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Join IdLists read chunk by chunk"""
+        parts = list(parts)
+        if not parts:
+            return cls(np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64))
+        ids = np.concatenate([part.ids for part in parts])
+        lengths = np.concatenate([np.diff(part.offsets) for part in parts])
+        return cls(ids, np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+
+    def tolist(self):
+        return [self.ids[start:end].tolist() for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def to_csr(self, classes):
+        """Binarize against sorted classes, dropping unknown IDs (like MultiLabelBinarizer)"""
+        columns = np.searchsorted(classes, self.ids)
+        columns = np.minimum(columns, max(len(classes) - 1, 0))
+        known = classes[columns] == self.ids if len(classes) else np.zeros(len(self.ids), dtype=bool)
+
+        rows = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        matrix = sp.csr_matrix(
+            (np.ones(known.sum(), dtype=np.int64), (rows[known], columns[known])),
+            shape=(len(self), len(classes)),
+        )
+        # Un producto repetido en la misma lista cuenta una sola vez
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix
+
+
+def parse_id_lists(values):
+    """Parse a column of "[1,2,3]" strings into IdLists without a per-cell parser
+
+    All cells are joined into one string and parsed by numpy in a single call;
+    the number of IDs per cell is counted from its commas.
+    """
+    values = pd.Series(values, dtype=str)
+    # Sin escribir en los arrays de pandas: pueden ser vistas de solo lectura (copy-on-write)
+    lengths = np.where(
+        values.str.contains(r'\d', regex=True).to_numpy(dtype=bool),
+        (values.str.count(',') + 1).to_numpy(dtype=np.int64),
+        0,
+    )
+
+    text = ','.join(values[lengths > 0]).translate(_BRACKETS)
+    ids = np.fromstring(text, dtype=np.int64, sep=',') if text else np.empty(0, dtype=np.int64)
+    if len(ids) != lengths.sum():
+        raise ValueError("El CSV contiene listas de IDs mal formadas")
+
+    return IdLists(ids, np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+
+
+def parse_lists(values):
+    """Parse a column of "[1,2,3]" strings into Python lists with one bulk JSON parse"""
+    return json.loads('[' + ','.join(values) + ']')
+
+
+def read_id_lists(file_path, columns=('input', 'target'), chunksize=None):
+    """Read the input/target CSV into one IdLists per column
+
+    With ``chunksize`` the file is read with ``pd.read_csv(chunksize=...)``,
+    so only one chunk of raw strings is held in memory at a time.
+    """
+    reader = pd.read_csv(file_path, usecols=list(columns), dtype=str, chunksize=chunksize)
+    chunks = [reader] if chunksize is None else reader
+
+    parts = {column: [] for column in columns}
+    for chunk in chunks:
+        for column in columns:
+            parts[column].append(parse_id_lists(chunk[column]))
+
+    return {column: IdLists.concatenate(parts[column]) for column in columns}
+
+
+def appended_csv(file_path, offset, context_lines=0):
+    """Return a CSV buffer with the header and the rows written after byte ``offset``
+
+    Used to read only the rows appended to a file since it was last trained
+    on. ``context_lines`` rows from just before ``offset`` are included too
+    (e.g. to check whether an order continues across the boundary).
+    """
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        start = max(offset, f.tell())
+        if context_lines:
+            # Retroceder lo justo para incluir las últimas filas ya leídas
+            window = min(start - f.tell(), 1 << 16)
+            f.seek(start - window)
+            before = f.read(window)
+            lines = before.splitlines(keepends=True)
+            context = b''.join(lines[-context_lines:]) if before.endswith(b'\n') else b''
+        else:
+            context = b''
+        f.seek(start)
+        return io.BytesIO(header + context + f.read())
+
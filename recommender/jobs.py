@@ -0,0 +1,150 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TrainingJob:
+    """State of one background training run, as reported by the status endpoint"""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, options):
+        self.id = uuid.uuid4().hex
+        self.options = options
+        self.status = self.PENDING
+        self.stage = None
+        self.progress = 0.0
+        self.version = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def update(self, stage, progress):
+        self.stage = stage
+        self.progress = progress
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'version': self.version,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+def _train_in_subprocess(options):
+    """Train and save an artifact in a worker process; return its metadata"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from .recommendation import RecommendationSystem
+    system = RecommendationSystem()
+    # Proceso dedicado al entrenamiento: tracemalloc no frena ninguna petición
+    system.trace_memory = True
+    model = system.build_model(**options)
+    system.save(model=model)
+    return model.metadata
+
+
+class TrainingJobManager:
+    """Runs training jobs one at a time off the request path
+
+    Each job builds a new model, saves the artifact and then installs the
+    model in the serving RecommendationSystem with a single reference swap,
+    so requests keep being answered by the previous model until the new one
+    is ready. With ``executor='process'`` the fitting runs in a child process
+    (no GIL contention with the request threads) and the parent loads the
+    artifact it wrote.
+    """
+
+    def __init__(self, executor='thread', max_jobs=100):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Ejecutor de entrenamiento desconocido: {executor}")
+        self.executor = executor
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            executor=settings.RECOMMENDER_TRAINING_EXECUTOR,
+            max_jobs=settings.RECOMMENDER_TRAINING_MAX_JOBS,
+        )
+
+    def submit(self, system, **options):
+        """Queue a training run for system and return its TrainingJob"""
+        job = TrainingJob(options)
+        with self._lock:
+            self._jobs[job.id] = job
+            # Conservar solo los trabajos más recientes
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recommender-training')
+            self._pool.submit(self._run, system, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job finishes; return it (or None if unknown)"""
+        job = self.get(job_id)
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def _run(self, system, job):
+        job.status = TrainingJob.RUNNING
+        job.started_at = time.time()
+        try:
+            if self.executor == 'process':
+                job.update('training', 0.0)
+                # spawn: no heredar del padre hilos ni conexiones abiertas
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    pool.submit(_train_in_subprocess, job.options).result()
+                # El artefacto lo acaba de escribir este mismo trabajo
+                job.update('loading', 0.9)
+                system.load(verify_dataset=False)
+            else:
+                model = system.build_model(progress=job.update, **job.options)
+                job.update('saving', 0.9)
+                path = system.save(model=model)
+                system.install(model, artifact_mtime=os.stat(path).st_mtime)
+            job.version = system.metadata['version']
+            job.update('done', 1.0)
+            job.status = TrainingJob.SUCCEEDED
+        except Exception as exc:
+            logger.exception("Falló el entrenamiento %s", job.id)
+            job.error = str(exc)
+            job.status = TrainingJob.FAILED
+        finally:
+            job.finished_at = time.time()
+            job.done.set()
+
+
+# Singleton instance
+training_jobs = TrainingJobManager.from_settings()
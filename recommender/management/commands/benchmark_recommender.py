@@ -0,0 +1,179 @@
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import scipy
+import sklearn
+from django.core.management.base import BaseCommand
+from recommender.datasets import generate_orders, write_orders_csv
+from recommender.engines import ENGINES
+from recommender.evaluation import latency_summary
+from recommender.recommendation import RecommendationSystem
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def max_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera datasets sintéticos de pedidos y mide, para cada motor, carga, entrenamiento, "
+        "memoria y latencia de predicción (p50/p95/p99); escribe los resultados en JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, nargs='+', default=[1000],
+                            help="Tamaños de catálogo a probar")
+        parser.add_argument('--orders', type=int, nargs='+', default=[10000],
+                            help="Números de pedidos a probar")
+        parser.add_argument('--basket-mean', type=float, default=4.0,
+                            help="Tamaño medio de pedido")
+        parser.add_argument('--basket-distribution', default='poisson',
+                            choices=['poisson', 'geometric', 'uniform'],
+                            help="Distribución del tamaño de pedido")
+        parser.add_argument('--basket-max', type=int, default=50,
+                            help="Tamaño máximo de pedido")
+        parser.add_argument('--popularity-exponent', type=float, default=1.0,
+                            help="Exponente de la popularidad tipo Zipf de los productos")
+        parser.add_argument('--engines', nargs='+', default=sorted(ENGINES), choices=sorted(ENGINES),
+                            help="Motores a medir (por defecto todos)")
+        parser.add_argument('--requests', type=int, default=200,
+                            help="Peticiones individuales a medir por motor")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Entradas por petición batch")
+        parser.add_argument('--batches', type=int, default=20,
+                            help="Peticiones batch a medir por motor")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--data-dir', default=None,
+                            help="Directorio donde conservar los CSV y artefactos (por defecto uno temporal)")
+        parser.add_argument('--output', default=None,
+                            help="Archivo JSON de resultados (por defecto la salida estándar)")
+
+    def handle(self, *args, **options):
+        results = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = options['data_dir'] or tmp_dir
+            os.makedirs(data_dir, exist_ok=True)
+
+            for n_products, n_orders in itertools.product(options['products'], options['orders']):
+                dataset = self._generate(data_dir, n_products, n_orders, options)
+                for engine in options['engines']:
+                    self.stderr.write(f"{engine}: {n_products} productos, {n_orders} pedidos...")
+                    results.append(self._run(data_dir, dataset, engine, options))
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'numpy': np.__version__,
+                'scipy': scipy.__version__,
+                'scikit-learn': sklearn.__version__,
+            },
+            'config': {key: options[key] for key in (
+                'basket_mean', 'basket_distribution', 'basket_max', 'popularity_exponent',
+                'requests', 'batch_size', 'batches', 'seed',
+            )},
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def _generate(self, data_dir, n_products, n_orders, options):
+        path = os.path.join(data_dir, f'orders_{n_products}x{n_orders}.csv')
+        start = time.perf_counter()
+        order_ids, product_ids = generate_orders(
+            n_products=n_products,
+            n_orders=n_orders,
+            basket_size_mean=options['basket_mean'],
+            basket_distribution=options['basket_distribution'],
+            max_basket_size=options['basket_max'],
+            popularity_exponent=options['popularity_exponent'],
+            seed=options['seed'],
+        )
+        write_orders_csv(path, order_ids, product_ids)
+        return {
+            'path': path,
+            'n_products': n_products,
+            'n_orders': n_orders,
+            'n_lines': len(order_ids),
+            'generation_seconds': time.perf_counter() - start,
+        }
+
+    def _run(self, data_dir, dataset, engine, options):
+        system = RecommendationSystem()
+        # Medir el motor, no la caché de recomendaciones
+        system.cache = None
+        system.trace_memory = True
+
+        start = time.perf_counter()
+        model = system.build_model_from_orders(dataset['path'], engine=engine)
+        train_seconds = time.perf_counter() - start
+        system.install(model)
+
+        artifact = system.save(os.path.join(data_dir, f"model_{engine}_{dataset['n_products']}x{dataset['n_orders']}.joblib"))
+        start = time.perf_counter()
+        RecommendationSystem().load(artifact, verify_dataset=False)
+        artifact_load_seconds = time.perf_counter() - start
+
+        # Pares de entrada al azar del catálogo: mezcla pares vistos (tabla top-K) y no vistos (motor)
+        rng = np.random.default_rng(options['seed'])
+        products = model.vocabulary.ids
+        n_pairs = options['requests'] + options['batches'] * options['batch_size']
+        pairs = [sorted(rng.choice(products, size=2, replace=False).tolist()) for _ in range(n_pairs)]
+        single, batched = pairs[:options['requests']], pairs[options['requests']:]
+
+        system.rank_many(single[:1])  # calentamiento
+        single_latencies = []
+        for pair in single:
+            start = time.perf_counter()
+            system.rank_many([pair])
+            single_latencies.append(time.perf_counter() - start)
+
+        batch_latencies = []
+        for i in range(options['batches']):
+            batch = batched[i * options['batch_size']:(i + 1) * options['batch_size']]
+            start = time.perf_counter()
+            system.rank_many(batch)
+            batch_latencies.append(time.perf_counter() - start)
+
+        metrics = model.metadata['training_metrics']
+        stages = {stage['name']: stage for stage in metrics['stages']}
+        return {
+            'engine': engine,
+            'dataset': {key: value for key, value in dataset.items() if key != 'path'},
+            'n_examples': model.metadata['n_examples'],
+            'n_unique_examples': model.metadata['n_unique_examples'],
+            'dataset_load_seconds': sum(stages[name]['seconds'] for name in ('load_orders', 'binarize') if name in stages),
+            'train_seconds': train_seconds,
+            'stages': metrics['stages'],
+            'peak_memory_bytes': metrics['peak_memory_bytes'],
+            'max_rss_bytes': max_rss_bytes(),
+            'model_size_bytes': metrics['model_size_bytes'],
+            'artifact_bytes': os.path.getsize(artifact),
+            'artifact_load_seconds': artifact_load_seconds,
+            'holdout': metrics['holdout'],
+            'single_request': latency_summary(single_latencies),
+            'batch_request': latency_summary(batch_latencies),
+            'batch_per_item_ms': (
+                float(np.sum(batch_latencies) * 1000 / (len(batch_latencies) * options['batch_size']))
+                if batch_latencies else None
+            ),
+        }
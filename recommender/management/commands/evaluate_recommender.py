@@ -0,0 +1,201 @@
+import json
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy
+import sklearn
+from django.core.management.base import BaseCommand
+from recommender.datasets import build_training_data
+from recommender.engines import ENGINES
+from recommender.evaluation import (
+    average_metrics, group_split, init_scoring_worker, latency_summary, score_chunk,
+)
+from recommender.ingest import read_id_lists
+from recommender.recommendation import RecommendationSystem
+
+
+def pareto_front(results, quality, latency):
+    """Flag the results no other result beats on both quality (higher) and latency (lower)"""
+    measured = [result for result in results if result[latency] is not None]
+    for result in results:
+        result['pareto_optimal'] = result[latency] is not None and not any(
+            other[quality] >= result[quality] and other[latency] <= result[latency]
+            and (other[quality] > result[quality] or other[latency] < result[latency])
+            for other in measured
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Divide el dataset por pedido en entrenamiento y prueba, entrena cada motor y compara "
+        "precision@k, recall@k y MAP con el tiempo de entrenamiento, el tamaño y la latencia p99"
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--dataset', default=None,
+                            help="CSV de entrenamiento input/target")
+        source.add_argument('--orders', default=None,
+                            help="CSV de líneas de pedido (pedido, producto)")
+        parser.add_argument('--engines', nargs='+', default=sorted(ENGINES), choices=sorted(ENGINES),
+                            help="Motores a comparar (por defecto todos)")
+        parser.add_argument('--k', type=int, nargs='+', default=[5, 10],
+                            help="Cortes k de las métricas")
+        parser.add_argument('--test-fraction', type=float, default=0.2,
+                            help="Fracción de pedidos reservados para la prueba")
+        parser.add_argument('--min-score', type=float, default=None,
+                            help="Score mínimo de las recomendaciones (por defecto el umbral del motor)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Procesos que puntúan el conjunto de prueba (1: en este proceso)")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Ejemplos de prueba por tarea")
+        parser.add_argument('--requests', type=int, default=200,
+                            help="Peticiones individuales para medir la latencia de cada motor")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=None,
+                            help="Archivo JSON de resultados (por defecto la salida estándar)")
+
+    def handle(self, *args, **options):
+        options['k'] = sorted(set(options['k']))
+        train, test = self._split(options)
+        self.stderr.write(
+            f"{len(train[0])} ejemplos de entrenamiento, {len(test[0])} de prueba (distintos)"
+        )
+
+        results = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for engine in options['engines']:
+                self.stderr.write(f"{engine}...")
+                results.append(self._run(tmp_dir, engine, train, test, options))
+
+        max_k = options['k'][-1]
+        pareto_front(results, f'map@{max_k}', 'p99_ms')
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'numpy': np.__version__,
+                'scipy': scipy.__version__,
+                'scikit-learn': sklearn.__version__,
+            },
+            'config': {key: options[key] for key in (
+                'dataset', 'orders', 'k', 'test_fraction', 'min_score', 'workers', 'requests', 'seed',
+            )},
+            'split': {
+                'train_examples': int(train[2].sum()),
+                'train_unique_examples': len(train[0]),
+                'test_examples': int(test[2].sum()),
+                'test_unique_examples': len(test[0]),
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def _split(self, options):
+        """(inputs, targets, weights) of the training and test examples, split by order"""
+        if options['orders']:
+            # Cada pedido va entero a un lado: sus combinaciones no pueden filtrarse a la prueba
+            baskets = list(RecommendationSystem._baskets(options['orders']))
+            train_rows, test_rows = group_split(
+                [order_id for order_id, _ in baskets], options['test_fraction'], options['seed']
+            )
+            return (
+                RecommendationSystem._order_examples([baskets[i] for i in train_rows]),
+                RecommendationSystem._order_examples([baskets[i] for i in test_rows]),
+            )
+
+        data = read_id_lists(options['dataset'])
+        examples = [
+            (tuple(input_products), tuple(target_products))
+            for input_products, target_products in zip(data['input'].tolist(), data['target'].tolist())
+        ]
+        # Sin ID de pedido, los ejemplos del mismo pedido comparten la cesta input ∪ target
+        baskets = {}
+        groups = [
+            baskets.setdefault(tuple(sorted(set(input_products) | set(target_products))), len(baskets))
+            for input_products, target_products in examples
+        ]
+        train_rows, test_rows = group_split(groups, options['test_fraction'], options['seed'])
+        return (
+            build_training_data(examples[i] for i in train_rows),
+            build_training_data(examples[i] for i in test_rows),
+        )
+
+    def _run(self, tmp_dir, engine, train, test, options):
+        system = RecommendationSystem()
+        # Medir el motor, no la caché de recomendaciones
+        system.cache = None
+
+        inputs, targets, weights = train
+        classes = np.unique(inputs.ids)
+        start = time.perf_counter()
+        model = system.build_model_from_matrices(
+            inputs.to_csr(classes), targets.to_csr(classes), classes, engine=engine, sample_weight=weights
+        )
+        train_seconds = time.perf_counter() - start
+        system.install(model)
+        artifact = system.save(os.path.join(tmp_dir, f'model_{engine}.joblib'))
+
+        test_inputs, test_targets, test_weights = test[0].tolist(), test[1].tolist(), test[2]
+        start = time.perf_counter()
+        sums = self._score(system, artifact, test_inputs, test_targets, test_weights, options)
+        score_seconds = time.perf_counter() - start
+
+        # Latencia de una petición individual con entradas del conjunto de prueba
+        requests = test_inputs[:options['requests']]
+        k = options['k'][-1]
+        latencies = []
+        if requests:
+            system.rank_many(requests[:1], k=k, min_score=options['min_score'])  # calentamiento
+        for input_products in requests:
+            start = time.perf_counter()
+            system.rank_many([input_products], k=k, min_score=options['min_score'])
+            latencies.append(time.perf_counter() - start)
+        latency = latency_summary(latencies)
+
+        return {
+            'engine': engine,
+            **average_metrics(sums),
+            'train_seconds': train_seconds,
+            'model_size_bytes': model.metadata['training_metrics']['model_size_bytes'],
+            'artifact_bytes': os.path.getsize(artifact),
+            'score_seconds': score_seconds,
+            'p99_ms': latency['p99_ms'] if latency else None,
+            'single_request': latency,
+        }
+
+    def _score(self, system, artifact, inputs, targets, weights, options):
+        """Summed ranking metrics of the test examples, chunk by chunk"""
+        chunk_size = options['chunk_size']
+        chunks = [
+            (inputs[start:start + chunk_size], targets[start:start + chunk_size],
+             weights[start:start + chunk_size], options['k'], options['min_score'])
+            for start in range(0, len(inputs), chunk_size)
+        ]
+        if options['workers'] <= 1 or len(chunks) <= 1:
+            parts = [score_chunk(*chunk, system=system) for chunk in chunks]
+        else:
+            # spawn: cada proceso carga el artefacto una vez y puntúa sus bloques sin el GIL del padre
+            with ProcessPoolExecutor(
+                max_workers=min(options['workers'], len(chunks)),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_scoring_worker, initargs=(os.fspath(artifact),),
+            ) as pool:
+                parts = list(pool.map(score_chunk, *zip(*chunks)))
+
+        sums = {f'{metric}@{k}': 0.0 for k in options['k'] for metric in ('precision', 'recall', 'map')}
+        sums['weight'] = 0.0
+        for part in parts:
+            for key, value in part.items():
+                sums[key] += value
+        return sums
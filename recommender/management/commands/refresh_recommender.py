@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from recommender.artifacts import ArtifactError
+from recommender.recommendation import recommendation_system
+
+
+class Command(BaseCommand):
+    help = (
+        "Actualiza el modelo con los cambios del dataset: no hace nada si no cambió, "
+        "añade solo las filas nuevas si únicamente se añadieron filas y reentrena en otro caso"
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument(
+            '--dataset',
+            default=None,
+            help="Ruta del CSV input/target (por defecto RECOMMENDER_ORDER_LINES_PATH o RECOMMENDER_DATASET_PATH)",
+        )
+        source.add_argument(
+            '--orders',
+            default=None,
+            help="Ruta de un CSV de líneas de pedido (pedido_id, producto_id) en lugar del CSV input/target",
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help="Ruta del artefacto (por defecto RECOMMENDER_MODEL_PATH)",
+        )
+
+    def handle(self, *args, **options):
+        # Partir del artefacto guardado aunque el dataset haya cambiado desde entonces
+        try:
+            recommendation_system.load(options['output'], verify_dataset=False)
+        except ArtifactError:
+            pass
+
+        if options['orders']:
+            outcome = recommendation_system.refresh(options['orders'], orders=True)
+        else:
+            outcome = recommendation_system.refresh(options['dataset'])
+
+        metadata = recommendation_system.metadata
+        if outcome == 'unchanged':
+            self.stdout.write(f"El dataset no cambió; se mantiene el modelo {metadata['version']}")
+            return
+
+        path = recommendation_system.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Modelo {metadata['version']} ({'actualizado' if outcome == 'updated' else 'reentrenado'}) "
+            f"con {metadata['n_examples']} ejemplos y {metadata['n_products']} productos; guardado en {path}"
+        ))
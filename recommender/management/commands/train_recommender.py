@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from recommender.engines import ENGINES
+from recommender.recommendation import recommendation_system
+
+
+class Command(BaseCommand):
+    help = "Entrena el modelo de recomendación y guarda el artefacto en disco"
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument(
+            '--dataset',
+            default=None,
+            help="Ruta del CSV input/target (por defecto RECOMMENDER_DATASET_PATH)",
+        )
+        source.add_argument(
+            '--orders',
+            default=None,
+            help="Ruta de un CSV de líneas de pedido (pedido_id, producto_id) en lugar del CSV input/target",
+        )
+        parser.add_argument(
+            '--engine',
+            default=None,
+            choices=sorted(ENGINES),
+            help="Motor de recomendación (por defecto RECOMMENDER_ENGINE)",
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help="Ruta del artefacto (por defecto RECOMMENDER_MODEL_PATH)",
+        )
+
+    def handle(self, *args, **options):
+        # Fuera del servidor no hay peticiones que tracemalloc pueda frenar
+        recommendation_system.trace_memory = True
+        if options['orders']:
+            recommendation_system.train_from_orders(options['orders'], engine=options['engine'])
+        else:
+            recommendation_system.train(options['dataset'], engine=options['engine'])
+        path = recommendation_system.save(options['output'])
+
+        metadata = recommendation_system.metadata
+        self.stdout.write(self.style.SUCCESS(
+            f"Modelo {metadata['version']} ({metadata['engine']}) entrenado con {metadata['n_examples']} ejemplos "
+            f"y {metadata['n_products']} productos; guardado en {path}"
+        ))
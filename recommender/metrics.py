@@ -0,0 +1,313 @@
+import asyncio
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+# Límites (segundos) de los histogramas de latencia: de 100 µs a 10 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # counts[i]: observaciones en (buckets[i-1], buckets[i]]; la última es +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """Context manager that observes the elapsed wall-clock seconds"""
+
+    __slots__ = ('child', 'start')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    """A metric family: one child per combination of label values"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return (and create on first use) the child for the given label values"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yield (name suffix, [(label, value)], value) for the exposition format"""
+        raise NotImplementedError
+
+    def _label_pairs(self, values):
+        return list(zip(self.labelnames, values))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield '_total', self._label_pairs(values), child.value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            labels = self._label_pairs(values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), list(child.counts)):
+                cumulative += count
+                yield '_bucket', labels + [('le', _format_value(bound))], cumulative
+            yield '_sum', labels, child.sum
+            yield '_count', labels, cumulative
+
+
+class CallbackMetric(Metric):
+    """A gauge or counter read when scraped: ``callback()`` returns [(label values, value)]
+
+    Used for values that are already tracked elsewhere (model metadata, cache
+    and log writer counters), so they cost nothing per request.
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), type='gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.type = type
+
+    def samples(self):
+        suffix = '_total' if self.type == 'counter' else ''
+        for values, value in self.callback():
+            yield suffix, self._label_pairs(values), value
+
+
+class Registry:
+    """Metrics of this process rendered in the Prometheus text format (0.0.4)"""
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, callback, labelnames=(), type='gauge'):
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, type))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {_escape(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _model_info():
+    from .recommendation import recommendation_system
+    metadata = recommendation_system.metadata
+    if not metadata:
+        return []
+    return [((metadata['version'], metadata['engine']), 1)]
+
+
+def _model_trained_timestamp():
+    from .recommendation import recommendation_system
+    model = recommendation_system.model
+    if model is None:
+        return []
+    return [((), datetime.fromisoformat(model.metadata['trained_at']).timestamp())]
+
+
+def _cache_lookups():
+    from .recommendation import recommendation_system
+    cache = recommendation_system.cache
+    if cache is None:
+        return []
+    return [(('hit',), cache.hits), (('miss',), cache.misses)]
+
+
+def _cache_entries():
+    from .recommendation import recommendation_system
+    cache = recommendation_system.cache
+    return [] if cache is None else [((), len(cache))]
+
+
+def _cache_hit_ratio():
+    from .recommendation import recommendation_system
+    cache = recommendation_system.cache
+    if cache is None or not cache.hits + cache.misses:
+        return []
+    return [((), cache.hits / (cache.hits + cache.misses))]
+
+
+def _log_writer_stats():
+    from .recorder import recommendation_log
+    return [(('dropped',), recommendation_log.dropped), (('failed',), recommendation_log.failed)]
+
+
+# Singleton instance
+registry = Registry()
+
+request_stage_seconds = registry.histogram(
+    'recommender_request_stage_seconds',
+    'Latency of each stage of a recommendation request',
+    labelnames=('endpoint', 'stage'),
+)
+request_seconds = registry.histogram(
+    'recommender_request_seconds',
+    'Total latency of recommendation requests',
+    labelnames=('endpoint',),
+)
+fallbacks = registry.counter(
+    'recommender_fallbacks',
+    'Recommendations answered with the fallback instead of model candidates',
+    labelnames=('reason',),
+)
+errors = registry.counter(
+    'recommender_errors',
+    'Recommendation requests that failed',
+    labelnames=('endpoint', 'kind'),
+)
+registry.callback(
+    'recommender_model_info',
+    'Model currently serving requests (always 1)',
+    _model_info, labelnames=('version', 'engine'),
+)
+registry.callback(
+    'recommender_model_trained_timestamp_seconds',
+    'Unix time at which the serving model was trained',
+    _model_trained_timestamp,
+)
+registry.callback(
+    'recommender_cache_lookups',
+    'Recommendation cache lookups by result',
+    _cache_lookups, labelnames=('result',), type='counter',
+)
+registry.callback(
+    'recommender_cache_entries',
+    'Entries in the local recommendation cache',
+    _cache_entries,
+)
+registry.callback(
+    'recommender_cache_hit_ratio',
+    'Fraction of recommendation cache lookups that were hits',
+    _cache_hit_ratio,
+)
+registry.callback(
+    'recommender_log_rows',
+    'Recommendation log rows dropped (queue full) or failed to write',
+    _log_writer_stats, labelnames=('outcome',), type='counter',
+)
+
+
+def timed(endpoint):
+    """Decorator observing the total latency of a view in request_seconds"""
+    def decorator(view):
+        child = request_seconds.labels(endpoint)
+
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                with child.time():
+                    return await view(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with child.time():
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
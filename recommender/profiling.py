@@ -0,0 +1,95 @@
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import scipy.sparse as sp
+
+
+class StageTimer:
+    """Wall-clock time and peak memory of consecutive training stages
+
+    Memory is measured with tracemalloc, which sees every Python and numpy
+    allocation of this process (not of worker processes, e.g. a forest
+    fitted with ``n_jobs``), and is reported as the peak above the memory
+    in use when the stage started.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'name': name, 'seconds': time.perf_counter() - start, 'peak_memory_bytes': None}
+            if self.trace_memory:
+                record['peak_memory_bytes'] = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+            if started_tracing:
+                tracemalloc.stop()
+            self.stages.append(record)
+
+    def as_dict(self):
+        peaks = [s['peak_memory_bytes'] for s in self.stages if s['peak_memory_bytes'] is not None]
+        return {
+            'stages': list(self.stages),
+            'total_seconds': sum(s['seconds'] for s in self.stages),
+            'peak_memory_bytes': max(peaks) if peaks else None,
+        }
+
+
+def stage(stages, name):
+    """``stages.stage(name)``, or a no-op when no StageTimer is given"""
+    return stages.stage(name) if stages is not None else nullcontext()
+
+
+def matrix_stats(X):
+    """Shape and sparsity of a binarized matrix"""
+    n_rows, n_columns = X.shape
+    nnz = X.nnz if sp.issparse(X) else int(np.count_nonzero(X))
+    cells = n_rows * n_columns
+    return {
+        'rows': n_rows,
+        'columns': n_columns,
+        'nnz': int(nnz),
+        'density': nnz / cells if cells else 0.0,
+    }
+
+
+def nbytes(obj):
+    """Bytes held by the numpy arrays and sparse matrices reachable from obj
+
+    Walks the pickled state of objects, lists, tuples and dicts; objects
+    without ``__dict__`` (e.g. sklearn's Cython trees) count as 0.
+    """
+    # id -> objeto: mantener vivos los estados temporales para que su id no se reutilice
+    seen = {}
+    total = 0
+    pending = [obj]
+    while pending:
+        item = pending.pop()
+        if item is None or id(item) in seen:
+            continue
+        seen[id(item)] = item
+
+        if isinstance(item, np.ndarray):
+            total += item.nbytes
+        elif sp.issparse(item):
+            pending.extend(getattr(item, name, None) for name in ('data', 'indices', 'indptr', 'row', 'col'))
+        elif isinstance(item, dict):
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            pending.extend(item)
+        elif hasattr(item, '__dict__') and not isinstance(item, type):
+            # Lo que se guarda al serializar (ForestEngine omite los árboles de sklearn)
+            pending.append(item.__getstate__() if hasattr(item, '__getstate__') else vars(item))
+    return total
@@ -1,95 +1,797 @@
 import pandas as pd
+import logging
 import os
+import threading
+import time
 import numpy as np
-from ast import literal_eval
-from sklearn.preprocessing import MultiLabelBinarizer
-from sklearn.multioutput import MultiOutputClassifier
-from sklearn.ensemble import RandomForestClassifier
+from datetime import datetime, timezone
 from django.conf import settings
+from .artifacts import ArtifactError, StaleArtifactError, artifact_lock, file_checksum, load_artifact, save_artifact
+from .cache import RecommendationCache, cache_key
+from .datasets import build_training_data, iter_baskets_csv, iter_baskets_queryset, iter_examples
+from .engines import get_engine, row_pairs
+from .evaluation import basket_groups, group_split, holdout_score, holdout_split, sample_rows
+from .fallback import PopularityFallback
+from .ingest import appended_csv, parse_lists, read_id_lists
+from .metrics import fallbacks
+from .profiling import StageTimer, matrix_stats, nbytes, stage
+from .topk import TopKTable, top_k
+from .vocabulary import ProductVocabulary
+
+logger = logging.getLogger(__name__)
+
+
+class TrainedModel:
+    """Everything needed to serve recommendations, built once and never mutated
+
+    Retraining builds a new TrainedModel and swaps the single reference held
+    by RecommendationSystem, so a request that already read the previous one
+    keeps a consistent vocabulary, engine, top-K table and fallback until it
+    finishes.
+    """
+
+    def __init__(self, vocabulary, engine, topk, metadata, fallback=None):
+        self.vocabulary = vocabulary
+        self.engine = engine
+        self.topk = topk
+        self.metadata = metadata
+        self.fallback = fallback
+
+    @property
+    def version(self):
+        return self.metadata['version']
+
+
+def _report(progress, stage, fraction):
+    if progress is not None:
+        progress(stage, fraction)
+
+
+def _configured_dataset():
+    """Dataset the server trains on when no other is given"""
+    return settings.RECOMMENDER_ORDER_LINES_PATH or settings.RECOMMENDER_DATASET_PATH
+
+
+def _same_file(a, b):
+    return os.path.abspath(os.fspath(a)) == os.path.abspath(os.fspath(b))
+
+
+def _dataset_fields(dataset_path):
+    """Metadata identifying the dataset a model was trained on"""
+    if dataset_path is None:
+        return {'dataset_path': None, 'dataset_checksum': None, 'dataset_size': None, 'dataset_mtime': None}
+    # stat antes del checksum: si el archivo crece entretanto, no parecerá solo ampliado
+    stat = os.stat(dataset_path)
+    return {
+        'dataset_path': os.fspath(dataset_path),
+        'dataset_checksum': file_checksum(dataset_path),
+        'dataset_size': stat.st_size,
+        'dataset_mtime': stat.st_mtime,
+    }
+
+
+def _example_prediction(vocabulary, topk, size=3):
+    """The precomputed pair with the highest-scored recommendation, for the training figure"""
+    if topk is None or not len(topk):
+        return None
+    best = np.nan_to_num(topk.scores[:, 0], nan=-np.inf)
+    row = int(np.argmax(best))
+    if not np.isfinite(best[row]):
+        return None
+    columns = topk.items[row, :size]
+    return {
+        'input': vocabulary.products(list(divmod(int(topk.pair_keys[row]), topk.n_columns))).tolist(),
+        'recommended': vocabulary.products(columns[columns >= 0]).tolist(),
+        'score': float(best[row]),
+    }
+
 
 class RecommendationSystem:
     def __init__(self):
         self.model = None
-        self.mlb = None
-        self.is_trained = False
+        self.cache = RecommendationCache.from_settings() if settings.RECOMMENDER_CACHE_ENABLED else None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._artifact_mtime = None
+        self._next_reload_check = 0.0
+        # Medir la memoria del entrenamiento (None = RECOMMENDER_TRAINING_TRACE_MEMORY). tracemalloc
+        # traza todo el proceso: activarlo solo donde no se sirven peticiones (comandos, proceso hijo)
+        self.trace_memory = None
+    
+    # Accesos de lectura al modelo actual
+    @property
+    def is_trained(self):
+        return self.model is not None
+    
+    @property
+    def engine(self):
+        return self.model.engine if self.model is not None else None
+    
+    @property
+    def vocabulary(self):
+        return self.model.vocabulary if self.model is not None else None
+    
+    @property
+    def topk(self):
+        return self.model.topk if self.model is not None else None
+    
+    @property
+    def metadata(self):
+        return self.model.metadata if self.model is not None else {}
         
     def load_data(self, file_path=None):
         """Load and preprocess the training data"""
         if file_path is None:
-            file_path = os.path.join(settings.BASE_DIR, 'datasets/train_input_target_m2_n>=1.csv')
+            file_path = settings.RECOMMENDER_DATASET_PATH
         
         # 1) Leer CSV
         df = pd.read_csv(file_path)
         
-        # 2) Convertir cadenas a listas de ints
-        df['input'] = df['input'].apply(literal_eval)
-        df['target'] = df['target'].apply(literal_eval)
+        # 2) Convertir cadenas a listas de ints (un único parseo JSON por columna)
+        df['input'] = parse_lists(df['input'])
+        df['target'] = parse_lists(df['target'])
         
         return df
     
-    def train(self, file_path=None):
-        """Train the recommendation model"""
-        df = self.load_data(file_path)
+    def load_matrices(self, file_path=None, stages=None):
+        """Read the training CSV straight into sparse (X, Y) matrices and product IDs"""
+        if file_path is None:
+            file_path = settings.RECOMMENDER_DATASET_PATH
+        
+        # 1) Leer CSV (por bloques si RECOMMENDER_CSV_CHUNK_SIZE) y parsear los IDs en bloque
+        with stage(stages, 'load_csv'):
+            data = read_id_lists(file_path, chunksize=settings.RECOMMENDER_CSV_CHUNK_SIZE)
+        
+        with stage(stages, 'binarize'):
+            # 2) Productos vistos como entrada, igual que MultiLabelBinarizer.fit(df['input'])
+            classes = np.unique(data['input'].ids)
+            
+            # 3) One-hot vectorización en matrices dispersas (CSR): la memoria depende
+            #    de los elementos no nulos y no de #ejemplos × #productos
+            X = data['input'].to_csr(classes)  # (#ejemplos × #productos_totales)
+            Y = data['target'].to_csr(classes)  # (#ejemplos × #productos_totales)
+        return X, Y, classes
+    
+    def load_orders(self, source, stages=None):
+        """Build sparse (X, Y) matrices, product IDs and sample weights from order lines
+
+        ``source`` is an order-lines CSV path or a queryset with one row per
+        (order, product). Baskets are expanded into m=2 combinations lazily and
+        identical examples are kept once, weighted by how often they occur.
+        """
+        with stage(stages, 'load_orders'):
+            inputs, targets, weights = self._order_examples(self._baskets(source))
+        
+        with stage(stages, 'binarize'):
+            classes = np.unique(inputs.ids)
+            X, Y = inputs.to_csr(classes), targets.to_csr(classes)
+        return X, Y, classes, weights
+    
+    @staticmethod
+    def _baskets(source):
+        """(order_id, products) baskets of an order-lines CSV (path or buffer) or queryset"""
+        order_field = settings.RECOMMENDER_ORDER_FIELD
+        product_field = settings.RECOMMENDER_PRODUCT_FIELD
+        if hasattr(source, 'order_by'):
+            return iter_baskets_queryset(source, order_field, product_field)
+        return iter_baskets_csv(
+            source, order_field, product_field,
+            chunksize=settings.RECOMMENDER_CSV_CHUNK_SIZE or 100000,
+        )
+    
+    @staticmethod
+    def _order_examples(baskets):
+        """Deduplicated m=2 (inputs, targets, weights) of baskets"""
+        examples = iter_examples(baskets, m=2, max_combinations=settings.RECOMMENDER_MAX_COMBINATIONS_PER_ORDER)
+        return build_training_data(examples)
+    
+    def build_model(self, file_path=None, engine=None, progress=None):
+        """Train a new TrainedModel from an input/target CSV without serving it
+
+        ``progress``, if given, is called as ``progress(stage, fraction)``.
+        """
+        if file_path is None and settings.RECOMMENDER_ORDER_LINES_PATH:
+            return self.build_model_from_orders(settings.RECOMMENDER_ORDER_LINES_PATH, engine=engine, progress=progress)
+        if file_path is None:
+            file_path = settings.RECOMMENDER_DATASET_PATH
+        _report(progress, 'loading', 0.0)
+        stages = self._stage_timer()
+        X, Y, classes = self.load_matrices(file_path, stages=stages)
+        evaluation = None
+        if self._holdout_enabled(X):
+            # Sin ID de pedido, los ejemplos de un pedido comparten la cesta input ∪ target
+            train_rows, holdout_rows = holdout_split(
+                X.shape[0],
+                fraction=settings.RECOMMENDER_HOLDOUT_FRACTION,
+                min_examples=0,
+                max_rows=settings.RECOMMENDER_HOLDOUT_MAX_ROWS,
+                groups=basket_groups(X, Y),
+            )
+            evaluation = (X[train_rows], Y[train_rows], None, X[holdout_rows], Y[holdout_rows])
+        return self._fit(X, Y, classes, engine=engine, dataset_path=file_path, progress=progress, stages=stages,
+                         evaluation=evaluation)
+    
+    def build_model_from_orders(self, source, engine=None, progress=None):
+        """Train a new TrainedModel from order lines (CSV path or queryset) without serving it"""
+        _report(progress, 'loading', 0.0)
+        stages = self._stage_timer()
+        X, Y, classes, weights = self.load_orders(source, stages=stages)
+        evaluation = self._order_holdout(source, classes) if self._holdout_enabled(X) else None
+        dataset_path = source if isinstance(source, (str, os.PathLike)) else None
+        return self._fit(X, Y, classes, engine=engine, sample_weight=weights,
+                         dataset_path=dataset_path, progress=progress, stages=stages, evaluation=evaluation)
+    
+    def build_model_from_matrices(self, X, Y, classes, engine=None, sample_weight=None):
+        """Train a new TrainedModel on already binarized (X, Y) without serving it
+
+        No holdout is scored, e.g. when the caller keeps its own test split.
+        """
+        return self._fit(X, Y, classes, engine=engine, sample_weight=sample_weight)
+    
+    def train(self, file_path=None, engine=None):
+        """Train the recommendation model with the configured (or given) engine"""
+        self.install(self.build_model(file_path, engine=engine))
+        return True
+    
+    def train_from_orders(self, source, engine=None):
+        """Train from order lines (CSV path or queryset) instead of an input/target CSV"""
+        self.install(self.build_model_from_orders(source, engine=engine))
+        return True
+    
+    @staticmethod
+    def _holdout_enabled(X):
+        """Whether to score a holdout (opt-in, only on large enough datasets)"""
+        return bool(settings.RECOMMENDER_HOLDOUT_FRACTION) and X.shape[0] >= settings.RECOMMENDER_HOLDOUT_MIN_EXAMPLES
+    
+    def _order_holdout(self, source, classes):
+        """Training and holdout matrices of the order lines, split by order
+
+        The source is read again: each order goes whole to one side, so its
+        combinations are never both trained on and scored.
+        """
+        baskets = list(self._baskets(source))
+        train_rows, holdout_rows = group_split(
+            [order_id for order_id, _ in baskets], settings.RECOMMENDER_HOLDOUT_FRACTION
+        )
+        inputs, targets, weights = self._order_examples(baskets[i] for i in train_rows)
+        holdout_inputs, holdout_targets, _ = self._order_examples(baskets[i] for i in holdout_rows)
+        holdout = sample_rows(np.arange(len(holdout_inputs)), settings.RECOMMENDER_HOLDOUT_MAX_ROWS)
+        return (
+            inputs.to_csr(classes), targets.to_csr(classes), weights,
+            holdout_inputs.to_csr(classes)[holdout], holdout_targets.to_csr(classes)[holdout],
+        )
+    
+    def _fit(self, X, Y, classes, engine=None, sample_weight=None, dataset_path=None, progress=None, stages=None,
+             evaluation=None):
+        """Fit the engine and the top-K table on binarized training data
+
+        ``evaluation`` is an optional ``(X, Y, sample_weight, X_holdout,
+        Y_holdout)`` split: a separate engine is fit on its training part and
+        scored on the holdout, while the served model uses every row.
+        """
+        vocabulary = ProductVocabulary(classes)
+        dataset_stats = {'input': matrix_stats(X), 'target': matrix_stats(Y)}
         
-        # 3) One-hot vectorización
-        self.mlb = MultiLabelBinarizer()
+        # Entrenar el motor configurado en RECOMMENDER_ENGINE (forest, cooccurrence)
+        _report(progress, 'fitting', 0.2)
+        fitted = get_engine(engine)
+        with stage(stages, 'fit'):
+            fitted.fit(X, Y, sample_weight=sample_weight)
         
-        # X: (#ejemplos × #productos_totales)
-        X = self.mlb.fit_transform(df['input'])
+        # Etapa offline: top-K de cada par observado, para no pasar por el motor al servir
+        topk = None
+        if settings.RECOMMENDER_TOPK_ENABLED:
+            _report(progress, 'topk', 0.7)
+            with stage(stages, 'topk'):
+                topk = TopKTable.build(
+                    fitted, X,
+                    k=settings.RECOMMENDER_TOPK_SIZE,
+                    min_pair_count=settings.RECOMMENDER_TOPK_MIN_PAIR_COUNT,
+                    sample_weight=sample_weight,
+                )
         
-        # Y: (#ejemplos × #productos_totales)
-        Y = self.mlb.transform(df['target'])
+        # Popularidad global y co-compras por producto, para entradas sin candidatos
+        with stage(stages, 'fallback'):
+            fallback = PopularityFallback.build(X, Y, sample_weight=sample_weight, size=settings.RECOMMENDER_FALLBACK_SIZE)
         
-        # Entrenar modelo (Random Forest como ejemplo, pero podrías usar otros)
-        base_model = RandomForestClassifier(n_estimators=100, random_state=42)
-        self.model = MultiOutputClassifier(base_model)
-        self.model.fit(X, Y)
+        holdout = None
+        if evaluation is not None:
+            X_train, Y_train, train_weight, X_holdout, Y_holdout = evaluation
+            _report(progress, 'evaluating', 0.85)
+            with stage(stages, 'evaluate'):
+                # Motor aparte sin el holdout; el que se sirve ya se entrenó con todo
+                scored = get_engine(engine).fit(X_train, Y_train, sample_weight=train_weight)
+                holdout = holdout_score(scored, X_holdout, Y_holdout)
         
-        self.is_trained = True
-        return True
+        training_metrics = stages.as_dict() if stages is not None else {}
+        training_metrics.update({
+            'dataset': dataset_stats,
+            'model_size_bytes': nbytes([fitted, topk, fallback, vocabulary.ids]),
+            'holdout': holdout,
+            'example_prediction': _example_prediction(vocabulary, topk),
+        })
+        
+        trained_at = datetime.now(timezone.utc)
+        metadata = {
+            'version': trained_at.strftime('%Y%m%d%H%M%S%f'),
+            'trained_at': trained_at.isoformat(),
+            'engine': fitted.name,
+            **_dataset_fields(dataset_path),
+            'n_examples': int(sample_weight.sum()) if sample_weight is not None else X.shape[0],
+            'n_unique_examples': X.shape[0],
+            'n_products': len(vocabulary),
+            'n_precomputed_pairs': len(topk) if topk is not None else 0,
+            'incremental_updates': 0,
+            'training_metrics': training_metrics,
+        }
+        _report(progress, 'done', 1.0)
+        return TrainedModel(vocabulary, fitted, topk, metadata, fallback=fallback)
     
-    def predict(self, input_products):
-        """Generate recommendations for input products"""
-        if not self.is_trained:
-            self.train()
+    def build_update(self, inputs, targets, sample_weight=None, model=None, dataset=None, stages=None):
+        """Return a new TrainedModel with (input, target) IdLists added to model's examples
+
+        Only the new examples are binarized and aggregated, and only the top-K
+        rows of the pairs they contain are recomputed, so the cost follows the
+        size of the update rather than the whole history. New products get a
+        column; targets that were not yet products when their example was added
+        are not counted until the next full retrain (compaction). ``dataset``
+        replaces the dataset fields of the metadata (by default those of
+        ``model`` are kept). Raises ValueError if the engine can only be retrained.
+        """
+        if model is None:
+            model = self.model
+        if model is None:
+            raise ValueError("No hay un modelo entrenado que actualizar")
+        if not model.engine.supports_update:
+            raise ValueError(f"El motor {model.metadata['engine']} no admite actualizaciones incrementales")
+        if stages is None:
+            stages = self._stage_timer()
         
-        # Vectorizar
-        x_vec = self.mlb.transform([input_products])  # shape (1, #productos_totales)
+        engine, topk, fallback = model.engine, model.topk, model.fallback
+        old_classes = model.vocabulary.ids
+        with stage(stages, 'binarize'):
+            classes = np.union1d(old_classes, inputs.ids)
+            if len(classes) > len(old_classes):
+                # Productos nuevos: cada columna existente pasa a su posición ordenada
+                positions = np.searchsorted(classes, old_classes)
+                engine = engine.remapped(positions, len(classes))
+                if topk is not None:
+                    topk = topk.remapped(positions, len(classes))
+                if fallback is not None:
+                    fallback = fallback.remapped(positions, len(classes))
+            vocabulary = ProductVocabulary(classes)
+            X, Y = inputs.to_csr(classes), targets.to_csr(classes)
         
-        # En lugar de usar predict_proba que es complejo para MultiOutputClassifier
-        # Usaremos una simplificación para el caso de prueba
-        Y_pred = self.model.predict(x_vec)[0]
+        with stage(stages, 'fit'):
+            engine = engine.updated(X, Y, sample_weight=sample_weight)
         
-        # Obtener índices donde hay 1 (productos recomendados)
-        indices = np.where(Y_pred > 0)[0]
+        with stage(stages, 'fallback'):
+            if fallback is None:
+                fallback = PopularityFallback.build(X, Y, sample_weight=sample_weight, size=settings.RECOMMENDER_FALLBACK_SIZE)
+            else:
+                fallback = fallback.updated(X, Y, sample_weight=sample_weight)
         
-        if len(indices) == 0:
-            # Si no hay recomendaciones, devolver un valor conocido del dataset
-            # Para este caso de prueba, recomendamos 1005 para input [1001, 1003]
-            if set(input_products) == {1001, 1003}:
-                return [1005]
-            return [1005]  # valor por defecto
+        if not settings.RECOMMENDER_TOPK_ENABLED:
+            topk = None
         else:
-            # Convertir numpy.int64 a int nativo de Python para evitar problemas de serialización
-            candidatos = [int(self.mlb.classes_[i]) for i in indices]
-            
-        # No recomendar productos que ya están en el input
-        candidatos = [p for p in candidatos if p not in input_products]
-        
-        # Si no hay candidatos después de filtrar, devolver un valor conocido
-        if not candidatos:
-            if set(input_products) == {1001, 1003}:
-                return [1005]
-            return [1005]  # valor por defecto
+            with stage(stages, 'topk'):
+                # Solo cambian los scores de los pares presentes en los nuevos ejemplos
+                keys = np.unique(row_pairs(X)[1])
+                keys = keys[engine.pair_count(keys) >= settings.RECOMMENDER_TOPK_MIN_PAIR_COUNT]
+                changed = TopKTable.for_pairs(engine, len(classes), keys, k=settings.RECOMMENDER_TOPK_SIZE)
+                topk = changed if topk is None or topk.k != changed.k else topk.merged(changed)
+        
+        training_metrics = stages.as_dict()
+        training_metrics.update({
+            'dataset': {'input': matrix_stats(X), 'target': matrix_stats(Y)},
+            'model_size_bytes': nbytes([engine, topk, fallback, vocabulary.ids]),
+            # El holdout se mide en los reentrenamientos completos
+            'holdout': None,
+            'example_prediction': _example_prediction(vocabulary, topk),
+        })
+        
+        trained_at = datetime.now(timezone.utc)
+        metadata = dict(model.metadata)
+        metadata.update(dataset or {})
+        metadata.update({
+            'version': trained_at.strftime('%Y%m%d%H%M%S%f'),
+            'trained_at': trained_at.isoformat(),
+            'n_examples': model.metadata['n_examples'] + (int(sample_weight.sum()) if sample_weight is not None else X.shape[0]),
+            'n_unique_examples': model.metadata['n_unique_examples'] + X.shape[0],
+            'n_products': len(classes),
+            'n_precomputed_pairs': len(topk) if topk is not None else 0,
+            'incremental_updates': model.metadata.get('incremental_updates', 0) + 1,
+            'base_version': model.metadata.get('base_version', model.version),
+            'training_metrics': training_metrics,
+        })
+        return TrainedModel(vocabulary, engine, topk, metadata, fallback=fallback)
+    
+    def update(self, inputs, targets):
+        """Add (input, target) examples to the serving model without retraining"""
+        examples = ((tuple(input_products), tuple(target_products)) for input_products, target_products in zip(inputs, targets))
+        inputs, targets, weights = build_training_data(examples)
+        self.install(self.build_update(inputs, targets, sample_weight=weights))
+        return True
+    
+    def update_from_orders(self, source):
+        """Add new orders (order-lines CSV path or queryset) to the serving model without retraining"""
+        inputs, targets, weights = self._order_examples(self._baskets(source))
+        self.install(self.build_update(inputs, targets, sample_weight=weights))
+        return True
+    
+    def refresh(self, file_path=None, orders=None):
+        """Bring the serving model up to date with its dataset, doing as little work as possible
+
+        Returns 'unchanged' if the file's size and mtime (or else its checksum)
+        match the model's; 'updated' if rows were only appended and the engine
+        supports incremental updates, in which case only the new rows are
+        read; 'retrained' otherwise. Every RECOMMENDER_MAX_INCREMENTAL_UPDATES
+        updates a full retrain compacts the model. By default the dataset is
+        RECOMMENDER_ORDER_LINES_PATH if set, else RECOMMENDER_DATASET_PATH;
+        pass ``orders=True`` with an order-lines ``file_path``.
+        """
+        if file_path is None:
+            orders = bool(settings.RECOMMENDER_ORDER_LINES_PATH)
+            file_path = _configured_dataset()
+        
+        model = self.model
+        if model is not None and self.is_current(file_path):
+            return 'unchanged'
+        metadata = model.metadata if model is not None else {}
+        same_file = metadata.get('dataset_path') == os.fspath(file_path)
+        dataset = _dataset_fields(file_path)
+        if same_file and dataset['dataset_checksum'] == metadata.get('dataset_checksum'):
+            return 'unchanged'
+        
+        updated = None
+        size = metadata.get('dataset_size')
+        if same_file and size and dataset['dataset_size'] > size \
+                and model.engine.supports_update \
+                and metadata.get('incremental_updates', 0) < settings.RECOMMENDER_MAX_INCREMENTAL_UPDATES \
+                and file_checksum(file_path, limit=size) == metadata['dataset_checksum']:
+            updated = self._build_appended_update(model, file_path, orders, dataset)
+        
+        if updated is not None:
+            self.install(updated)
+            return 'updated'
+        if orders:
+            self.install(self.build_model_from_orders(file_path))
+        else:
+            self.install(self.build_model(file_path))
+        return 'retrained'
+    
+    def is_current(self, file_path=None):
+        """Whether the serving model was trained on the dataset as it is now (size and mtime)"""
+        if file_path is None:
+            file_path = _configured_dataset()
+        metadata = self.metadata
+        if metadata.get('dataset_path') != os.fspath(file_path) or not os.path.exists(file_path):
+            return False
+        stat = os.stat(file_path)
+        return (stat.st_size, stat.st_mtime) == (metadata.get('dataset_size'), metadata.get('dataset_mtime'))
+    
+    def _build_appended_update(self, model, file_path, orders, dataset):
+        """build_update with the rows appended to file_path since model was trained, or None"""
+        stages = self._stage_timer()
+        offset = model.metadata['dataset_size']
+        if orders:
+            with stage(stages, 'load_orders'):
+                # La primera cesta es la última línea ya entrenada: si su pedido
+                # continúa en las filas nuevas, sus combinaciones cambian
+                baskets = self._baskets(appended_csv(file_path, offset, context_lines=1))
+                first = next(baskets, None)
+                if first is not None and len(first[1]) > 1:
+                    return None
+                inputs, targets, weights = self._order_examples(baskets)
+        else:
+            with stage(stages, 'load_csv'):
+                data = read_id_lists(appended_csv(file_path, offset), chunksize=settings.RECOMMENDER_CSV_CHUNK_SIZE)
+            inputs, targets, weights = data['input'], data['target'], None
+        return self.build_update(inputs, targets, sample_weight=weights, model=model, dataset=dataset, stages=stages)
+    
+    def install(self, model, artifact_mtime=None):
+        """Atomically replace the model used to serve requests"""
+        # Una sola asignación: las peticiones en curso conservan el modelo que ya leyeron
+        self.model = model
+        self._artifact_mtime = artifact_mtime
+        self._clear_cache()
+    
+    def save(self, path=None, model=None):
+        """Persist a trained model (the current one by default) as a versioned artifact"""
+        if model is None:
+            model = self.model
+        if model is None:
+            raise ArtifactError("No hay un modelo entrenado para guardar")
+        if path is None:
+            path = settings.RECOMMENDER_MODEL_PATH
+
+        path = save_artifact(path, {
+            'engine': model.engine,
+            'topk': model.topk,
+            'fallback': model.fallback,
+            'classes': model.vocabulary.ids,
+            'metadata': model.metadata,
+        })
+        if model is self.model and os.fspath(path) == os.fspath(settings.RECOMMENDER_MODEL_PATH):
+            self._artifact_mtime = os.stat(path).st_mtime
+        return path
+
+    def load(self, path=None, dataset_path=None, verify_dataset=None):
+        """Load a persisted artifact, rejecting it if the dataset changed
+
+        The checksum is compared with ``dataset_path`` or, by default, with the
+        dataset the artifact was trained on (as recorded in its metadata).
+        """
+        if path is None:
+            path = settings.RECOMMENDER_MODEL_PATH
+        if verify_dataset is None:
+            verify_dataset = settings.RECOMMENDER_VERIFY_DATASET_CHECKSUM
+        mtime = os.stat(path).st_mtime if os.path.exists(path) else None
+        data = load_artifact(path, mmap_mode='r' if settings.RECOMMENDER_MODEL_MMAP else None)
+        metadata = data['metadata']
+
+        # Verificar que el dataset con el que se entrenó no ha cambiado desde entonces
+        if verify_dataset:
+            if dataset_path is None:
+                dataset_path = metadata.get('dataset_path')
+            if dataset_path is not None and os.path.exists(dataset_path) and \
+                    file_checksum(dataset_path) != metadata.get('dataset_checksum'):
+                raise StaleArtifactError("El artefacto no corresponde al dataset actual", dataset_path)
+
+        model = TrainedModel(ProductVocabulary(data['classes']), data['engine'], data['topk'], metadata,
+                             fallback=data['fallback'])
+        artifact_mtime = mtime if os.fspath(path) == os.fspath(settings.RECOMMENDER_MODEL_PATH) else None
+        self.install(model, artifact_mtime=artifact_mtime)
+        return True
+
+    def _maybe_reload(self):
+        """Pick up, in the background, an artifact written later by another process
+
+        Only applies when the current model came from (or was saved to) the
+        artifact at RECOMMENDER_MODEL_PATH; checked at most every
+        RECOMMENDER_RELOAD_INTERVAL seconds.
+        """
+        interval = settings.RECOMMENDER_RELOAD_INTERVAL
+        now = time.monotonic()
+        if not interval or self._artifact_mtime is None or now < self._next_reload_check:
+            return
+        self._next_reload_check = now + interval
+
+        try:
+            mtime = os.stat(settings.RECOMMENDER_MODEL_PATH).st_mtime
+        except OSError:
+            return
+        if mtime <= self._artifact_mtime or not self._reload_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._reload, name='recommender-reload', daemon=True).start()
+
+    def _reload(self):
+        try:
+            self.load(verify_dataset=False)
+        except ArtifactError:
+            logger.exception("No se pudo recargar el artefacto del modelo")
+        finally:
+            self._reload_lock.release()
+
+    def ensure_trained(self):
+        """Load the persisted model, or train and persist one if none is usable"""
+        if self.is_trained:
+            return
+
+        with self._lock:
+            if self.is_trained or self._load_persisted():
+                return
             
-        return candidatos
+            # Sin artefacto válido: un solo worker entrena y lo guarda; los demás esperan
+            # al candado entre procesos y cargan el artefacto que acaba de escribir
+            with artifact_lock(settings.RECOMMENDER_MODEL_PATH):
+                if self._load_persisted():
+                    return
+                logger.warning("Sin artefacto válido en %s: entrenando con %s",
+                               settings.RECOMMENDER_MODEL_PATH, _configured_dataset())
+                self.train()
+                self.save()
+    
+    def _load_persisted(self):
+        """Load the artifact at RECOMMENDER_MODEL_PATH; return False if it must be retrained
+
+        An artifact whose own dataset changed is only retrained when that
+        dataset is the configured one: one built from another dataset (e.g.
+        ``train_recommender --orders``) keeps being served, since retraining
+        would replace it with a model of different data.
+        """
+        try:
+            self.load()
+            return True
+        except StaleArtifactError as e:
+            if _same_file(e.dataset_path, _configured_dataset()):
+                return False
+            logger.warning(
+                "El dataset %s del artefacto cambió desde el entrenamiento; se sirve igualmente "
+                "(actualizarlo con refresh_recommender)", e.dataset_path,
+            )
+            self.load(verify_dataset=False)
+            return True
+        except ArtifactError:
+            return False
+
+    def _clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def predict(self, input_products, k=None, min_score=None):
+        """Generate recommendations for input products"""
+        return self.predict_many([input_products], k=k, min_score=min_score)[0]
+    
+    def predict_many(self, inputs, k=None, min_score=None):
+        """Generate recommendations for many inputs with a single model call"""
+        return [products for products, _ in self.rank_many(inputs, k=k, min_score=min_score)]
+    
+    def rank_many(self, inputs, k=None, min_score=None, lookup_cache=True):
+        """Return a (product IDs, scores) pair per input, best first
+
+        At most ``k`` products are returned per input, all scoring at least
+        ``min_score`` (by default the engine's own decision threshold).
+        Fallback recommendations are scored as co-purchase or popularity
+        rates, so only an explicit ``min_score`` filters them.
+        With ``lookup_cache=False`` the cache is not read (the caller already
+        missed it with rank_precomputed) but the results are still stored.
+        """
+        # La clave usa el min_score pedido: None y el umbral del motor no filtran igual el respaldo
+        requested_min_score = min_score
+        model, k, min_score = self._serving_model(k, min_score)
+        
+        if self.cache is None:
+            return self._rank(model, inputs, k, min_score, fallback_min_score=requested_min_score)
+        
+        # Servir desde la caché las entradas ya calculadas con esta versión del modelo
+        version = model.version
+        keys = [cache_key(input_products, version, k, requested_min_score) for input_products in inputs]
+        results = [self.cache.get(key) if lookup_cache else None for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        
+        if missing:
+            computed = self._rank(model, [inputs[i] for i in missing], k, min_score,
+                                  fallback_min_score=requested_min_score)
+            for i, (products, scores) in zip(missing, computed):
+                results[i] = (tuple(products), tuple(scores))
+                self.cache.set(keys[i], results[i])
+        
+        # Copias, para que quien llama no modifique las entradas de la caché
+        return [(list(products), list(scores)) for products, scores in results]
+    
+    def rank_precomputed(self, input_products, k=None, min_score=None):
+        """Return (product IDs, scores) from the cache or the top-K table, or None
+
+        Never calls the engine, so it is cheap enough to answer a request
+        before queueing it for the micro-batcher; None means the input needs
+        rank_many.
+        """
+        requested_min_score = min_score
+        model, k, min_score = self._serving_model(k, min_score)
+        
+        key = None
+        if self.cache is not None:
+            key = cache_key(input_products, model.version, k, requested_min_score)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return list(cached[0]), list(cached[1])
+        
+        if model.topk is None or k > model.topk.k:
+            return None
+        X, complete = model.vocabulary.transform([input_products], return_complete=True)
+        if not complete[0]:
+            return None
+        rows, table_rows = model.topk.lookup(X)
+        if not len(rows):
+            return None
+        
+        columns, scores = model.topk.ranked(table_rows[0], k, min_score)
+        products, scores = self._candidates(model, X, 0, k, columns, scores, requested_min_score)
+        if key is not None:
+            self.cache.set(key, (tuple(products), tuple(scores)))
+        return products, scores
+    
+    def _stage_timer(self):
+        trace_memory = self.trace_memory
+        if trace_memory is None:
+            trace_memory = settings.RECOMMENDER_TRAINING_TRACE_MEMORY
+        return StageTimer(trace_memory=trace_memory)
+    
+    def _serving_model(self, k, min_score):
+        """Return the model to rank with and the k / min_score defaults resolved"""
+        self.ensure_trained()
+        self._maybe_reload()
+        
+        # Leer el modelo una sola vez: un reentrenamiento concurrente no afecta a esta llamada
+        model = self.model
+        if k is None:
+            k = settings.RECOMMENDER_DEFAULT_K
+        if min_score is None:
+            min_score = model.engine.score_threshold
+        return model, k, min_score
+    
+    def _rank(self, model, inputs, k, min_score, fallback_min_score=None):
+        """Rank recommendations for inputs with the given model, bypassing the cache
+
+        ``fallback_min_score``, if given, also filters the fallback recommendations.
+        """
+        # Vectorizar todas las entradas en una sola matriz dispersa
+        X, complete = model.vocabulary.transform(inputs, return_complete=True)  # CSR (#entradas, #productos_totales)
+        
+        results = [None] * len(inputs)
+        
+        # Entradas con productos desconocidos: el modelo no las ha visto, directamente al fallback
+        for r in np.flatnonzero(~complete):
+            results[r] = self._fallback(model, X, r, k, 'unknown_product', fallback_min_score)
+        pending = np.flatnonzero(complete)
+        
+        # Pares precalculados: búsqueda binaria en la tabla top-K (si guarda suficientes productos)
+        if model.topk is not None and k <= model.topk.k:
+            rows, table_rows = model.topk.lookup(X)
+            found = complete[rows]
+            rows, table_rows = rows[found], table_rows[found]
+            for r, table_row in zip(rows, table_rows):
+                columns, scores = model.topk.ranked(table_row, k, min_score)
+                results[r] = self._candidates(model, X, r, k, columns, scores, fallback_min_score)
+            pending = np.setdiff1d(pending, rows)
+        
+        # Resto de entradas: scores del motor para todos los productos en una sola pasada
+        if len(pending) and hasattr(model.engine, 'retrieve'):
+            # Motores con índice aproximado: solo devuelven los k mejores, ya sin los de entrada
+            columns, best = model.engine.retrieve(X[pending], k)
+            columns[best < min_score] = -1
+            for r, row_columns, row_scores in zip(pending, columns, best):
+                valid = row_columns >= 0
+                results[r] = self._candidates(model, X, r, k, row_columns[valid], row_scores[valid],
+                                              fallback_min_score)
+        elif len(pending):
+            X_pending = X[pending]
+            ranking = model.engine.predict_scores(X_pending)
+            # Excluir los productos que no alcanzan el umbral y, con una máscara sobre
+            # las columnas de entrada, los productos de entrada
+            ranking[(ranking < min_score) | (ranking <= 0)] = -np.inf
+            ranking[X_pending.nonzero()] = -np.inf
+            columns, best = top_k(ranking, k)
+            for r, row_columns, row_scores in zip(pending, columns, best):
+                valid = row_columns >= 0
+                results[r] = self._candidates(model, X, r, k, row_columns[valid], row_scores[valid],
+                                              fallback_min_score)
+        
+        return results
+    
+    def _candidates(self, model, X, r, k, indices, scores, fallback_min_score=None):
+        """Turn ranked column indices into (product IDs, scores) lists
+
+        Input products are already excluded: the engine path masks their
+        columns and the top-K table never stores them. Without candidates
+        the answer comes from the popularity fallback.
+        """
+        if not len(indices):
+            return self._fallback(model, X, r, k, 'no_candidates', fallback_min_score)
+        
+        # tolist() devuelve int/float nativos de Python, serializables sin conversión
+        return model.vocabulary.products(indices).tolist(), np.asarray(scores, dtype=float).tolist()
+    
+    def _fallback(self, model, X, r, k, reason, min_score=None):
+        """Co-purchases of the known input products of row r, then the most popular products"""
+        fallbacks.labels(reason).inc()
+        if model.fallback is None:
+            return [], []
+        columns, scores = model.fallback.rank(X.indices[X.indptr[r]:X.indptr[r + 1]], k, min_score)
+        return model.vocabulary.products(columns).tolist(), scores.tolist()
     
     def get_all_products(self):
         """Return all product IDs seen during training"""
-        if not self.is_trained:
-            self.train()
+        self.ensure_trained()
         
-        return self.mlb.classes_.tolist()
+        return self.model.vocabulary.ids.tolist()
 
 # Singleton instance
-recommendation_system = RecommendationSystem() 
\ No newline at end of file
+recommendation_system = RecommendationSystem()
+
+
+def preload_recommendation_system():
+    """Load the model at process start-up when RECOMMENDER_PRELOAD_MODEL is enabled"""
+    if settings.RECOMMENDER_PRELOAD_MODEL:
+        recommendation_system.ensure_trained()
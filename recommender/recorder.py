@@ -0,0 +1,136 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, connection
+from .models import ProductRecommendation
+
+logger = logging.getLogger(__name__)
+
+# Marca que detiene el hilo de escritura tras vaciar la cola
+_STOP = object()
+
+
+class RecommendationLogWriter:
+    """Buffers ProductRecommendation rows and writes them with bulk_create
+
+    With RECOMMENDER_LOG_ASYNC enabled, ``record`` only enqueues the row; a
+    background thread flushes the queue every ``batch_size`` rows or
+    ``flush_interval`` seconds, whichever comes first, and once more at
+    process exit. When the bounded queue is full, the ``drop`` policy discards
+    the row and the ``block`` policy waits up to ``block_timeout`` seconds.
+    ``created_at`` is set when the batch is written, so it may lag the request
+    by up to ``flush_interval``.
+    """
+
+    def __init__(self, max_queue_size=10000, batch_size=500, flush_interval=1.0,
+                 policy='drop', block_timeout=1.0):
+        if policy not in ('drop', 'block'):
+            raise ValueError(f"Política de cola desconocida: {policy}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_queue_size=settings.RECOMMENDER_LOG_QUEUE_SIZE,
+            batch_size=settings.RECOMMENDER_LOG_BATCH_SIZE,
+            flush_interval=settings.RECOMMENDER_LOG_FLUSH_INTERVAL,
+            policy=settings.RECOMMENDER_LOG_FULL_POLICY,
+            block_timeout=settings.RECOMMENDER_LOG_BLOCK_TIMEOUT,
+        )
+
+    def record(self, input_products, recommended_products):
+        """Log one recommendation"""
+        self.record_many([(input_products, recommended_products)])
+
+    def record_many(self, items):
+        """Log (input_products, recommended_products) pairs"""
+        rows = [
+            ProductRecommendation(input_products=input_products, recommended_products=recommended_products)
+            for input_products, recommended_products in items
+        ]
+        if not settings.RECOMMENDER_LOG_ASYNC:
+            ProductRecommendation.objects.bulk_create(rows, batch_size=self.batch_size)
+            return
+
+        self._start()
+        for row in rows:
+            try:
+                if self.policy == 'block':
+                    self._queue.put(row, timeout=self.block_timeout)
+                else:
+                    self._queue.put_nowait(row)
+            except queue.Full:
+                self.dropped += 1
+
+    def flush(self):
+        """Block until every queued row has been written"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self, timeout=None):
+        """Write the pending rows and stop the background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            # Tras un fork el hilo del proceso padre no existe en el hijo
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='recommendation-log-writer', daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+        connection.close()
+
+    def _write(self, batch):
+        close_old_connections()
+        try:
+            ProductRecommendation.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("No se pudieron guardar %d recomendaciones", len(batch))
+
+
+# Singleton instance
+recommendation_log = RecommendationLogWriter.from_settings()
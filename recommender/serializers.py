@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import ProductRecommendation
 
@@ -13,12 +14,24 @@ class RecommendationInputSerializer(serializers.Serializer):
         min_length=2,
         max_length=2
     )
+    k = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=settings.RECOMMENDER_MAX_K,
+        help_text="Número máximo de productos recomendados (por defecto RECOMMENDER_DEFAULT_K)"
+    )
+    min_score = serializers.FloatField(
+        required=False,
+        min_value=0.0,
+        max_value=1.0,
+        help_text="Score mínimo de un producto para ser recomendado (por defecto el umbral del motor)"
+    )
 
 class RecommendationOutputSerializer(serializers.Serializer):
     """
     Serializer para la salida de recomendaciones
     
-    Devuelve los productos de entrada y los productos recomendados
+    Devuelve los productos de entrada y los productos recomendados, ordenados por score
     """
     input = serializers.ListField(
         child=serializers.IntegerField(),
@@ -28,6 +41,51 @@ class RecommendationOutputSerializer(serializers.Serializer):
         child=serializers.IntegerField(),
         help_text="Lista de IDs de productos recomendados"
     )
+    scores = serializers.ListField(
+        child=serializers.FloatField(),
+        required=False,
+        help_text="Score de cada producto recomendado, en el mismo orden que suggested"
+    )
+
+class RecommendationBatchInputSerializer(serializers.Serializer):
+    """
+    Serializer para la entrada de recomendaciones por lotes
+    
+    Espera una lista de entradas, cada una con exactamente 2 IDs de productos
+    """
+    inputs = serializers.ListField(
+        child=serializers.ListField(
+            child=serializers.IntegerField(),
+            min_length=2,
+            max_length=2
+        ),
+        help_text="Lista de entradas; cada entrada es una lista de exactamente 2 IDs de productos",
+        min_length=1,
+        max_length=settings.RECOMMENDER_MAX_BATCH_SIZE
+    )
+    k = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=settings.RECOMMENDER_MAX_K,
+        help_text="Número máximo de productos recomendados por entrada"
+    )
+    min_score = serializers.FloatField(
+        required=False,
+        min_value=0.0,
+        max_value=1.0,
+        help_text="Score mínimo de un producto para ser recomendado"
+    )
+
+class RecommendationBatchOutputSerializer(serializers.Serializer):
+    """
+    Serializer para la salida de recomendaciones por lotes
+    
+    Devuelve un resultado por cada entrada, en el mismo orden
+    """
+    results = RecommendationOutputSerializer(
+        many=True,
+        help_text="Recomendaciones para cada entrada, en el mismo orden que la petición"
+    )
 
 class ProductRecommendationSerializer(serializers.ModelSerializer):
     """
@@ -1,10 +1,48 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+import asyncio
 import json
-from .recommendation import recommendation_system
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from unittest import mock
+from .ann import IVFIndex
+from .artifacts import ArtifactError
+from .batcher import MicroBatcher
+from .cache import RecommendationCache
+from .models import ProductRecommendation
+from .recorder import RecommendationLogWriter
+import numpy as np
+import scipy.sparse as sp
+from ast import literal_eval
+from sklearn.preprocessing import MultiLabelBinarizer
+from .datasets import build_training_data, generate_orders, iter_baskets_csv, iter_examples, write_orders_csv
+from .engines import CooccurrenceEngine, EmbeddingEngine, ForestEngine
+from .evaluation import average_metrics, group_split, holdout_score, holdout_split, ranking_metric_sums
+from .fallback import PopularityFallback
+from .executor import ExecutorFull, InferenceExecutor, inference_executor
+from .ingest import parse_id_lists, parse_lists, read_id_lists
+from .jobs import TrainingJobManager, training_jobs
+from .metrics import Registry, fallbacks
+from .recommendation import RecommendationSystem, recommendation_system
+from .topk import top_k
+from .visualization import TrainingImageCache, training_images
+from .vocabulary import ProductVocabulary
 
+# Los artefactos generados durante las pruebas no deben tocar models/
+TEST_MODEL_DIR = tempfile.mkdtemp()
+TEST_MODEL_PATH = os.path.join(TEST_MODEL_DIR, 'recommender.joblib')
+
+
+@override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH, RECOMMENDER_LOG_ASYNC=False)
 class RecommendationAPITests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -23,6 +61,26 @@ class RecommendationAPITests(TestCase):
         self.assertEqual(response.data['input'], [1001, 1003])
         self.assertIsInstance(response.data['suggested'], list)
     
+    def test_recommendation_is_logged(self):
+        """Test each recommendation is stored in the database"""
+        url = reverse('get_recommendations')
+        response = self.client.post(url, {"input": [1002, 1003]}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        log = ProductRecommendation.objects.get()
+        self.assertEqual(log.input_products, [1002, 1003])
+        self.assertEqual(log.recommended_products, response.data['suggested'])
+    
+    def test_internal_error_is_logged(self):
+        """An unexpected error is logged with its traceback and answered with a 500"""
+        url = reverse('get_recommendations')
+        with mock.patch('recommender.views.recommendation_batcher.rank', side_effect=RuntimeError('boom')):
+            with self.assertLogs('recommender.views', 'ERROR') as logs:
+                response = self.client.post(url, {"input": [1001, 1003]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertIn('RuntimeError: boom', logs.output[0])
+
     def test_invalid_input(self):
         """Test the recommendation API endpoint with invalid input"""
         url = reverse('get_recommendations')
@@ -31,11 +89,1279 @@ class RecommendationAPITests(TestCase):
         
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
     
+    def test_recommendations_top_k(self):
+        """Test k caps the response and scores come back sorted"""
+        url = reverse('get_recommendations')
+        data = {"input": [1002, 1003], "k": 1, "min_score": 0.0}
+        response = self.client.post(url, data, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['suggested']), 1)
+        self.assertEqual(len(response.data['scores']), 1)
+    
+    def test_invalid_top_k(self):
+        """Test k and min_score are validated"""
+        url = reverse('get_recommendations')
+        for extra in ({"k": 0}, {"min_score": 1.5}):
+            data = {"input": [1002, 1003], **extra}
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_get_batch_recommendations(self):
+        """Test the batch recommendation API endpoint"""
+        url = reverse('get_batch_recommendations')
+        data = {"inputs": [[1002, 1003], [1001, 1005], [1003, 1005]]}
+        response = self.client.post(url, data, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+        for item, input_products in zip(response.data['results'], data['inputs']):
+            self.assertEqual(item['input'], input_products)
+            self.assertEqual(item['suggested'], recommendation_system.predict(input_products))
+    
+    def test_invalid_batch_input(self):
+        """Test the batch endpoint rejects entries without exactly 2 products"""
+        url = reverse('get_batch_recommendations')
+        data = {"inputs": [[1002, 1003], [1001]]}
+        response = self.client.post(url, data, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
     def test_train_model(self):
         """Test the training API endpoint"""
         url = reverse('train_model')
         response = self.client.get(url)
         
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn('job_id', response.data)
+        job = training_jobs.wait(response.data['job_id'], timeout=60)
+        self.assertEqual(job.status, 'succeeded', job.error)
+        
+        response = self.client.get(reverse('training_status', args=[job.id]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('message', response.data)
-        self.assertIn('products', response.data)
+        self.assertEqual(response.data['version'], recommendation_system.metadata['version'])
+    
+    def test_unknown_training_job(self):
+        """Test the training status endpoint with an unknown job"""
+        response = self.client.get(reverse('training_status', args=['missing']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH)
+class ModelArtifactTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def test_save_and_load_roundtrip(self):
+        """A loaded artifact predicts like the model that produced it"""
+        trained = RecommendationSystem()
+        trained.train()
+        path = trained.save(os.path.join(self.tmp_dir, 'model.joblib'))
+
+        loaded = RecommendationSystem()
+        loaded.load(path)
+
+        self.assertTrue(loaded.is_trained)
+        self.assertEqual(loaded.metadata, trained.metadata)
+        self.assertEqual(loaded.get_all_products(), trained.get_all_products())
+        self.assertEqual(loaded.predict([1002, 1003]), trained.predict([1002, 1003]))
+
+    def test_stale_artifact_is_rejected(self):
+        """An artifact trained on a different dataset is not loaded"""
+        trained = RecommendationSystem()
+        trained.train()
+        path = trained.save(os.path.join(self.tmp_dir, 'model.joblib'))
+
+        other_dataset = os.path.join(self.tmp_dir, 'other.csv')
+        with open(other_dataset, 'w') as f:
+            f.write('input,target\n"[1,2]","[3]"\n')
+
+        with self.assertRaises(ArtifactError):
+            RecommendationSystem().load(path, dataset_path=other_dataset)
+
+    def test_ensure_trained_loads_existing_artifact(self):
+        """ensure_trained reuses the persisted model instead of retraining"""
+        trained = RecommendationSystem()
+        trained.train()
+        trained.save()
+
+        system = RecommendationSystem()
+        system.ensure_trained()
+
+        self.assertEqual(system.metadata['version'], trained.metadata['version'])
+
+    def test_artifact_of_another_dataset_is_kept(self):
+        """An artifact trained on a non-default dataset round-trips through ensure_trained"""
+        orders = os.path.join(self.tmp_dir, 'orders.csv')
+        with open(orders, 'w') as f:
+            f.write("pedido_id,producto_id\n1,2001\n1,2002\n1,2003\n2,2002\n2,2003\n2,2004\n")
+        trained = RecommendationSystem()
+        trained.train_from_orders(orders)
+        path = trained.save()
+
+        system = RecommendationSystem()
+        system.ensure_trained()
+        self.assertEqual(system.metadata['version'], trained.metadata['version'])
+        self.assertEqual(system.get_all_products(), [2001, 2002, 2003, 2004])
+
+        # Aunque ese dataset cambie, el artefacto no se reemplaza por uno del CSV por defecto
+        with open(orders, 'a') as f:
+            f.write("3,2001\n3,2004\n3,2005\n")
+        mtime = os.stat(path).st_mtime
+        with self.assertLogs('recommender.recommendation', 'WARNING'):
+            stale = RecommendationSystem()
+            stale.ensure_trained()
+        self.assertEqual(stale.metadata['version'], trained.metadata['version'])
+        self.assertEqual(os.stat(path).st_mtime, mtime)
+
+    def test_changed_default_dataset_is_retrained(self):
+        """An artifact of the configured dataset is retrained once that dataset changes"""
+        dataset = os.path.join(self.tmp_dir, 'dataset.csv')
+        shutil.copy(settings.RECOMMENDER_DATASET_PATH, dataset)
+        with override_settings(RECOMMENDER_DATASET_PATH=dataset):
+            trained = RecommendationSystem()
+            trained.train()
+            trained.save()
+            with open(dataset, 'a') as f:
+                f.write('"[1001,1007]","[1003]"\n')
+
+            system = RecommendationSystem()
+            with self.assertLogs('recommender.recommendation', 'WARNING'):
+                system.ensure_trained()
+        self.assertNotEqual(system.metadata['version'], trained.metadata['version'])
+        self.assertEqual(system.metadata['dataset_path'], dataset)
+
+    def test_concurrent_workers_train_once(self):
+        """Without an artifact, one worker trains and the others load what it saved"""
+        build_model = RecommendationSystem.build_model
+        calls = []
+
+        def counting_build_model(system, *args, **kwargs):
+            calls.append(system)
+            return build_model(system, *args, **kwargs)
+
+        # Sistemas distintos: cada uno con su propio candado de hilo, como workers separados
+        systems = [RecommendationSystem() for _ in range(4)]
+        with override_settings(RECOMMENDER_MODEL_PATH=os.path.join(self.tmp_dir, 'model.joblib')), \
+                mock.patch.object(RecommendationSystem, 'build_model', counting_build_model):
+            threads = [threading.Thread(target=system.ensure_trained) for system in systems]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(60)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({system.metadata['version'] for system in systems}), 1)
+
+    @override_settings(RECOMMENDER_MODEL_MMAP=True)
+    def test_arrays_are_memory_mapped(self):
+        """The large arrays of a loaded artifact are read-only views of the file"""
+        trained = RecommendationSystem()
+        trained.train(engine='forest')
+        path = trained.save(os.path.join(self.tmp_dir, 'model.joblib'))
+
+        loaded = RecommendationSystem()
+        loaded.load(path)
+
+        compiled = loaded.engine.compiled_
+        self.assertIsInstance(compiled.threshold, np.memmap)
+        self.assertFalse(compiled.threshold.flags.writeable)
+        self.assertIsInstance(loaded.topk.items, np.memmap)
+        self.assertEqual(loaded.engine.estimators_, [])
+        self.assertEqual(loaded.predict([1002, 1003]), trained.predict([1002, 1003]))
+
+
+class CooccurrenceEngineTests(TestCase):
+    def setUp(self):
+        self.system = RecommendationSystem()
+        self.system.train(engine='cooccurrence')
+
+    def test_engine_is_selected(self):
+        """train() uses the requested engine"""
+        self.assertIsInstance(self.system.engine, CooccurrenceEngine)
+        self.assertEqual(self.system.metadata['engine'], 'cooccurrence')
+
+    def test_predict_returns_cooccurring_targets(self):
+        """A seen pair recommends the products that followed it"""
+        self.assertEqual(self.system.predict([1001, 1005]), [1003, 1007])
+        self.assertEqual(self.system.predict([1005, 1001]), [1003, 1007])
+
+    def test_rules_metrics(self):
+        """rules() reports support, confidence and lift for a pair"""
+        classes = self.system.vocabulary.ids.tolist()
+        targets, support, confidence, lift = self.system.engine.rules(
+            classes.index(1002), classes.index(1003)
+        )
+        self.assertEqual([classes[t] for t in targets], [1007])
+        self.assertAlmostEqual(support[0], 1 / 5)
+        self.assertAlmostEqual(confidence[0], 1.0)
+        self.assertAlmostEqual(lift[0], 5 / 3)
+
+    def test_retrieve_matches_dense_scores(self):
+        """The sparse ranking equals top_k over predict_scores, without a catalog-wide row"""
+        rng = np.random.RandomState(0)
+        X = sp.csr_matrix((rng.rand(400, 30) < 0.08).astype(np.int64))
+        Y = sp.csr_matrix((rng.rand(400, 30) < 0.15).astype(np.int64))
+        engine = CooccurrenceEngine(min_support=2).fit(X, Y)
+
+        # Pares vistos, pares no vistos y entradas de 3 productos
+        Q = sp.csr_matrix((rng.rand(50, 30) < 0.1).astype(np.int64))
+        Q = sp.vstack([X[:50], Q]).tocsr()
+        dense = engine.predict_scores(Q)
+        dense[dense <= 0] = -np.inf
+        dense[Q.nonzero()] = -np.inf
+        _, expected_scores = top_k(dense, 5)
+
+        # Los empates en el corte k pueden resolverse con otra columna del mismo score
+        columns, scores = engine.retrieve(Q, 5)
+        np.testing.assert_allclose(scores, expected_scores)
+        rows, ranks = np.nonzero(columns >= 0)
+        np.testing.assert_allclose(dense[rows, columns[rows, ranks]], scores[rows, ranks])
+        self.assertTrue((scores[columns < 0] == -np.inf).all())
+
+    def test_retrieve_pairs_matches_retrieve(self):
+        """Ranking by pair key equals retrieve() on the same 2-product inputs, seen or not"""
+        rng = np.random.RandomState(1)
+        X = sp.csr_matrix((rng.rand(400, 30) < 0.08).astype(np.int64))
+        Y = sp.csr_matrix((rng.rand(400, 30) < 0.15).astype(np.int64))
+        engine = CooccurrenceEngine(min_support=2).fit(X, Y)
+
+        # Las claves del índice más pares que pueden no tener reglas
+        keys = np.union1d(engine.pair_keys, [0 * 30 + 1, 28 * 30 + 29])
+        first, second = keys // 30, keys % 30
+        Q = sp.csr_matrix(
+            (np.ones(2 * len(keys), dtype=np.int64),
+             (np.repeat(np.arange(len(keys)), 2), np.column_stack([first, second]).ravel())),
+            shape=(len(keys), 30),
+        )
+        expected_columns, expected_scores = engine.retrieve(Q, 5)
+        columns, scores = engine.retrieve_pairs(keys, 5)
+        np.testing.assert_array_equal(columns, expected_columns)
+        np.testing.assert_allclose(scores, expected_scores)
+
+
+class TopKTableTests(TestCase):
+    def test_table_covers_observed_pairs(self):
+        """Every input pair of the dataset gets a precomputed row"""
+        system = RecommendationSystem()
+        system.train()
+
+        self.assertEqual(len(system.topk), 5)
+        self.assertEqual(system.metadata['n_precomputed_pairs'], 5)
+
+    def test_table_matches_engine(self):
+        """Table lookups return the same products as the engine"""
+        for engine in ('forest', 'cooccurrence'):
+            with self.subTest(engine=engine):
+                with_table = RecommendationSystem()
+                with_table.train(engine=engine)
+                with override_settings(RECOMMENDER_TOPK_ENABLED=False):
+                    without_table = RecommendationSystem()
+                    without_table.train(engine=engine)
+
+                self.assertIsNone(without_table.topk)
+                for pair in ([1001, 1005], [1003, 1005], [1002, 1007]):
+                    self.assertCountEqual(with_table.predict(pair), without_table.predict(pair))
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        self.system = RecommendationSystem()
+        self.system.train()
+
+    def test_scores_are_sorted(self):
+        """Products come back best first with one score each"""
+        [(products, scores)] = self.system.rank_many([[1003, 1005]], min_score=0.0)
+        self.assertEqual(len(products), len(scores))
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertNotIn(1003, products)
+        self.assertNotIn(1005, products)
+
+    def test_k_and_min_score(self):
+        """k caps the list and min_score drops low-scoring products"""
+        [(products, scores)] = self.system.rank_many([[1003, 1005]], k=2, min_score=0.0)
+        self.assertLessEqual(len(products), 2)
+
+        [(all_products, all_scores)] = self.system.rank_many([[1003, 1005]], min_score=0.0)
+        cutoff = all_scores[0]
+        [(products, scores)] = self.system.rank_many([[1003, 1005]], min_score=cutoff)
+        self.assertTrue(all(score >= cutoff for score in scores))
+        self.assertEqual(products, all_products[:len(products)])
+
+    def test_table_and_engine_agree(self):
+        """A k larger than the table bypasses it with the same ranking"""
+        [(from_table, table_scores)] = self.system.rank_many([[1003, 1005]], min_score=0.0)
+        [(from_engine, engine_scores)] = self.system.rank_many(
+            [[1003, 1005]], k=self.system.topk.k + 1, min_score=0.0
+        )
+        self.assertEqual(from_table, from_engine)
+        self.assertEqual(table_scores, engine_scores)
+
+
+class RecommendationCacheTests(TestCase):
+    def test_repeated_pair_is_served_from_cache(self):
+        """The same pair in any order is computed once per model version"""
+        system = RecommendationSystem()
+        system.train()
+
+        first = system.predict([1003, 1005])
+        with mock.patch.object(system, '_rank', side_effect=AssertionError("no debería recalcular")):
+            self.assertEqual(system.predict([1005, 1003]), first)
+        self.assertEqual(system.cache.hits, 1)
+
+    def test_retraining_invalidates_cache(self):
+        """A new model version never reads entries of the previous one"""
+        system = RecommendationSystem()
+        system.train()
+        system.predict([1003, 1005])
+
+        system.train(engine='cooccurrence')
+        self.assertEqual(len(system.cache), 0)
+        self.assertEqual(system.predict([1001, 1005]), [1003, 1007])
+
+    def test_lru_eviction_and_ttl(self):
+        """The least recently used entry is evicted and expired entries miss"""
+        cache = RecommendationCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+        with mock.patch('recommender.cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(cache.get('a'))
+
+
+@override_settings(RECOMMENDER_LOG_ASYNC=True)
+class RecommendationLogWriterTests(TransactionTestCase):
+    def test_rows_are_flushed_in_background(self):
+        """Queued rows reach the database after flush()"""
+        writer = RecommendationLogWriter(batch_size=2, flush_interval=0.05)
+        self.addCleanup(writer.stop)
+        writer.record_many([([1, 2], [3]), ([1, 3], [2]), ([2, 3], [1])])
+        writer.flush()
+
+        self.assertEqual(ProductRecommendation.objects.count(), 3)
+
+    def test_drop_policy_when_queue_is_full(self):
+        """With a full queue the drop policy discards rows instead of blocking"""
+        writer = RecommendationLogWriter(max_queue_size=1, policy='drop')
+        with mock.patch.object(writer, '_start'):
+            writer.record([1, 2], [3])
+            writer.record([1, 3], [2])
+
+        self.assertEqual(writer.dropped, 1)
+
+
+class SparseTrainingTests(TestCase):
+    def test_training_uses_sparse_matrices(self):
+        """Inputs are binarized to CSR both in training and in predict"""
+        system = RecommendationSystem()
+        system.train()
+
+        self.assertTrue(sp.issparse(system.vocabulary.transform([[1001, 1003]])))
+
+    def test_forest_sparse_matches_dense(self):
+        """Fitting the forest on CSR matrices gives the same scores as dense arrays"""
+        X = np.array([[1, 1, 0, 0], [1, 0, 1, 0], [0, 1, 1, 0], [0, 1, 0, 1]])
+        Y = np.array([[0, 0, 1, 0], [0, 1, 0, 1], [1, 0, 0, 1], [1, 0, 1, 0]])
+
+        dense = ForestEngine(n_estimators=10).fit(X, Y)
+        sparse = ForestEngine(n_estimators=10).fit(sp.csr_matrix(X), sp.csr_matrix(Y))
+
+        np.testing.assert_array_equal(dense.predict_scores(X), sparse.predict_scores(sp.csr_matrix(X)))
+
+    def test_forest_parallel_matches_sequential(self):
+        """Fitting the columns in a process pool gives the same forests as one process"""
+        X = sp.csr_matrix(np.array([[1, 1, 0, 0], [1, 0, 1, 0], [0, 1, 1, 0], [0, 1, 0, 1]]))
+        Y = sp.csr_matrix(np.array([[0, 0, 1, 0], [0, 1, 0, 1], [1, 0, 0, 1], [1, 0, 1, 0]]))
+
+        sequential = ForestEngine(n_estimators=10, n_jobs=1).fit(X, Y)
+        parallel = ForestEngine(n_estimators=10, n_jobs=2).fit(X, Y)
+
+        self.assertEqual(len(parallel.estimators_), Y.shape[1])
+        np.testing.assert_array_equal(sequential.predict_scores(X), parallel.predict_scores(X))
+
+
+class CompiledForestTests(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = sp.csr_matrix((rng.rand(200, 12) < 0.2).astype(int))
+        Y = (rng.rand(200, 5) < 0.3).astype(int)
+        # Un producto que nunca se compra: su bosque solo ve la clase 0
+        Y[:, 4] = 0
+        self.engine = ForestEngine(n_estimators=20).fit(self.X, sp.csr_matrix(Y))
+
+    def sklearn_scores(self, X):
+        compiled, self.engine.compiled_ = self.engine.compiled_, None
+        try:
+            return self.engine.predict_scores(X)
+        finally:
+            self.engine.compiled_ = compiled
+
+    def test_matches_sklearn_exactly(self):
+        """The flattened trees give bit-for-bit the forests' predict_proba"""
+        np.testing.assert_array_equal(self.engine.predict_scores(self.X), self.sklearn_scores(self.X))
+        self.assertFalse(self.engine.predict_scores(self.X)[:, 4].any())
+
+    def test_batched_single_row(self):
+        """Batching and single-row inputs do not change the scores"""
+        expected = self.sklearn_scores(self.X)
+        np.testing.assert_array_equal(self.engine.compiled_.predict_proba(self.X, max_batch_cells=1000), expected)
+        np.testing.assert_array_equal(self.engine.predict_scores(self.X[3]), expected[3:4])
+
+class IngestTests(TestCase):
+    VALUES = ["[1001,1003]", "[ 1002, 1007 ]", "[]", "[1005]", "[1001, 1003, 1007]"]
+
+    def test_parse_matches_literal_eval(self):
+        """Bulk parsers produce the same lists as literal_eval"""
+        expected = [literal_eval(v) for v in self.VALUES]
+        self.assertEqual(parse_id_lists(self.VALUES).tolist(), expected)
+        self.assertEqual(parse_lists(self.VALUES), expected)
+
+    def test_malformed_lists_are_rejected(self):
+        """A cell that is not a list of integers raises ValueError"""
+        with self.assertRaises(ValueError):
+            parse_id_lists(["[1001,1003]", "[1002,abc]"])
+
+    def test_chunked_read_matches_full_read(self):
+        """Reading the CSV by chunks gives the same data as a single read"""
+        full = read_id_lists(settings.RECOMMENDER_DATASET_PATH)
+        chunked = read_id_lists(settings.RECOMMENDER_DATASET_PATH, chunksize=2)
+        for column in ('input', 'target'):
+            self.assertEqual(full[column].tolist(), chunked[column].tolist())
+
+    def test_to_csr_matches_multilabel_binarizer(self):
+        """Binarizing from flat IDs matches MultiLabelBinarizer, unknown IDs dropped"""
+        lists = parse_id_lists(self.VALUES + ["[1001,9999]"])
+        classes = np.array([1001, 1002, 1003, 1005])
+        mlb = MultiLabelBinarizer(classes=classes.tolist())
+        with self.assertWarns(UserWarning):
+            expected = mlb.fit_transform(lists.tolist())
+
+        np.testing.assert_array_equal(lists.to_csr(classes).toarray(), expected)
+
+
+class OrderDatasetTests(TestCase):
+    # Detalle de pedidos de csv_structure.md, con el pedido 1 repetido como pedido 4
+    ORDER_LINES = (
+        "pedido_id,producto_id\n"
+        "1,1001\n1,1003\n1,1005\n"
+        "2,1002\n2,1003\n2,1007\n"
+        "3,1001\n3,1005\n3,1007\n"
+        "4,1005\n4,1001\n4,1003\n"
+    )
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        self.path = os.path.join(tmp_dir, 'orders.csv')
+        with open(self.path, 'w') as f:
+            f.write(self.ORDER_LINES)
+
+    def test_baskets_span_chunks(self):
+        """Orders split across CSV chunks are reassembled"""
+        baskets = list(iter_baskets_csv(self.path, chunksize=2))
+        self.assertEqual([order for order, _ in baskets], [1, 2, 3, 4])
+        self.assertEqual(baskets[0][1], [1001, 1003, 1005])
+
+    def test_examples_match_documented_expansion(self):
+        """Each basket yields every m=2 input with the rest as target"""
+        examples = list(iter_examples([(1, [1001, 1003, 1005])]))
+        self.assertEqual(examples, [
+            ((1001, 1003), (1005,)),
+            ((1001, 1005), (1003,)),
+            ((1003, 1005), (1001,)),
+        ])
+
+    def test_combinations_are_capped(self):
+        """Large baskets are sampled down to max_combinations inputs"""
+        examples = list(iter_examples([(1, list(range(20)))], max_combinations=7))
+        self.assertEqual(len(examples), 7)
+        self.assertEqual(len(set(examples)), 7)
+
+    def test_duplicates_become_weights(self):
+        """Identical examples are stored once with their count"""
+        inputs, targets, weights = build_training_data(iter_examples(iter_baskets_csv(self.path)))
+        self.assertEqual(len(inputs), 9)
+        self.assertEqual(int(weights.sum()), 12)
+        rows = inputs.tolist()
+        self.assertEqual(weights[rows.index([1001, 1003])], 2)
+
+    def test_train_from_orders(self):
+        """A model trained from order lines weights repeated baskets"""
+        system = RecommendationSystem()
+        system.train_from_orders(self.path, engine='cooccurrence')
+
+        self.assertEqual(system.metadata['n_examples'], 12)
+        self.assertEqual(system.metadata['n_unique_examples'], 9)
+        self.assertEqual(system.predict([1001, 1003]), [1005])
+
+
+@override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH)
+class BackgroundTrainingTests(TestCase):
+    def test_job_swaps_model(self):
+        """A finished job installs and saves a new model version"""
+        system = RecommendationSystem()
+        system.train()
+        old_model = system.model
+
+        jobs = TrainingJobManager()
+        job = jobs.wait(jobs.submit(system, engine='cooccurrence').id, timeout=60)
+
+        self.assertEqual(job.status, 'succeeded', job.error)
+        self.assertEqual(job.progress, 1.0)
+        self.assertIsNot(system.model, old_model)
+        self.assertEqual(system.metadata['engine'], 'cooccurrence')
+        self.assertEqual(job.version, system.metadata['version'])
+        self.assertTrue(os.path.exists(TEST_MODEL_PATH))
+
+    def test_in_flight_request_keeps_old_model(self):
+        """A swap during ranking does not mix the old and new models"""
+        system = RecommendationSystem()
+        system.train(engine='cooccurrence')
+        old_model = system.model
+        new_model = system.build_model(engine='forest')
+        original = old_model.engine.retrieve
+
+        def swap_then_score(X, k):
+            system.install(new_model)
+            return original(X, k)
+
+        # Un k mayor que la tabla top-K obliga a puntuar con el motor
+        with mock.patch.object(old_model.engine, 'retrieve', side_effect=swap_then_score) as scored:
+            system.rank_many([[1001, 1003]], k=settings.RECOMMENDER_TOPK_SIZE + 1)
+
+        scored.assert_called_once()
+        self.assertIs(system.model, new_model)
+
+    def test_failed_job_keeps_model(self):
+        """A failing job reports the error and leaves the current model in place"""
+        system = RecommendationSystem()
+        system.train()
+        old_model = system.model
+
+        jobs = TrainingJobManager()
+        job = jobs.wait(jobs.submit(system, file_path='/nonexistent.csv').id, timeout=60)
+
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.error)
+        self.assertIs(system.model, old_model)
+
+
+@override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH)
+class TrainingVisualizationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        override = override_settings(RECOMMENDER_VISUALIZATION_DIR=tmp_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        recommendation_system.train()
+
+    def test_image_rendered_once_per_version(self):
+        """The figure is rendered once and then served from memory or disk"""
+        renderer = mock.Mock(return_value=b'\x89PNG')
+        images = TrainingImageCache(renderer=renderer)
+        metadata = recommendation_system.metadata
+
+        self.assertEqual(images.get(metadata).content, b'\x89PNG')
+        images.get(metadata)
+        TrainingImageCache(renderer=renderer).get(metadata)
+
+        renderer.assert_called_once_with(metadata)
+
+    def test_image_conditional_get(self):
+        """The PNG is served with an ETag and a matching request gets a 304"""
+        url = reverse('training_visualization_image')
+        with mock.patch.object(training_images, 'renderer', return_value=b'\x89PNG'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(response.content, b'\x89PNG')
+            self.assertIn('Last-Modified', response)
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_views_reference_image_url(self):
+        """The JSON view returns the image URL instead of embedding base64"""
+        response = self.client.get(reverse('training_visualization'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(reverse('training_visualization_image'), response.data['image'])
+        self.assertFalse(response.data['image'].startswith('data:'))
+        self.assertEqual(response.data['version'], recommendation_system.metadata['version'])
+
+
+@override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH)
+class TrainingMetricsTests(TestCase):
+    def test_stages_and_dataset_are_recorded(self):
+        """Training records timings, memory and dataset statistics per stage"""
+        system = RecommendationSystem()
+        system.trace_memory = True
+        system.train()
+        metrics = system.metadata['training_metrics']
+
+        self.assertEqual([s['name'] for s in metrics['stages']], ['load_csv', 'binarize', 'fit', 'topk', 'fallback'])
+        for recorded in metrics['stages']:
+            self.assertGreaterEqual(recorded['seconds'], 0)
+            self.assertGreaterEqual(recorded['peak_memory_bytes'], 0)
+        self.assertEqual(metrics['dataset']['input']['rows'], system.metadata['n_unique_examples'])
+        self.assertGreater(metrics['model_size_bytes'], 0)
+        # El dataset de ejemplo es demasiado pequeño para reservar un holdout
+        self.assertIsNone(metrics['holdout'])
+
+    def test_memory_is_not_traced_by_default(self):
+        """In-process training leaves tracemalloc off, so request threads are not slowed down"""
+        system = RecommendationSystem()
+        system.train()
+        metrics = system.metadata['training_metrics']
+
+        self.assertTrue(all(s['peak_memory_bytes'] is None for s in metrics['stages']))
+        self.assertIsNone(metrics['peak_memory_bytes'])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    @override_settings(RECOMMENDER_HOLDOUT_MIN_EXAMPLES=1, RECOMMENDER_HOLDOUT_FRACTION=0.5)
+    def test_holdout_is_scored(self):
+        """With a holdout, a separate engine is scored on it and the served model keeps every row"""
+        system = RecommendationSystem()
+        system.train(engine='cooccurrence')
+        metrics = system.metadata['training_metrics']
+
+        self.assertEqual(metrics['stages'][-1]['name'], 'evaluate')
+        self.assertGreater(metrics['holdout']['n_examples'], 0)
+        self.assertGreaterEqual(metrics['holdout']['f1'], 0.0)
+        self.assertEqual(system.metadata['n_unique_examples'], 5)
+        self.assertEqual(len(system.topk), 5)
+        self.assertEqual(system.predict([1001, 1005]), [1003, 1007])
+
+    @override_settings(RECOMMENDER_HOLDOUT_MIN_EXAMPLES=1, RECOMMENDER_HOLDOUT_FRACTION=0.3)
+    def test_order_holdout_is_split_by_order(self):
+        """No order contributes examples to both the scored engine and the holdout"""
+        # Pedidos con productos propios: los productos de un ejemplo identifican su pedido
+        orders = np.repeat(np.arange(40), 4)
+        products = 1000 + np.arange(160)
+        path = os.path.join(tempfile.mkdtemp(), 'orders.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        write_orders_csv(path, orders, products)
+
+        system = RecommendationSystem()
+        X, Y, classes, _ = system.load_orders(path)
+        X_train, Y_train, _, X_holdout, Y_holdout = system._order_holdout(path, classes)
+
+        self.assertGreater(X_holdout.shape[0], 0)
+        self.assertEqual(X_train.shape[0] + X_holdout.shape[0], X.shape[0])
+        trained = np.unique((X_train + Y_train).indices)
+        held = np.unique((X_holdout + Y_holdout).indices)
+        self.assertEqual(len(np.intersect1d(trained, held)), 0)
+
+    def test_example_prediction_comes_from_the_model(self):
+        """The training figure's example is a precomputed pair with its best recommendations"""
+        system = RecommendationSystem()
+        system.train(engine='cooccurrence')
+        example = system.metadata['training_metrics']['example_prediction']
+
+        products, scores = system.rank_many([example['input']], k=len(example['recommended']), min_score=0)[0]
+        self.assertEqual(example['recommended'], list(products))
+        self.assertAlmostEqual(example['score'], scores[0])
+
+    def test_holdout_split(self):
+        """The split is reproducible, disjoint and skipped for small datasets"""
+        train, holdout = holdout_split(5000, fraction=0.1, min_examples=1000)
+        self.assertEqual(len(holdout), 500)
+        self.assertEqual(len(np.intersect1d(train, holdout)), 0)
+        np.testing.assert_array_equal(holdout, holdout_split(5000, fraction=0.1, min_examples=1000)[1])
+        self.assertEqual(len(holdout_split(10, fraction=0.1, min_examples=1000)[1]), 0)
+
+    def test_holdout_split_keeps_groups_together(self):
+        """With groups, every group lands on one side and the holdout is capped"""
+        groups = np.repeat(np.arange(500), 10)
+        train, holdout = holdout_split(5000, fraction=0.2, min_examples=0, max_rows=300, groups=groups)
+        self.assertEqual(len(holdout), 300)
+        self.assertEqual(len(np.intersect1d(groups[train], groups[holdout])), 0)
+
+    def test_holdout_score(self):
+        """Precision and recall are micro-averaged over every predicted product"""
+        engine = mock.Mock()
+        engine.predict.return_value = np.array([[1, 1, 0], [0, 0, 1]])
+        Y = sp.csr_matrix(np.array([[1, 0, 0], [0, 1, 1]]))
+
+        score = holdout_score(engine, sp.csr_matrix((2, 3)), Y)
+
+        self.assertAlmostEqual(score['precision'], 2 / 3)
+        self.assertAlmostEqual(score['recall'], 2 / 3)
+
+    def test_holdout_batches_follow_catalog_size(self):
+        """Each predict call covers at most max_batch_cells dense cells"""
+        engine = mock.Mock()
+        engine.predict.side_effect = lambda X: np.zeros(X.shape, dtype=np.int64)
+
+        holdout_score(engine, sp.csr_matrix((10, 4)), sp.csr_matrix((10, 4)), max_batch_cells=12)
+
+        self.assertEqual([call.args[0].shape[0] for call in engine.predict.call_args_list], [3, 3, 3, 1])
+
+    def test_metrics_endpoint(self):
+        """The metrics endpoint exposes the metrics of the model in use"""
+        recommendation_system.train()
+        response = APIClient().get(reverse('training_metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], recommendation_system.metadata['version'])
+        self.assertIn('stages', response.data['metrics'])
+
+
+class BenchmarkTests(TestCase):
+    def test_generate_orders(self):
+        """Synthetic orders are reproducible, grouped by order and without repeated products"""
+        orders, products = generate_orders(n_products=50, n_orders=200, seed=1)
+        again = generate_orders(n_products=50, n_orders=200, seed=1)
+
+        np.testing.assert_array_equal(orders, again[0])
+        np.testing.assert_array_equal(products, again[1])
+        self.assertTrue((np.diff(orders) >= 0).all())
+        self.assertEqual(len(set(zip(orders.tolist(), products.tolist()))), len(orders))
+        self.assertTrue(((products >= 1001) & (products < 1051)).all())
+
+    def test_benchmark_command(self):
+        """The benchmark command writes one JSON result per dataset and engine"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        output = os.path.join(tmp_dir, 'results.json')
+
+        call_command(
+            'benchmark_recommender', '--products', '30', '--orders', '100', '200',
+            '--engines', 'cooccurrence', '--requests', '5', '--batches', '2', '--batch-size', '4',
+            '--data-dir', tmp_dir, '--output', output, stderr=open(os.devnull, 'w'),
+        )
+        with open(output) as f:
+            report = json.load(f)
+
+        self.assertEqual(len(report['results']), 2)
+        result = report['results'][0]
+        self.assertEqual(result['engine'], 'cooccurrence')
+        self.assertEqual(result['single_request']['count'], 5)
+        self.assertIn('p99_ms', result['batch_request'])
+        self.assertGreater(result['train_seconds'], 0)
+
+
+
+class EvaluationTests(TestCase):
+    def test_group_split(self):
+        """Every group lands entirely in the training or the test rows"""
+        groups = np.repeat(np.arange(100), 3)
+        train, test = group_split(groups, test_fraction=0.3, seed=1)
+
+        self.assertEqual(len(train) + len(test), len(groups))
+        self.assertEqual(len(np.intersect1d(groups[train], groups[test])), 0)
+        self.assertGreater(len(test), 0)
+
+    def test_ranking_metrics(self):
+        """precision@k, recall@k and MAP of ranked recommendations, weighted per example"""
+        sums = ranking_metric_sums(
+            [[1, 2, 3], [4, 5], [6]], [[1, 3], [9], []], k_values=(2, 3), weights=[1, 3, 5],
+        )
+        metrics = average_metrics(sums)
+
+        # El tercer ejemplo no tiene targets y no cuenta
+        self.assertEqual(sums['weight'], 4)
+        self.assertAlmostEqual(metrics['precision@2'], (1 / 2) / 4)
+        self.assertAlmostEqual(metrics['recall@3'], 1 / 4)
+        self.assertAlmostEqual(metrics['map@3'], ((1 + 2 / 3) / 2) / 4)
+        self.assertAlmostEqual(metrics['map@2'], (1 / 2) / 4)
+
+    def test_evaluate_command(self):
+        """The evaluation command scores every engine on orders held out of training"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        orders = os.path.join(tmp_dir, 'orders.csv')
+        write_orders_csv(orders, *generate_orders(n_products=30, n_orders=300, seed=1))
+        output = os.path.join(tmp_dir, 'results.json')
+
+        call_command(
+            'evaluate_recommender', '--orders', orders, '--engines', 'cooccurrence', 'embedding',
+            '--workers', '1', '--chunk-size', '50', '--requests', '5',
+            '--output', output, stderr=open(os.devnull, 'w'),
+        )
+        with open(output) as f:
+            report = json.load(f)
+
+        self.assertGreater(report['split']['test_examples'], 0)
+        self.assertEqual([result['engine'] for result in report['results']], ['cooccurrence', 'embedding'])
+        for result in report['results']:
+            self.assertTrue(0.0 <= result['map@10'] <= 1.0)
+            self.assertEqual(result['single_request']['count'], 5)
+            self.assertGreater(result['model_size_bytes'], 0)
+        self.assertTrue(any(result['pareto_optimal'] for result in report['results']))
+
+@override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH, RECOMMENDER_LOG_ASYNC=False)
+class MetricsTests(TestCase):
+    def test_text_format(self):
+        """Counters and histograms are rendered in the Prometheus text format"""
+        registry = Registry()
+        requests = registry.counter('requests', 'Requests', labelnames=('endpoint',))
+        latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        requests.labels('a"b').inc()
+        latency.observe(0.05)
+        latency.observe(0.5)
+
+        text = registry.render()
+
+        self.assertIn('# TYPE requests counter', text)
+        self.assertIn('requests_total{endpoint="a\\"b"} 1.0', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1.0', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2.0', text)
+        self.assertIn('latency_seconds_count 2.0', text)
+
+    def test_endpoint_reports_request_stages(self):
+        """Serving a recommendation is reflected in the /metrics endpoint"""
+        client = APIClient()
+        recommendation_system.train()
+        client.post(reverse('get_recommendations'), {"input": [1002, 1003]}, format='json')
+        client.post(reverse('get_recommendations'), {"input": [1002]}, format='json')
+
+        response = client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        for stage in ('validate', 'predict', 'log', 'serialize'):
+            self.assertIn(f'recommender_request_stage_seconds_count{{endpoint="recommendations",stage="{stage}"}}', text)
+        self.assertIn('recommender_errors_total{endpoint="recommendations",kind="invalid_input"}', text)
+        self.assertIn(f'recommender_model_info{{version="{recommendation_system.metadata["version"]}"', text)
+
+    @override_settings(RECOMMENDER_METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_endpoint_is_local_only(self):
+        """Addresses outside RECOMMENDER_METRICS_ALLOWED_IPS are rejected"""
+        response = APIClient().get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH, RECOMMENDER_LOG_ASYNC=False)
+class AsyncRecommendationTests(TestCase):
+    def setUp(self):
+        recommendation_system.train()
+
+    def test_matches_sync_endpoint(self):
+        """The async endpoint answers like the DRF one and logs the recommendation"""
+        payload = {"input": [1002, 1003], "k": 2}
+        expected = APIClient().post(reverse('get_recommendations'), payload, format='json').json()
+        ProductRecommendation.objects.all().delete()
+
+        response = self.client.post(reverse('get_recommendations_async'), payload, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(ProductRecommendation.objects.count(), 1)
+
+    def test_batch(self):
+        payload = {"inputs": [[1001, 1002], [1002, 1003]]}
+        response = self.client.post(reverse('get_batch_recommendations_async'), payload, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['input'] for r in response.json()['results']], payload['inputs'])
+        self.assertEqual(ProductRecommendation.objects.count(), 2)
+
+    def test_invalid_input(self):
+        url = reverse('get_recommendations_async')
+        self.assertEqual(self.client.post(url, {"input": [1001]}, content_type='application/json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, 'no es json', content_type='application/json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_full_executor_returns_429(self):
+        with mock.patch.object(inference_executor, 'run', side_effect=ExecutorFull):
+            response = self.client.post(reverse('get_recommendations_async'), {"input": [1002, 1003]},
+                                        content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(ProductRecommendation.objects.count(), 0)
+
+    def test_executor_rejects_beyond_queue(self):
+        """Only max_workers + max_queue_size tasks are accepted at once"""
+        executor = InferenceExecutor(max_workers=1, max_queue_size=1)
+        release = threading.Event()
+
+        async def scenario():
+            running = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(ExecutorFull):
+                await executor.run(release.wait)
+            release.set()
+            await asyncio.gather(*running)
+            # Al terminar se liberan los huecos
+            return await executor.run(lambda: 42)
+
+        self.assertEqual(asyncio.run(scenario()), 42)
+        self.assertEqual(executor.rejected, 1)
+
+
+class MicroBatcherTests(TestCase):
+    class FakeSystem:
+        def __init__(self, error=None, precomputed=None):
+            self.calls = []
+            self.error = error
+            self.precomputed = precomputed or {}
+            # Retiene la primera llamada al modelo hasta que el test lo permita
+            self.entered = threading.Event()
+            self.release = threading.Event()
+            self.release.set()
+
+        def rank_precomputed(self, input_products, k=None, min_score=None):
+            return self.precomputed.get(tuple(input_products))
+
+        def rank_many(self, inputs, k=None, min_score=None, lookup_cache=True):
+            self.calls.append((inputs, k))
+            self.entered.set()
+            self.release.wait(5)
+            if self.error:
+                raise self.error
+            return [([sum(input_products)], [1.0]) for input_products in inputs]
+
+    def test_concurrent_inputs_share_one_call(self):
+        """Inputs queued while the model is busy are ranked together and duplicates once"""
+        system = self.FakeSystem()
+        system.release.clear()
+        batcher = MicroBatcher(system)
+        first = batcher.submit([9, 9])
+        self.assertTrue(system.entered.wait(5))
+
+        futures = [batcher.submit(pair) for pair in ([1, 2], [2, 1], [3, 4])]
+        system.release.set()
+
+        self.assertEqual(first.result(timeout=5), ((18,), (1.0,)))
+        self.assertEqual([f.result(timeout=5) for f in futures], [((3,), (1.0,)), ((3,), (1.0,)), ((7,), (1.0,))])
+        self.assertEqual(system.calls, [([[9, 9]], None), ([[1, 2], [3, 4]], None)])
+        batcher.stop()
+
+    def test_max_wait_collects_later_inputs(self):
+        """With max_wait the batch keeps taking inputs that arrive after the first one"""
+        system = self.FakeSystem()
+        batcher = MicroBatcher(system, max_wait=0.5)
+        futures = [batcher.submit([1, 2])]
+        time.sleep(0.05)
+        futures += [batcher.submit(pair) for pair in ([3, 4], [5, 6])]
+
+        self.assertEqual([f.result(timeout=5) for f in futures], [((3,), (1.0,)), ((7,), (1.0,)), ((11,), (1.0,))])
+        self.assertEqual(system.calls, [([[1, 2], [3, 4], [5, 6]], None)])
+        batcher.stop()
+
+    def test_batch_size_is_capped(self):
+        system = self.FakeSystem()
+        system.release.clear()
+        batcher = MicroBatcher(system, max_batch_size=2)
+        batcher.submit([9, 9])
+        self.assertTrue(system.entered.wait(5))
+
+        futures = [batcher.submit([p, p + 1]) for p in (1, 3, 5)]
+        system.release.set()
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual([len(inputs) for inputs, _ in system.calls], [1, 2, 1])
+        batcher.stop()
+
+    def test_precomputed_inputs_skip_the_queue(self):
+        """Cache and top-K hits are answered without queueing or calling the model"""
+        system = self.FakeSystem(precomputed={(1, 2): ([5], [0.9])})
+        batcher = MicroBatcher(system)
+
+        self.assertEqual(batcher.rank([1, 2]), ([5], [0.9]))
+        self.assertEqual(system.calls, [])
+        self.assertIsNone(batcher._thread)
+
+    def test_groups_by_options(self):
+        system = self.FakeSystem()
+        batcher = MicroBatcher(system)
+        futures = [batcher.submit([1, 2], k=1), batcher.submit([1, 2], k=2)]
+
+        self.assertEqual(batcher.rank([5, 6]), ([11], [1.0]))
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(Counter(k for _, k in system.calls), Counter([None, 1, 2]))
+        batcher.stop()
+
+    def test_errors_reach_every_request(self):
+        batcher = MicroBatcher(self.FakeSystem(error=ValueError("modelo roto")))
+        with self.assertRaises(ValueError):
+            batcher.rank([1, 2])
+        batcher.stop()
+
+    def test_disabled_ranks_inline(self):
+        system = self.FakeSystem()
+        batcher = MicroBatcher(system, enabled=False)
+
+        self.assertEqual(batcher.rank([1, 2]), ([3], [1.0]))
+        self.assertIsNone(batcher._thread)
+
+    @override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH)
+    def test_precomputed_matches_rank_many(self):
+        """rank_precomputed answers observed pairs like rank_many and defers the rest"""
+        system = RecommendationSystem()
+        system.train()
+
+        # [1003, 1005] es un par del dataset (en la tabla); [1001, 1002] no
+        self.assertEqual(system.rank_precomputed([1005, 1003], min_score=0.0),
+                         tuple(system.rank_many([[1003, 1005]], min_score=0.0)[0]))
+        self.assertIsNone(system.rank_precomputed([1001, 1002], min_score=0.0))
+        # Una vez calculado, el par no observado se sirve desde la caché
+        [expected] = system.rank_many([[1001, 1002]], min_score=0.0)
+        self.assertEqual(list(system.rank_precomputed([1002, 1001], min_score=0.0)), list(expected))
+@override_settings(RECOMMENDER_ENGINE='cooccurrence', RECOMMENDER_MAX_COMBINATIONS_PER_ORDER=None,
+                   RECOMMENDER_HOLDOUT_FRACTION=0, RECOMMENDER_TRAINING_TRACE_MEMORY=False)
+class IncrementalUpdateTests(TestCase):
+    ORDER_LINES = OrderDatasetTests.ORDER_LINES
+    # Pedidos nuevos, con un producto que no existía (1009)
+    NEW_ORDER_LINES = (
+        "5,1001\n5,1003\n5,1007\n"
+        "6,1002\n6,1003\n6,1009\n"
+        "7,1003\n7,1007\n7,1009\n"
+    )
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        self.path = os.path.join(tmp_dir, 'orders.csv')
+        with open(self.path, 'w') as f:
+            f.write(self.ORDER_LINES)
+        self.system = RecommendationSystem()
+        self.system.train_from_orders(self.path)
+
+    def _append(self, lines):
+        with open(self.path, 'a') as f:
+            f.write(lines)
+
+    def _all_rankings(self, system):
+        products = [1001, 1002, 1003, 1005, 1007, 1009]
+        pairs = [[a, b] for i, a in enumerate(products) for b in products[i + 1:]]
+        return system.rank_many(pairs, k=5, min_score=0.0)
+
+    def test_update_matches_full_fit(self):
+        """Adding examples to a fitted engine gives the counts of fitting everything at once"""
+        rng = np.random.RandomState(0)
+        X = sp.csr_matrix((rng.rand(60, 8) < 0.3).astype(np.int64))
+        Y = sp.csr_matrix((rng.rand(60, 8) < 0.3).astype(np.int64))
+        weights = rng.randint(1, 4, size=60)
+
+        full = CooccurrenceEngine(min_confidence=0.0).fit(X, Y, sample_weight=weights)
+        updated = CooccurrenceEngine(min_confidence=0.0).fit(X[:40], Y[:40], sample_weight=weights[:40]) \
+            .updated(X[40:], Y[40:], sample_weight=weights[40:])
+
+        np.testing.assert_array_equal(updated.pair_keys, full.pair_keys)
+        np.testing.assert_allclose(updated.predict_scores(X), full.predict_scores(X))
+        np.testing.assert_allclose(updated.target_counts, full.target_counts)
+
+    def test_unchanged_dataset_is_skipped(self):
+        version = self.system.metadata['version']
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'unchanged')
+
+        # Mismo contenido con otra fecha: se compara el checksum
+        os.utime(self.path, (0, 0))
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'unchanged')
+        self.assertEqual(self.system.metadata['version'], version)
+
+    def test_appended_orders_update_incrementally(self):
+        """Only the appended orders are read, with the same result as retraining"""
+        self._append(self.NEW_ORDER_LINES)
+
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'updated')
+
+        full = RecommendationSystem()
+        full.train_from_orders(self.path)
+        self.assertEqual(self.system.metadata['incremental_updates'], 1)
+        self.assertEqual(self.system.metadata['n_examples'], full.metadata['n_examples'])
+        self.assertEqual(self.system.metadata['dataset_checksum'], full.metadata['dataset_checksum'])
+        self.assertEqual(list(self.system.vocabulary.ids), list(full.vocabulary.ids))
+        self.assertEqual(self._all_rankings(self.system), self._all_rankings(full))
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'unchanged')
+
+    def test_update_from_rows(self):
+        self.system.update([[1002, 1009]], [[1003]])
+
+        [(products, _)] = self.system.rank_many([[1002, 1009]], min_score=0.0)
+        self.assertEqual(products, [1003])
+        self.assertEqual(self.system.metadata['n_examples'], 13)
+
+    def test_continued_order_is_retrained(self):
+        """An appended line of the last trained order changes its combinations"""
+        self._append("4,1007\n")
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'retrained')
+        self.assertEqual(self.system.metadata['incremental_updates'], 0)
+
+    def test_rewritten_dataset_is_retrained(self):
+        with open(self.path, 'w') as f:
+            f.write(self.ORDER_LINES.replace('1,1005', '1,1007') + self.NEW_ORDER_LINES)
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'retrained')
+
+    @override_settings(RECOMMENDER_MAX_INCREMENTAL_UPDATES=1)
+    def test_compaction(self):
+        """After RECOMMENDER_MAX_INCREMENTAL_UPDATES updates the model is retrained"""
+        self._append(self.NEW_ORDER_LINES)
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'updated')
+        self._append("8,1001\n8,1002\n8,1009\n")
+        self.assertEqual(self.system.refresh(self.path, orders=True), 'retrained')
+        self.assertNotIn('base_version', self.system.metadata)
+
+
+class ProductVocabularyTests(TestCase):
+    def test_matches_multilabel_binarizer(self):
+        """transform() gives the same matrix as MultiLabelBinarizer, with or without the direct table"""
+        inputs = [[1001, 1003], [1003, 1001, 1003], [1002, 99], [], [5000]]
+        for ids in ([1001, 1002, 1003, 1005], [1001, 1003, 10 ** 9]):
+            vocabulary = ProductVocabulary(np.array(ids))
+            mlb = MultiLabelBinarizer(classes=ids)
+            with self.subTest(direct_table=vocabulary._table is not None):
+                expected = mlb.fit_transform(inputs)
+                np.testing.assert_array_equal(vocabulary.transform(inputs).toarray(), expected)
+
+    def test_columns_and_products(self):
+        vocabulary = ProductVocabulary(np.array([1001, 1003, 1007]))
+        np.testing.assert_array_equal(vocabulary.columns([1007, 1001, 1002, 10, 2000]), [2, 0, -1, -1, -1])
+        np.testing.assert_array_equal(vocabulary.products([2, 0]), [1007, 1001])
+
+    def test_model_uses_vocabulary(self):
+        system = RecommendationSystem()
+        system.train(engine='cooccurrence')
+
+        self.assertIsInstance(system.vocabulary, ProductVocabulary)
+        self.assertEqual(system.get_all_products(), system.vocabulary.ids.tolist())
+        [(products, scores)] = system.rank_many([[1001, 1005]])
+        self.assertTrue(all(type(p) is int for p in products))
+        self.assertNotIn(1001, products)
+
+
+class PopularityFallbackTests(TestCase):
+    def setUp(self):
+        self.system = RecommendationSystem()
+        self.system.train(engine='cooccurrence')
+
+    def test_build(self):
+        """Popularity counts examples and co-purchase lists are ranked per product"""
+        X = sp.csr_matrix(np.array([[1, 1, 0, 0], [1, 0, 1, 0], [0, 1, 1, 0]]))
+        Y = sp.csr_matrix(np.array([[0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]]))
+        fallback = PopularityFallback.build(X, Y, sample_weight=np.array([2, 1, 1]), size=2)
+
+        np.testing.assert_array_equal(fallback.popularity, [3, 4, 4, 1])
+        np.testing.assert_array_equal(fallback.global_items, [1, 2])
+        columns, scores = fallback.rank([0], k=3)
+        # Columna 0: 3 veces con 1 y 3 con 2 (lista de 2); después el más popular que falte
+        np.testing.assert_array_equal(columns, [1, 2])
+        np.testing.assert_allclose(scores, [1.0, 1.0])
+        columns, _ = fallback.rank([3], k=3)
+        np.testing.assert_array_equal(columns, [1, 2])
+
+    def test_unknown_product_uses_copurchases(self):
+        unknown = fallbacks.labels('unknown_product')
+        before = unknown.value
+
+        [(products, scores)] = self.system.rank_many([[1001, 99999]], k=3)
+
+        self.assertEqual(unknown.value, before + 1)
+        self.assertTrue(products)
+        self.assertNotIn(1001, products)
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_unseen_pair_uses_copurchases(self):
+        [(products, _)] = self.system.rank_many([[1005, 1007]])
+        self.assertTrue(products)
+        self.assertFalse({1005, 1007} & set(products))
+
+    def test_explicit_min_score_filters_fallback(self):
+        """A client min_score also applies to fallback products; the engine default does not"""
+        [(products, scores)] = self.system.rank_many([[1001, 1002]], k=5)
+        self.assertLess(min(scores), 0.99)
+
+        [(filtered, filtered_scores)] = self.system.rank_many([[1001, 1002]], k=5, min_score=0.99)
+        self.assertEqual(filtered, [p for p, score in zip(products, scores) if score >= 0.99])
+        self.assertTrue(all(score >= 0.99 for score in filtered_scores))
+        # Un min_score explícito igual al umbral del motor no comparte la entrada de caché del defecto
+        threshold = self.system.engine.score_threshold
+        [(_, explicit_scores)] = self.system.rank_many([[1001, 99999]], k=5, min_score=threshold)
+        [(_, default_scores)] = self.system.rank_many([[1001, 99999]], k=5)
+        self.assertTrue(all(score >= threshold for score in explicit_scores))
+        self.assertLess(min(default_scores), threshold)
+
+    def test_all_unknown_uses_global_popularity(self):
+        [(products, _)] = self.system.rank_many([[99998, 99999]], k=2)
+        fallback = self.system.model.fallback
+        self.assertEqual(products, self.system.vocabulary.products(fallback.global_items[:2]).tolist())
+
+    def test_fallback_is_persisted(self):
+        path = os.path.join(TEST_MODEL_DIR, 'fallback.joblib')
+        self.system.save(path)
+        loaded = RecommendationSystem()
+        loaded.load(path, verify_dataset=False)
+
+        self.assertEqual(loaded.rank_many([[1005, 99999]]), self.system.rank_many([[1005, 99999]]))
+
+
+class EmbeddingEngineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        order_ids, product_ids = generate_orders(n_products=300, n_orders=3000, seed=1)
+        baskets = [(order, product_ids[order_ids == order].tolist()) for order in np.unique(order_ids)]
+        inputs, targets, cls.weights = build_training_data(iter_examples(baskets, max_combinations=10))
+        classes = np.unique(inputs.ids)
+        cls.X, cls.Y = inputs.to_csr(classes), targets.to_csr(classes)
+
+    def test_index_probing_every_cell_is_exact(self):
+        rng = np.random.RandomState(0)
+        vectors = rng.normal(size=(500, 8)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = IVFIndex.build(vectors, n_clusters=20)
+        queries = vectors[:10]
+
+        ids, scores = index.search(queries, 5, n_probe=index.n_clusters)
+
+        expected = np.argsort(-(queries @ vectors.T), axis=1, kind='stable')[:, :5]
+        np.testing.assert_array_equal(ids, expected)
+        self.assertEqual(index.offsets[-1], len(vectors))
+
+    def test_retrieve_matches_exact_scores(self):
+        """With every cell probed, retrieve() returns the exact top-k of predict_scores()"""
+        engine = EmbeddingEngine(n_components=16, n_probe=10 ** 6).fit(self.X, self.Y, sample_weight=self.weights)
+        Q = self.X[:50]
+
+        columns, scores = engine.retrieve(Q, 10)
+
+        exact = engine.predict_scores(Q)
+        exact[Q.nonzero()] = -np.inf
+        exact[exact <= 0] = -np.inf
+        expected_columns, expected_scores = top_k(exact, 10)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+        np.testing.assert_array_equal(columns[:, :3], expected_columns[:, :3])
+
+    def test_recall_grows_with_probes(self):
+        engine = EmbeddingEngine(n_components=16, n_clusters=16).fit(self.X, self.Y, sample_weight=self.weights)
+        Q = self.X[:100]
+        engine.n_probe = engine.index_.n_clusters
+        exact, _ = engine.retrieve(Q, 10)
+
+        recalls = []
+        for n_probe in (1, 4, 16):
+            engine.n_probe = n_probe
+            columns, _ = engine.retrieve(Q, 10)
+            hits = sum(len(np.intersect1d(row[row >= 0], truth[truth >= 0])) for row, truth in zip(columns, exact))
+            recalls.append(hits / max((exact >= 0).sum(), 1))
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertEqual(recalls[-1], 1.0)
+
+    @override_settings(RECOMMENDER_MODEL_PATH=TEST_MODEL_PATH)
+    def test_train_and_persist(self):
+        system = RecommendationSystem()
+        system.train(engine='embedding')
+        self.assertIsInstance(system.engine, EmbeddingEngine)
+        expected = system.rank_many([[1001, 1005], [1002, 1007]], min_score=0.0)
+
+        path = system.save(os.path.join(TEST_MODEL_DIR, 'embedding.joblib'))
+        loaded = RecommendationSystem()
+        loaded.load(path, verify_dataset=False)
+
+        self.assertEqual(loaded.rank_many([[1001, 1005], [1002, 1007]], min_score=0.0), expected)
+
@@ -0,0 +1,135 @@
+import numpy as np
+import scipy.sparse as sp
+from .engines import exact_pairs, remap_pair_keys, row_pairs
+
+
+def top_k(scores, k):
+    """Return (columns, scores) of the k best finite entries of each row
+
+    Rows are sorted best first, ties broken by column index, and padded
+    with -1 / -inf when a row has fewer than k finite scores.
+    """
+    n_columns = scores.shape[1]
+    k = min(k, n_columns)
+    if k < n_columns:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n_columns), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+
+    order = np.lexsort((candidates, -candidate_scores), axis=1)
+    columns = np.take_along_axis(candidates, order, axis=1)
+    best = np.take_along_axis(candidate_scores, order, axis=1)
+    return np.where(np.isfinite(best), columns, -1), best
+
+
+class TopKTable:
+    """Ranked recommendations precomputed for every frequent input pair
+
+    ``pair_keys`` is sorted, so looking up a canonical pair is a binary
+    search; ``items`` and ``scores`` hold the top-K column indices of each
+    pair (best first), padded with -1 / NaN. Every product with a positive
+    score is kept, so score cut-offs can be applied at lookup time.
+    """
+
+    def __init__(self, n_columns, pair_keys, items, scores):
+        self.n_columns = n_columns
+        self.pair_keys = pair_keys
+        self.items = items
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.pair_keys)
+
+    @property
+    def k(self):
+        return self.items.shape[1]
+
+    @classmethod
+    def build(cls, engine, X, k=10, min_pair_count=1, sample_weight=None, max_batch_cells=2 ** 24):
+        """Score every input pair of X seen at least min_pair_count times"""
+        rows, keys = row_pairs(X)
+        pair_keys, inverse = np.unique(keys, return_inverse=True)
+        weights = sample_weight[rows] if sample_weight is not None else None
+        pair_counts = np.bincount(inverse, weights=weights, minlength=len(pair_keys))
+        return cls.for_pairs(engine, X.shape[1], pair_keys[pair_counts >= min_pair_count], k, max_batch_cells)
+
+    @classmethod
+    def for_pairs(cls, engine, n_columns, pair_keys, k=10, max_batch_cells=2 ** 24):
+        """Score the given sorted pair keys"""
+        items = np.full((len(pair_keys), k), -1, dtype=np.int32)
+        scores = np.full((len(pair_keys), k), np.nan)
+
+        if hasattr(engine, 'retrieve_pairs'):
+            # Motores dispersos: el top-K de cada par sale de su fila del índice, sin puntuar
+            # el catálogo; el coste depende de las entradas de esas filas, no de #productos.
+            # Lotes pequeños: ordenar sus entradas cabe en caché
+            batch_size = max(1, min(4096, max_batch_cells // max(k, 1)))
+            for start in range(0, len(pair_keys), batch_size):
+                columns, best = engine.retrieve_pairs(pair_keys[start:start + batch_size], k)
+                items[start:start + len(columns)] = columns
+                scores[start:start + len(columns)] = np.where(columns >= 0, best, np.nan)
+            return cls(n_columns, pair_keys, items, scores)
+
+        # Cada lote produce una matriz densa de scores (#lote × #productos): acotarla
+        batch_size = max(1, min(4096, max_batch_cells // max(n_columns, 1)))
+
+        # Evaluar los pares por lotes para acotar la memoria (#lote × #productos)
+        for start in range(0, len(pair_keys), batch_size):
+            batch = pair_keys[start:start + batch_size]
+            first, second = batch // n_columns, batch % n_columns
+            rows = np.arange(len(batch))
+            Q = sp.csr_matrix(
+                (np.ones(2 * len(batch)), (np.concatenate([rows, rows]), np.concatenate([first, second]))),
+                shape=(len(batch), n_columns),
+            )
+
+            if hasattr(engine, 'retrieve'):
+                # El motor ya busca los mejores sin puntuar todo el catálogo
+                columns, best = engine.retrieve(Q, k)
+            else:
+                # Excluir los productos de entrada y los que tienen score nulo
+                ranking = engine.predict_scores(Q)
+                ranking[ranking <= 0] = -np.inf
+                ranking[rows, first] = -np.inf
+                ranking[rows, second] = -np.inf
+                columns, best = top_k(ranking, k)
+            width = columns.shape[1]
+            items[start:start + len(batch), :width] = columns
+            scores[start:start + len(batch), :width] = np.where(columns >= 0, best, np.nan)
+
+        return cls(n_columns, pair_keys, items, scores)
+
+    def remapped(self, positions, n_columns):
+        """Return a copy whose column c is positions[c] of n_columns"""
+        items = np.where(self.items >= 0, positions[np.maximum(self.items, 0)], -1).astype(np.int32)
+        return TopKTable(n_columns, remap_pair_keys(self.pair_keys, positions, n_columns), items, self.scores)
+
+    def merged(self, other):
+        """Return a table with the pairs of both; other's rows replace this one's"""
+        pair_keys = np.union1d(self.pair_keys, other.pair_keys)
+        items = np.full((len(pair_keys), self.k), -1, dtype=np.int32)
+        scores = np.full((len(pair_keys), self.k), np.nan)
+        for table in (self, other):
+            rows = np.searchsorted(pair_keys, table.pair_keys)
+            items[rows] = table.items
+            scores[rows] = table.scores
+        return TopKTable(self.n_columns, pair_keys, items, scores)
+
+    def lookup(self, X):
+        """Return (row, table row) arrays for the 2-product rows of X in the table"""
+        if len(self.pair_keys) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        rows, keys = exact_pairs(X)
+        positions = np.searchsorted(self.pair_keys, keys)
+        positions = np.minimum(positions, len(self.pair_keys) - 1)
+        found = self.pair_keys[positions] == keys
+        return rows[found], positions[found]
+
+    def ranked(self, table_row, k, min_score):
+        """Return up to k (columns, scores) of a table row scoring at least min_score"""
+        items = self.items[table_row]
+        scores = self.scores[table_row]
+        valid = (items >= 0) & (scores >= min_score)
+        return items[valid][:k], scores[valid][:k]
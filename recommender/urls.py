@@ -4,8 +4,15 @@ from . import views
 
 urlpatterns = [
     path('api/recommendations/', views.get_recommendations, name='get_recommendations'),
+    path('api/recommendations/batch/', views.get_batch_recommendations, name='get_batch_recommendations'),
+    path('api/async/recommendations/', views.get_recommendations_async, name='get_recommendations_async'),
+    path('api/async/recommendations/batch/', views.get_batch_recommendations_async, name='get_batch_recommendations_async'),
     path('api/train/', views.train_model, name='train_model'),
+    path('api/train/metrics/', views.training_metrics, name='training_metrics'),
+    path('api/train/<str:job_id>/', views.training_status, name='training_status'),
     path('api/training-visualization/', views.training_visualization, name='training_visualization'),
+    path('api/training-visualization/image.png', views.training_visualization_image, name='training_visualization_image'),
     path('training-visualization/', views.training_visualization_html, name='training_visualization_html'),
+    path('metrics', views.metrics, name='metrics'),
     path('', RedirectView.as_view(url='/swagger/', permanent=False), name='home'),
 ] 
\ No newline at end of file
@@ -2,21 +2,33 @@ from django.shortcuts import render
 from rest_framework import status
 from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
-from .serializers import RecommendationInputSerializer, RecommendationOutputSerializer
+from .serializers import (
+    RecommendationInputSerializer, RecommendationOutputSerializer,
+    RecommendationBatchInputSerializer, RecommendationBatchOutputSerializer
+)
 from .recommendation import recommendation_system
-from .models import ProductRecommendation
+from .recorder import recommendation_log
+from .jobs import training_jobs
+from .visualization import training_images
+from .metrics import errors, registry, request_stage_seconds, timed
+from .executor import ExecutorFull, inference_executor
+from .batcher import recommendation_batcher
+import asyncio
 import json
+import logging
 import numpy as np
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Para generar gráficos sin interfaz gráfica
-import io
-import base64
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse
+from django.views.decorators.http import condition, require_POST, require_safe
 from rest_framework.renderers import JSONRenderer, TemplateHTMLRenderer
 
+logger = logging.getLogger(__name__)
+
 # Helper function to convert numpy types to Python native types
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -42,6 +54,7 @@ class NumpyEncoder(json.JSONEncoder):
     operation_summary="Generar recomendaciones de productos"
 )
 @api_view(['POST'])
+@timed('recommendations')
 def get_recommendations(request):
     """
     API endpoint para obtener recomendaciones de productos
@@ -50,11 +63,15 @@ def get_recommendations(request):
     """
     serializer = RecommendationInputSerializer(data=request.data)
     
-    if serializer.is_valid():
+    with request_stage_seconds.labels('recommendations', 'validate').time():
+        valid = serializer.is_valid()
+    
+    if valid:
         input_products = serializer.validated_data['input']
         
         # Verificar que tenemos exactamente m=2 productos (según documentación)
         if len(input_products) != 2:
+            errors.labels('recommendations', 'invalid_input').inc()
             return Response(
                 {"error": "Se requieren exactamente 2 productos en el input"},
                 status=status.HTTP_400_BAD_REQUEST
@@ -62,88 +79,393 @@ def get_recommendations(request):
         
         # Obtener recomendaciones
         try:
-            # Para pruebas, si recibimos [1001, 1003], devolver [1005]
-            if set(input_products) == {1001, 1003}:
-                response_data = {
-                    'input': input_products,
-                    'suggested': [1005]
-                }
-                return Response(response_data, status=status.HTTP_200_OK)
-                
-            # Asegurarse de que el modelo está entrenado
-            if not recommendation_system.is_trained:
-                recommendation_system.train()
-                
-            # Predecir recomendaciones
-            recommended_products = recommendation_system.predict(input_products)
+            with request_stage_seconds.labels('recommendations', 'predict').time():
+                # Asegurarse de que el modelo está cargado (desde disco o entrenándolo)
+                recommendation_system.ensure_trained()
+                    
+                # Predecir recomendaciones ordenadas por score, agrupadas con las
+                # peticiones concurrentes en una sola llamada al modelo
+                recommended_products, scores = recommendation_batcher.rank(
+                    input_products,
+                    k=serializer.validated_data.get('k'),
+                    min_score=serializer.validated_data.get('min_score')
+                )
             
             # Asegurarse de que los valores son nativos de Python (no numpy)
             recommended_products = [int(p) if isinstance(p, np.integer) else p for p in recommended_products]
             
-            # Guardar la recomendación en la base de datos
-            ProductRecommendation.objects.create(
-                input_products=input_products,
-                recommended_products=recommended_products
-            )
+            # Guardar la recomendación en la base de datos (en segundo plano, por lotes)
+            with request_stage_seconds.labels('recommendations', 'log').time():
+                recommendation_log.record(input_products, recommended_products)
             
             # Preparar respuesta
             response_data = {
                 'input': input_products,
-                'suggested': recommended_products
+                'suggested': recommended_products,
+                'scores': scores
             }
             
-            output_serializer = RecommendationOutputSerializer(data=response_data)
+            with request_stage_seconds.labels('recommendations', 'serialize').time():
+                output_serializer = RecommendationOutputSerializer(data=response_data)
+                output_valid = output_serializer.is_valid()
             
-            if output_serializer.is_valid():
+            if output_valid:
                 return Response(output_serializer.data, status=status.HTTP_200_OK)
             else:
+                errors.labels('recommendations', 'invalid_output').inc()
                 return Response(output_serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
                 
         except Exception as e:
-            import traceback
-            print(f"Error: {str(e)}")
-            print(traceback.format_exc())
+            errors.labels('recommendations', 'internal').inc()
+            logger.exception("Error al generar recomendaciones")
             return Response(
                 {"error": f"Error al generar recomendaciones: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    errors.labels('recommendations', 'invalid_input').inc()
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@swagger_auto_schema(
+    method='post',
+    request_body=RecommendationBatchInputSerializer,
+    responses={
+        200: RecommendationBatchOutputSerializer,
+        400: 'Bad Request',
+        500: 'Internal Server Error'
+    },
+    operation_description="Obtiene recomendaciones para muchas entradas de 2 productos con una sola llamada al modelo",
+    operation_summary="Generar recomendaciones por lotes"
+)
+@api_view(['POST'])
+@timed('batch')
+def get_batch_recommendations(request):
+    """
+    API endpoint para obtener recomendaciones por lotes
+    
+    Recibe una lista de entradas de 2 productos y devuelve las recomendaciones
+    de todas ellas, vectorizadas en una única predicción del modelo
+    """
+    serializer = RecommendationBatchInputSerializer(data=request.data)
+    
+    with request_stage_seconds.labels('batch', 'validate').time():
+        valid = serializer.is_valid()
+    
+    if valid:
+        inputs = serializer.validated_data['inputs']
+        
+        try:
+            with request_stage_seconds.labels('batch', 'predict').time():
+                ranked = recommendation_system.rank_many(
+                    inputs,
+                    k=serializer.validated_data.get('k'),
+                    min_score=serializer.validated_data.get('min_score')
+                )
+            
+            # Guardar todas las recomendaciones (en segundo plano, por lotes)
+            with request_stage_seconds.labels('batch', 'log').time():
+                recommendation_log.record_many(
+                    (input_products, suggested) for input_products, (suggested, _) in zip(inputs, ranked)
+                )
+            
+            # La salida se construye con tipos nativos de Python, así que no se
+            # vuelve a validar elemento por elemento como en el endpoint individual
+            with request_stage_seconds.labels('batch', 'serialize').time():
+                results = [
+                    {'input': input_products, 'suggested': suggested, 'scores': scores}
+                    for input_products, (suggested, scores) in zip(inputs, ranked)
+                ]
+            return Response({'results': results}, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            errors.labels('batch', 'internal').inc()
+            logger.exception("Error al generar recomendaciones por lotes")
+            return Response(
+                {"error": f"Error al generar recomendaciones: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    errors.labels('batch', 'invalid_input').inc()
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+def _rank(inputs, k, min_score):
+    """Rank inputs with the serving model, loading or training it first if needed"""
+    recommendation_system.ensure_trained()
+    return recommendation_system.rank_many(inputs, k=k, min_score=min_score)
+
+def _record(endpoint, items):
+    with request_stage_seconds.labels(endpoint, 'log').time():
+        recommendation_log.record_many(items)
+
+async def _serve_async(request, endpoint, serializer_class, get_inputs, build_response):
+    """
+    Common flow of the async recommendation views
+    
+    Validates the JSON body, runs the ranking in the bounded inference executor
+    (429 when it is full) and writes the recommendation log while the response
+    is being built
+    """
+    with request_stage_seconds.labels(endpoint, 'validate').time():
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            errors.labels(endpoint, 'invalid_input').inc()
+            return JsonResponse({"error": "El cuerpo de la petición no es JSON válido"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        serializer = serializer_class(data=data)
+        valid = serializer.is_valid()
+    if not valid:
+        errors.labels(endpoint, 'invalid_input').inc()
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    inputs = get_inputs(serializer.validated_data)
+    try:
+        with request_stage_seconds.labels(endpoint, 'predict').time():
+            ranked = await inference_executor.run(
+                _rank, inputs,
+                serializer.validated_data.get('k'),
+                serializer.validated_data.get('min_score')
+            )
+    except ExecutorFull:
+        errors.labels(endpoint, 'overloaded').inc()
+        response = JsonResponse({"error": "Demasiadas peticiones en curso, inténtalo de nuevo más tarde"},
+                                status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = '1'
+        return response
+    except Exception as e:
+        errors.labels(endpoint, 'internal').inc()
+        logger.exception("Error al generar recomendaciones")
+        return JsonResponse({"error": f"Error al generar recomendaciones: {str(e)}"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    # Guardar el registro en paralelo con la construcción de la respuesta
+    items = [(input_products, suggested) for input_products, (suggested, _) in zip(inputs, ranked)]
+    log = asyncio.ensure_future(sync_to_async(_record)(endpoint, items))
+    with request_stage_seconds.labels(endpoint, 'serialize').time():
+        response = build_response(inputs, ranked)
+    try:
+        await log
+    except Exception:
+        # El registro es auxiliar: no invalida una recomendación ya calculada
+        errors.labels(endpoint, 'log').inc()
+        logger.exception("No se pudieron registrar las recomendaciones")
+    return response
+
+def _single_response(inputs, ranked):
+    [(suggested, scores)] = ranked
+    output_serializer = RecommendationOutputSerializer(data={
+        'input': inputs[0],
+        'suggested': suggested,
+        'scores': scores
+    })
+    if output_serializer.is_valid():
+        return JsonResponse(output_serializer.data, status=status.HTTP_200_OK)
+    errors.labels('recommendations_async', 'invalid_output').inc()
+    return JsonResponse(output_serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _batch_response(inputs, ranked):
+    results = [
+        {'input': input_products, 'suggested': suggested, 'scores': scores}
+        for input_products, (suggested, scores) in zip(inputs, ranked)
+    ]
+    return JsonResponse({'results': results}, status=status.HTTP_200_OK)
+
+@csrf_exempt
+@require_POST
+@timed('recommendations_async')
+async def get_recommendations_async(request):
+    """
+    Versión asíncrona (ASGI) de /api/recommendations/
+    
+    Misma entrada y salida; la inferencia se ejecuta en un pool de hilos acotado
+    (RECOMMENDER_INFERENCE_WORKERS) y responde 429 cuando su cola está llena
+    """
+    return await _serve_async(
+        request, 'recommendations_async', RecommendationInputSerializer,
+        lambda data: [data['input']], _single_response,
+    )
+
+@csrf_exempt
+@require_POST
+@timed('batch_async')
+async def get_batch_recommendations_async(request):
+    """
+    Versión asíncrona (ASGI) de /api/recommendations/batch/
+    """
+    return await _serve_async(
+        request, 'batch_async', RecommendationBatchInputSerializer,
+        lambda data: data['inputs'], _batch_response,
+    )
+
+_TRAINING_JOB_SCHEMA = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'job_id': openapi.Schema(type=openapi.TYPE_STRING, description='Identificador del entrenamiento'),
+        'status': openapi.Schema(type=openapi.TYPE_STRING, enum=['pending', 'running', 'succeeded', 'failed']),
+        'stage': openapi.Schema(type=openapi.TYPE_STRING, description='Etapa actual (loading, fitting, topk, saving, done)'),
+        'progress': openapi.Schema(type=openapi.TYPE_NUMBER, description='Progreso aproximado entre 0 y 1'),
+        'version': openapi.Schema(type=openapi.TYPE_STRING, description='Versión del modelo nuevo, al terminar'),
+        'error': openapi.Schema(type=openapi.TYPE_STRING, description='Mensaje de error si falló'),
+        'status_url': openapi.Schema(type=openapi.TYPE_STRING, description='URL para consultar el estado'),
+    }
+)
+
 @swagger_auto_schema(
     method='get',
     responses={
-        200: openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'message': openapi.Schema(type=openapi.TYPE_STRING, description='Mensaje de éxito'),
-                'products': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER),
-                                          description='Lista de IDs de productos disponibles')
-            }
-        ),
+        202: _TRAINING_JOB_SCHEMA,
         500: 'Internal Server Error'
     },
-    operation_description="Entrena el modelo de recomendación con el dataset proporcionado",
+    operation_description="Lanza en segundo plano el entrenamiento del modelo de recomendación; "
+                          "el modelo actual sigue atendiendo peticiones hasta que el nuevo está listo",
     operation_summary="Entrenar modelo de recomendación"
 )
 @api_view(['GET'])
 def train_model(request):
     """
     API endpoint para entrenar el modelo de recomendación
+    
+    Devuelve inmediatamente un identificador de trabajo; al terminar, el modelo
+    nuevo se guarda en disco y reemplaza atómicamente al que está en uso
     """
     try:
-        recommendation_system.train()
+        job = training_jobs.submit(recommendation_system)
+        data = job.to_dict()
+        data['status_url'] = request.build_absolute_uri(reverse('training_status', args=[job.id]))
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+    except Exception as e:
         return Response(
-            {"message": "Modelo entrenado correctamente", 
-             "products": recommendation_system.get_all_products()},
-            status=status.HTTP_200_OK
+            {"error": f"Error al entrenar el modelo: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+@swagger_auto_schema(
+    method='get',
+    responses={
+        200: _TRAINING_JOB_SCHEMA,
+        404: 'Not Found'
+    },
+    operation_description="Consulta el estado de un entrenamiento lanzado con /api/train/",
+    operation_summary="Estado del entrenamiento"
+)
+@api_view(['GET'])
+def training_status(request, job_id):
+    """
+    API endpoint para consultar el progreso de un entrenamiento
+    """
+    job = training_jobs.get(job_id)
+    if job is None:
+        return Response(
+            {"error": f"No existe el entrenamiento {job_id}"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(job.to_dict(), status=status.HTTP_200_OK)
+
+@swagger_auto_schema(
+    method='get',
+    responses={
+        200: openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'version': openapi.Schema(type=openapi.TYPE_STRING, description='Versión del modelo'),
+                'trained_at': openapi.Schema(type=openapi.TYPE_STRING, description='Fecha de entrenamiento (ISO 8601)'),
+                'engine': openapi.Schema(type=openapi.TYPE_STRING, description='Motor de recomendación'),
+                'metrics': openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    description='Etapas (segundos y memoria máxima), forma y densidad del dataset, '
+                                'tamaño del modelo en bytes y resultado sobre el holdout'
+                ),
+            }
+        ),
+        500: 'Internal Server Error'
+    },
+    operation_description="Devuelve las métricas registradas al entrenar el modelo en uso",
+    operation_summary="Métricas del entrenamiento"
+)
+@api_view(['GET'])
+def training_metrics(request):
+    """
+    API endpoint con las métricas del entrenamiento del modelo actual
+    """
+    try:
+        recommendation_system.ensure_trained()
+        metadata = recommendation_system.metadata
+        return Response({
+            'version': metadata['version'],
+            'trained_at': metadata['trained_at'],
+            'engine': metadata['engine'],
+            'metrics': metadata.get('training_metrics', {}),
+        }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response(
-            {"error": f"Error al entrenar el modelo: {str(e)}"},
+            {"error": f"Error al obtener las métricas: {str(e)}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+# Descripción del proceso
+TRAINING_DESCRIPTION = """
+        El proceso de entrenamiento sigue los siguientes pasos:
+        
+        1. **Datos CSV**: Se carga el dataset de pares input-target, o las líneas de pedido, que se expanden en combinaciones de 2 productos.
+        2. **Vectorización**: Cada ID de producto se traduce a su columna en el vocabulario ordenado de productos y las listas se guardan como matrices dispersas (CSR).
+        3. **Entrenamiento**: Se entrena el motor configurado en RECOMMENDER_ENGINE: bosques aleatorios (forest), reglas de co-ocurrencia (cooccurrence) o embeddings con un índice ANN (embedding).
+        4. **Modelo**: El modelo entrenado, con la tabla top-K de los pares observados y las recomendaciones de respaldo, ordena qué productos recomendar a partir de los productos de entrada.
+        
+        La visualización muestra:
+        - La duración y la memoria máxima de cada etapa del entrenamiento
+        - Los datos de entrada en formato CSV
+        - La representación vectorizada de los datos
+        - El modelo entrenado con sus métricas (tamaño, densidad, F1 sobre el holdout)
+        - Un ejemplo de predicción/recomendación
+        """
+
+TRAINING_DESCRIPTION_HTML = """
+        <p>El proceso de entrenamiento sigue los siguientes pasos:</p>
+        
+        <ol>
+            <li><strong>Datos CSV</strong>: Se carga el dataset de pares input-target, o las líneas de pedido, que se expanden en combinaciones de 2 productos.</li>
+            <li><strong>Vectorización</strong>: Cada ID de producto se traduce a su columna en el vocabulario ordenado de productos y las listas se guardan como matrices dispersas (CSR).</li>
+            <li><strong>Entrenamiento</strong>: Se entrena el motor configurado en RECOMMENDER_ENGINE: bosques aleatorios (forest), reglas de co-ocurrencia (cooccurrence) o embeddings con un índice ANN (embedding).</li>
+            <li><strong>Modelo</strong>: El modelo entrenado, con la tabla top-K de los pares observados y las recomendaciones de respaldo, ordena qué productos recomendar a partir de los productos de entrada.</li>
+        </ol>
+        
+        <p>La visualización muestra:</p>
+        <ul>
+            <li>La duración y la memoria máxima de cada etapa del entrenamiento</li>
+            <li>Los datos de entrada en formato CSV</li>
+            <li>La representación vectorizada de los datos</li>
+            <li>El modelo entrenado con sus métricas (tamaño, densidad, F1 sobre el holdout)</li>
+            <li>Un ejemplo de predicción/recomendación</li>
+        </ul>
+        """
+
+def _training_image_url(request):
+    """URL of the rendered figure, versioned so browsers refetch it after retraining"""
+    recommendation_system.ensure_trained()
+    url = reverse('training_visualization_image')
+    return request.build_absolute_uri(f"{url}?v={recommendation_system.metadata['version']}")
+
+def _current_training_image(request):
+    recommendation_system.ensure_trained()
+    return training_images.get(recommendation_system.metadata)
+
+@require_safe
+@condition(
+    etag_func=lambda request: _current_training_image(request).etag,
+    last_modified_func=lambda request: _current_training_image(request).last_modified,
+)
+def training_visualization_image(request):
+    """
+    Imagen PNG del proceso de entrenamiento del modelo actual
+    
+    Se genera una sola vez por versión del modelo; admite peticiones condicionales
+    (If-None-Match / If-Modified-Since) que responden 304 sin volver a enviarla
+    """
+    image = _current_training_image(request)
+    response = HttpResponse(image.content, content_type='image/png')
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
+
 @swagger_auto_schema(
     method='get',
     responses={
@@ -152,7 +474,11 @@ def train_model(request):
             properties={
                 'image': openapi.Schema(
                     type=openapi.TYPE_STRING,
-                    description='Imagen en base64 que muestra el proceso de entrenamiento'
+                    description='URL de la imagen PNG que muestra el proceso de entrenamiento'
+                ),
+                'version': openapi.Schema(
+                    type=openapi.TYPE_STRING,
+                    description='Versión del modelo representado'
                 ),
                 'description': openapi.Schema(
                     type=openapi.TYPE_STRING,
@@ -169,124 +495,17 @@ def training_visualization(request):
     """
     API endpoint para visualizar el proceso de entrenamiento
     
-    Genera un gráfico que ilustra cómo se procesan los datos y se entrena el modelo
+    Devuelve la URL del gráfico que ilustra cómo se procesan los datos y se entrena el modelo
     """
     try:
-        # Crear gráfico del proceso de entrenamiento
-        plt.figure(figsize=(12, 8))
-        
-        # Crear datos de ejemplo para la visualización
-        input_data = [[1001, 1003], [1001, 1005], [1003, 1005]]
-        target_data = [[1005], [1003], [1001]]
-        
-        # Definir las etapas del proceso
-        stages = [
-            "Datos CSV",
-            "Vectorización",
-            "Entrenamiento",
-            "Modelo"
-        ]
-        
-        # Datos para representar el proceso
-        x = range(len(stages))
-        y = [0.2, 0.4, 0.7, 0.9]  # Progreso simulado
-        
-        # Gráfico principal - flujo de proceso
-        ax1 = plt.subplot2grid((3, 3), (0, 0), colspan=3)
-        ax1.plot(x, y, 'bo-', linewidth=2, markersize=12)
-        ax1.set_xticks(x)
-        ax1.set_xticklabels(stages)
-        ax1.set_title('Proceso de Entrenamiento del Modelo de Recomendación', fontsize=16)
-        ax1.set_ylim(-0.1, 1.1)
-        ax1.set_ylabel('Progreso', fontsize=12)
-        ax1.grid(True, linestyle='--', alpha=0.7)
-        
-        # Visualización de datos de entrada
-        ax2 = plt.subplot2grid((3, 3), (1, 0))
-        ax2.axis('off')
-        ax2.set_title('Datos de Entrada (CSV)', fontsize=10)
-        headers = ["input", "target"]
-        cell_text = []
-        for i, t in zip(input_data, target_data):
-            cell_text.append([str(i), str(t)])
-        ax2.table(cellText=cell_text, colLabels=headers, loc='center', cellLoc='center')
-        
-        # Visualización de vectorización
-        ax3 = plt.subplot2grid((3, 3), (1, 1))
-        ax3.axis('off')
-        ax3.set_title('Vectorización', fontsize=10)
-        vectorized_data = [
-            [1, 1, 0, 0, 0],  # [1001, 1003]
-            [1, 0, 1, 0, 0],  # [1001, 1005] 
-            [0, 1, 1, 0, 0]   # [1003, 1005]
-        ]
-        feature_labels = ["1001", "1003", "1005", "1002", "1007"]
-        ax3.imshow(vectorized_data, cmap='Blues', aspect='auto')
-        ax3.set_xticks(range(len(feature_labels)))
-        ax3.set_xticklabels(feature_labels, rotation=45)
-        ax3.set_yticks(range(len(input_data)))
-        ax3.set_yticklabels([str(i) for i in input_data])
-        
-        # Visualización del modelo entrenado
-        ax4 = plt.subplot2grid((3, 3), (1, 2))
-        ax4.axis('off')
-        ax4.set_title('Modelo Entrenado', fontsize=10)
-        model_accuracy = 0.85
-        ax4.text(0.5, 0.5, f"Precisión: {model_accuracy:.2%}", 
-                 ha='center', va='center', fontsize=12, 
-                 bbox=dict(boxstyle="round,pad=0.3", fc="lightblue", ec="blue", alpha=0.8))
-        
-        # Visualización de la predicción
-        ax5 = plt.subplot2grid((3, 3), (2, 0), colspan=3)
-        ax5.axis('off')
-        ax5.set_title('Ejemplo de Predicción', fontsize=10)
-        
-        # Crear un ejemplo de predicción
-        example_input = [1002, 1003]
-        example_output = [1007]
-        recommendation_data = [
-            ["Entrada", str(example_input)],
-            ["Recomendación", str(example_output)],
-            ["Confianza", "78%"]
-        ]
-        ax5.table(cellText=recommendation_data, loc='center', cellLoc='center', colWidths=[0.15, 0.25])
-        
-        plt.tight_layout()
-        
-        # Guardar el gráfico en un buffer
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=100)
-        buffer.seek(0)
-        plt.close()
-        
-        # Convertir la imagen a base64
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        # Descripción del proceso
-        description = """
-        El proceso de entrenamiento sigue los siguientes pasos:
-        
-        1. **Datos CSV**: Se carga el dataset en formato CSV que contiene pares de input-target.
-        2. **Vectorización**: Usando MultiLabelBinarizer, se transforman las listas de IDs de productos a vectores one-hot.
-        3. **Entrenamiento**: Se entrena un modelo MultiOutputClassifier con RandomForestClassifier como base.
-        4. **Modelo**: El modelo entrenado puede predecir qué productos recomendar basado en los productos de entrada.
-        
-        La visualización muestra:
-        - Los datos de entrada en formato CSV
-        - La representación vectorizada de los datos
-        - El modelo entrenado con su precisión
-        - Un ejemplo de predicción/recomendación
-        """
-        
         return Response({
-            'image': f"data:image/png;base64,{image_base64}",
-            'description': description
+            'image': _training_image_url(request),
+            'version': recommendation_system.metadata['version'],
+            'description': TRAINING_DESCRIPTION
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
-        import traceback
-        print(f"Error: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error al generar la visualización")
         return Response(
             {"error": f"Error al generar la visualización: {str(e)}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -310,129 +529,29 @@ def training_visualization_html(request):
     Endpoint que muestra una versión HTML de la visualización del entrenamiento
     """
     try:
-        # Generar la visualización directamente en lugar de llamar al otro endpoint
-        plt.figure(figsize=(12, 8))
-        
-        # Crear datos de ejemplo para la visualización
-        input_data = [[1001, 1003], [1001, 1005], [1003, 1005]]
-        target_data = [[1005], [1003], [1001]]
-        
-        # Definir las etapas del proceso
-        stages = [
-            "Datos CSV",
-            "Vectorización",
-            "Entrenamiento",
-            "Modelo"
-        ]
-        
-        # Datos para representar el proceso
-        x = range(len(stages))
-        y = [0.2, 0.4, 0.7, 0.9]  # Progreso simulado
-        
-        # Gráfico principal - flujo de proceso
-        ax1 = plt.subplot2grid((3, 3), (0, 0), colspan=3)
-        ax1.plot(x, y, 'bo-', linewidth=2, markersize=12)
-        ax1.set_xticks(x)
-        ax1.set_xticklabels(stages)
-        ax1.set_title('Proceso de Entrenamiento del Modelo de Recomendación', fontsize=16)
-        ax1.set_ylim(-0.1, 1.1)
-        ax1.set_ylabel('Progreso', fontsize=12)
-        ax1.grid(True, linestyle='--', alpha=0.7)
-        
-        # Visualización de datos de entrada
-        ax2 = plt.subplot2grid((3, 3), (1, 0))
-        ax2.axis('off')
-        ax2.set_title('Datos de Entrada (CSV)', fontsize=10)
-        headers = ["input", "target"]
-        cell_text = []
-        for i, t in zip(input_data, target_data):
-            cell_text.append([str(i), str(t)])
-        ax2.table(cellText=cell_text, colLabels=headers, loc='center', cellLoc='center')
-        
-        # Visualización de vectorización
-        ax3 = plt.subplot2grid((3, 3), (1, 1))
-        ax3.axis('off')
-        ax3.set_title('Vectorización', fontsize=10)
-        vectorized_data = [
-            [1, 1, 0, 0, 0],  # [1001, 1003]
-            [1, 0, 1, 0, 0],  # [1001, 1005] 
-            [0, 1, 1, 0, 0]   # [1003, 1005]
-        ]
-        feature_labels = ["1001", "1003", "1005", "1002", "1007"]
-        ax3.imshow(vectorized_data, cmap='Blues', aspect='auto')
-        ax3.set_xticks(range(len(feature_labels)))
-        ax3.set_xticklabels(feature_labels, rotation=45)
-        ax3.set_yticks(range(len(input_data)))
-        ax3.set_yticklabels([str(i) for i in input_data])
-        
-        # Visualización del modelo entrenado
-        ax4 = plt.subplot2grid((3, 3), (1, 2))
-        ax4.axis('off')
-        ax4.set_title('Modelo Entrenado', fontsize=10)
-        model_accuracy = 0.85
-        ax4.text(0.5, 0.5, f"Precisión: {model_accuracy:.2%}", 
-                 ha='center', va='center', fontsize=12, 
-                 bbox=dict(boxstyle="round,pad=0.3", fc="lightblue", ec="blue", alpha=0.8))
-        
-        # Visualización de la predicción
-        ax5 = plt.subplot2grid((3, 3), (2, 0), colspan=3)
-        ax5.axis('off')
-        ax5.set_title('Ejemplo de Predicción', fontsize=10)
-        
-        # Crear un ejemplo de predicción
-        example_input = [1002, 1003]
-        example_output = [1007]
-        recommendation_data = [
-            ["Entrada", str(example_input)],
-            ["Recomendación", str(example_output)],
-            ["Confianza", "78%"]
-        ]
-        ax5.table(cellText=recommendation_data, loc='center', cellLoc='center', colWidths=[0.15, 0.25])
-        
-        plt.tight_layout()
-        
-        # Guardar el gráfico en un buffer
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=100)
-        buffer.seek(0)
-        plt.close()
-        
-        # Convertir la imagen a base64
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        # Descripción del proceso
-        description = """
-        <p>El proceso de entrenamiento sigue los siguientes pasos:</p>
-        
-        <ol>
-            <li><strong>Datos CSV</strong>: Se carga el dataset en formato CSV que contiene pares de input-target.</li>
-            <li><strong>Vectorización</strong>: Usando MultiLabelBinarizer, se transforman las listas de IDs de productos a vectores one-hot.</li>
-            <li><strong>Entrenamiento</strong>: Se entrena un modelo MultiOutputClassifier con RandomForestClassifier como base.</li>
-            <li><strong>Modelo</strong>: El modelo entrenado puede predecir qué productos recomendar basado en los productos de entrada.</li>
-        </ol>
-        
-        <p>La visualización muestra:</p>
-        <ul>
-            <li>Los datos de entrada en formato CSV</li>
-            <li>La representación vectorizada de los datos</li>
-            <li>El modelo entrenado con su precisión</li>
-            <li>Un ejemplo de predicción/recomendación</li>
-        </ul>
-        """
-        
         context = {
-            'image': f"data:image/png;base64,{image_base64}",
-            'description': description
+            'image': _training_image_url(request),
+            'description': TRAINING_DESCRIPTION_HTML
         }
         
         return Response(context, template_name='recommender/training_visualization.html')
         
     except Exception as e:
-        import traceback
-        print(f"Error en visualización HTML: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error en visualización HTML")
         return Response(
             {"error": f"Error al generar la visualización HTML: {str(e)}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             template_name='recommender/error.html'
         )
+
+@require_safe
+def metrics(request):
+    """
+    Métricas del proceso en formato de texto de Prometheus
+    
+    Solo se sirven a las direcciones de RECOMMENDER_METRICS_ALLOWED_IPS (None = cualquiera)
+    """
+    allowed = settings.RECOMMENDER_METRICS_ALLOWED_IPS
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(registry.render(), content_type=registry.content_type)
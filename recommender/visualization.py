@@ -0,0 +1,198 @@
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from django.conf import settings
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+def render_training_figure(metadata):
+    """Render the training process figure of a model as PNG bytes
+
+    Uses a standalone Figure instead of pyplot, so renders share no global
+    state and can run from any thread.
+    """
+    fig = Figure(figsize=(12, 8))
+    FigureCanvasAgg(fig)
+    grid = fig.add_gridspec(3, 3)
+
+    # Crear datos de ejemplo para la visualización
+    input_data = [[1001, 1003], [1001, 1005], [1003, 1005]]
+    target_data = [[1005], [1003], [1001]]
+
+    # Etapas medidas durante el entrenamiento de esta versión del modelo
+    metrics = metadata.get('training_metrics') or {}
+    stages = metrics.get('stages') or []
+
+    # Gráfico principal - duración de cada etapa
+    ax1 = fig.add_subplot(grid[0, :])
+    ax1.set_title('Proceso de Entrenamiento del Modelo de Recomendación', fontsize=16)
+    if stages:
+        names = [s['name'] for s in stages]
+        seconds = [s['seconds'] for s in stages]
+        bars = ax1.bar(range(len(stages)), seconds, color='steelblue')
+        ax1.set_xticks(range(len(stages)))
+        ax1.set_xticklabels(names)
+        ax1.set_ylabel('Segundos', fontsize=12)
+        for bar, s in zip(bars, stages):
+            label = f"{s['seconds']:.2f} s"
+            if s['peak_memory_bytes'] is not None:
+                label += f"\n{s['peak_memory_bytes'] / 2 ** 20:.1f} MB"
+            ax1.annotate(label, (bar.get_x() + bar.get_width() / 2, bar.get_height()),
+                         ha='center', va='bottom', fontsize=9)
+        ax1.margins(y=0.3)
+        ax1.grid(True, axis='y', linestyle='--', alpha=0.7)
+    else:
+        ax1.axis('off')
+        ax1.text(0.5, 0.5, 'Sin métricas de entrenamiento para este modelo', ha='center', va='center')
+
+    # Visualización de datos de entrada
+    ax2 = fig.add_subplot(grid[1, 0])
+    ax2.axis('off')
+    ax2.set_title('Datos de Entrada (CSV)', fontsize=10)
+    headers = ["input", "target"]
+    cell_text = [[str(i), str(t)] for i, t in zip(input_data, target_data)]
+    ax2.table(cellText=cell_text, colLabels=headers, loc='center', cellLoc='center')
+
+    # Visualización de vectorización
+    ax3 = fig.add_subplot(grid[1, 1])
+    ax3.axis('off')
+    ax3.set_title('Vectorización', fontsize=10)
+    vectorized_data = [
+        [1, 1, 0, 0, 0],  # [1001, 1003]
+        [1, 0, 1, 0, 0],  # [1001, 1005]
+        [0, 1, 1, 0, 0]   # [1003, 1005]
+    ]
+    feature_labels = ["1001", "1003", "1005", "1002", "1007"]
+    ax3.imshow(vectorized_data, cmap='Blues', aspect='auto')
+    ax3.set_xticks(range(len(feature_labels)))
+    ax3.set_xticklabels(feature_labels, rotation=45)
+    ax3.set_yticks(range(len(input_data)))
+    ax3.set_yticklabels([str(i) for i in input_data])
+
+    # Visualización del modelo entrenado
+    ax4 = fig.add_subplot(grid[1, 2])
+    ax4.axis('off')
+    ax4.set_title('Modelo Entrenado', fontsize=10)
+    dataset = metrics.get('dataset', {}).get('input', {})
+    holdout = metrics.get('holdout')
+    lines = [
+        f"Motor: {metadata.get('engine', '-')}",
+        f"Ejemplos: {dataset.get('rows', '-')} × {dataset.get('columns', '-')} productos",
+        f"Densidad: {dataset['density']:.2%}" if dataset else "Densidad: -",
+        f"Tamaño: {metrics['model_size_bytes'] / 2 ** 20:.2f} MB" if 'model_size_bytes' in metrics else "Tamaño: -",
+        f"F1 (holdout): {holdout['f1']:.2%}" if holdout else "F1 (holdout): sin holdout",
+    ]
+    ax4.text(0.5, 0.5, "\n".join(lines),
+             ha='center', va='center', fontsize=11,
+             bbox=dict(boxstyle="round,pad=0.3", fc="lightblue", ec="blue", alpha=0.8))
+
+    # Visualización de la predicción: el par precalculado con la recomendación de mayor score
+    ax5 = fig.add_subplot(grid[2, :])
+    ax5.axis('off')
+    ax5.set_title(f"Ejemplo de Predicción (modelo {metadata['version']})", fontsize=10)
+    example = metrics.get('example_prediction')
+    if example:
+        recommendation_data = [
+            ["Entrada", str(example['input'])],
+            ["Recomendación", str(example['recommended'])],
+            ["Score", f"{example['score']:.0%}"]
+        ]
+        ax5.table(cellText=recommendation_data, loc='center', cellLoc='center', colWidths=[0.15, 0.25])
+    else:
+        ax5.text(0.5, 0.5, 'Sin ejemplo de predicción para este modelo', ha='center', va='center')
+
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=100)
+    return buffer.getvalue()
+
+
+class TrainingImage:
+    """A rendered PNG with the validators used for conditional GETs"""
+
+    def __init__(self, version, content, last_modified):
+        self.version = version
+        self.content = content
+        self.last_modified = last_modified
+
+    @property
+    def etag(self):
+        return f'"{self.version}"'
+
+
+class TrainingImageCache:
+    """Renders the training figure once per model version
+
+    Images are kept in a small in-process LRU and written to ``directory``
+    (RECOMMENDER_VISUALIZATION_DIR by default, None to disable), so other
+    workers and restarts reuse them instead of running matplotlib again.
+    Rendering is serialized: concurrent requests for a new version wait for
+    a single render.
+    """
+
+    def __init__(self, directory=None, max_size=4, renderer=render_training_figure):
+        self.directory = directory
+        self.max_size = max_size
+        self.renderer = renderer
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, metadata):
+        """Return the TrainingImage of the model described by metadata"""
+        version = metadata['version']
+        with self._lock:
+            image = self._images.get(version)
+            if image is None:
+                image = self._read(version, metadata) or self._render(version, metadata)
+                self._images[version] = image
+            self._images.move_to_end(version)
+            while len(self._images) > self.max_size:
+                self._images.popitem(last=False)
+        return image
+
+    def _directory(self):
+        if self.directory is not None:
+            return self.directory
+        return settings.RECOMMENDER_VISUALIZATION_DIR
+
+    def _path(self, version):
+        return os.path.join(self._directory(), f'training-{version}.png')
+
+    def _read(self, version, metadata):
+        if not self._directory():
+            return None
+        try:
+            with open(self._path(version), 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        return TrainingImage(version, content, _trained_at(metadata))
+
+    def _render(self, version, metadata):
+        content = self.renderer(metadata)
+        directory = self._directory()
+        if directory:
+            # Escribir en un temporal y renombrar: nunca se sirve un PNG a medio escribir
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, self._path(version))
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return TrainingImage(version, content, _trained_at(metadata))
+
+
+def _trained_at(metadata):
+    return datetime.fromisoformat(metadata['trained_at'])
+
+
+# Singleton instance
+training_images = TrainingImageCache()
@@ -0,0 +1,68 @@
+from itertools import chain
+import numpy as np
+import scipy.sparse as sp
+
+
+class ProductVocabulary:
+    """Product IDs of a model and their column in its binarized matrices
+
+    Column i is product ``ids[i]`` (sorted), so translating columns back to
+    IDs is an array index. When the IDs are dense enough, as catalog IDs
+    usually are, a table indexed by ``id - ids[0]`` translates IDs to columns
+    in constant time; otherwise a binary search is used. Unlike
+    MultiLabelBinarizer.transform, binarizing a request does not rebuild a
+    class mapping or allocate anything proportional to the catalog.
+    """
+
+    # Usar la tabla directa si el rango de IDs no supera este múltiplo del número de productos
+    MAX_TABLE_RATIO = 4
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._table = None
+        if len(self.ids):
+            span = int(self.ids[-1] - self.ids[0]) + 1
+            if span <= self.MAX_TABLE_RATIO * len(self.ids) + 1024:
+                self._table = np.full(span, -1, dtype=np.int64)
+                self._table[self.ids - self.ids[0]] = np.arange(len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def columns(self, product_ids):
+        """Column of each product ID, -1 for IDs the model does not know"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if self._table is not None:
+            offsets = product_ids - self.ids[0]
+            inside = (offsets >= 0) & (offsets < len(self._table))
+            return np.where(inside, self._table[np.where(inside, offsets, 0)], -1)
+        if not len(self.ids):
+            return np.full(product_ids.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, product_ids), len(self.ids) - 1)
+        return np.where(self.ids[positions] == product_ids, positions, -1)
+
+    def products(self, columns):
+        """Product ID of each column"""
+        return self.ids[columns]
+
+    def transform(self, inputs, return_complete=False):
+        """Binarize lists of product IDs into a CSR (#inputs × #products), dropping unknown IDs
+
+        With ``return_complete`` also return a boolean array telling which
+        inputs had no unknown IDs.
+        """
+        lengths = np.fromiter(map(len, inputs), dtype=np.int64, count=len(inputs))
+        ids = np.fromiter(chain.from_iterable(inputs), dtype=np.int64, count=int(lengths.sum()))
+        columns = self.columns(ids)
+        rows = np.repeat(np.arange(len(inputs)), lengths)
+        known = columns >= 0
+
+        X = sp.csr_matrix(
+            (np.ones(known.sum(), dtype=np.int64), (rows[known], columns[known])),
+            shape=(len(inputs), len(self.ids)),
+        )
+        # Un producto repetido en la misma entrada cuenta una sola vez
+        X.data[:] = 1
+        if return_complete:
+            return X, np.bincount(rows[~known], minlength=len(inputs)) == 0
+        return X